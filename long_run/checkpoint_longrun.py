@@ -0,0 +1,73 @@
+import os
+import json
+import numpy as np
+import gillespie_longrun
+
+"""
+Checkpoint and resume for very long runs.
+
+run_longrun_checkpointed splits a run into segments of checkpoint_steps steps (see GillespieLongRunStreamFun, which carries the
+state of a run from one call to the next) and saves everything after each segment: the current state and time, the number of steps done,
+the time spent in each state, the convergence trace, and the exact state of the random number generator.
+If the process is killed, calling it again with the same checkpoint_path - or resume_longrun with just the path - carries on from the last
+segment, and the final results are identical to a run that was never interrupted.
+"""
+
+#Writes the checkpoint under a temporary name first, so being killed during a save never leaves a broken checkpoint behind
+def save_checkpoint(checkpoint_path, config, state, cumulative, trace_arr, rng):
+    temp_path = checkpoint_path + ".tmp"
+    with open(temp_path, "wb") as checkpoint_file:
+        np.savez(checkpoint_file, config=json.dumps(config), state=json.dumps(state), rng_state=json.dumps(rng.bit_generator.state),
+                 cumulative=cumulative, trace_arr=trace_arr)
+    os.replace(temp_path, checkpoint_path)
+
+#returns the config and run state dictionaries, the cumulative times, the trace array and a generator restored to its saved state
+def load_checkpoint(checkpoint_path):
+    with np.load(checkpoint_path) as data:
+        rng = np.random.default_rng()
+        rng.bit_generator.state = json.loads(str(data["rng_state"]))
+        return json.loads(str(data["config"])), json.loads(str(data["state"])), data["cumulative"], data["trace_arr"], rng
+
+#Returns the master seed saved in checkpoint_path, or None if there's no checkpoint there yet -
+#the simulation program uses this so that a resumed run keeps its original seed
+def saved_master_seed(checkpoint_path):
+    if not os.path.exists(checkpoint_path):
+        return None
+    return load_checkpoint(checkpoint_path)[0]["master_seed"]
+
+#Runs (or continues) a long run of `steps` steps, saving a checkpoint every checkpoint_steps steps.
+#If checkpoint_path already holds a checkpoint of a different run, a ValueError is raised rather than mixing the two.
+#returns the cumulative time spent in each state, the total time, and the filled part of the convergence trace
+def run_longrun_checkpointed(checkpoint_path, steps, param_arr, totalpop, pop_methyl, pop_unmethyl, trace_stride, trace_interval, trace_points,
+                             master_seed, checkpoint_steps=10000000):
+    config = {"steps": int(steps), "param_arr": [float(value) for value in param_arr], "totalpop": int(totalpop), "pop_methyl": int(pop_methyl),
+              "pop_unmethyl": int(pop_unmethyl), "trace_stride": int(trace_stride), "trace_interval": float(trace_interval),
+              "trace_points": int(trace_points), "master_seed": int(master_seed)}
+    if os.path.exists(checkpoint_path):
+        saved_config, state, cumulative, trace_arr, rng = load_checkpoint(checkpoint_path)
+        if saved_config != config:
+            raise ValueError(f"{checkpoint_path} is a checkpoint of a different run - remove it or use another path")
+        print(f"Resuming from {checkpoint_path}: {state['steps_done']} of {steps} steps already done")
+    else:
+        state = {"methylated": int(pop_methyl), "unmethylated": int(pop_unmethyl), "time": 0.0, "steps_done": 0, "trace_count": 0}
+        cumulative = np.zeros(4)
+        trace_arr = np.zeros((trace_points, 4))
+        rng = np.random.default_rng(np.random.SeedSequence(master_seed))
+
+    rate_table = gillespie_longrun.build_rate_table(np.array(param_arr), totalpop)
+    while state["steps_done"] < steps:
+        segment = min(checkpoint_steps, steps - state["steps_done"])
+        methylated, unmethylated, time, trace_count = gillespie_longrun.GillespieLongRunStreamFun(segment, rate_table, totalpop, state["methylated"], state["unmethylated"],
+                                                                                                  state["time"], state["steps_done"], cumulative, trace_stride, trace_interval,
+                                                                                                  trace_arr, state["trace_count"], rng)
+        state = {"methylated": int(methylated), "unmethylated": int(unmethylated), "time": float(time), "steps_done": state["steps_done"] + segment,
+                 "trace_count": int(trace_count)}
+        save_checkpoint(checkpoint_path, config, state, cumulative, trace_arr, rng)
+    return cumulative, state["time"], trace_arr[:state["trace_count"]]
+
+#Resume entry point - continues the run saved in checkpoint_path using only the settings stored in it.
+#returns the same as run_longrun_checkpointed
+def resume_longrun(checkpoint_path, checkpoint_steps=10000000):
+    config = load_checkpoint(checkpoint_path)[0]
+    return run_longrun_checkpointed(checkpoint_path, config["steps"], config["param_arr"], config["totalpop"], config["pop_methyl"], config["pop_unmethyl"],
+                                    config["trace_stride"], config["trace_interval"], config["trace_points"], config["master_seed"], checkpoint_steps)
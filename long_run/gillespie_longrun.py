@@ -1,6 +1,7 @@
 import numpy as np
 from numba import jit
-from numba import njit
+import numba
+from numba import njit, types
 import matplotlib.pyplot as plt
 
 """
@@ -13,46 +14,65 @@ Output: wide variety of descriptive statistics
 
 """
 
-@njit
+#The kernels are cached on disk (in __pycache__), so they are only compiled the first time they are used - later runs load them in a fraction of a second.
+#The kernels that are called from python have explicit signatures, which means they are compiled (or loaded from the cache) as soon as this module is imported,
+#and a run never stops part-way to compile. Integers are int64, rates and times are float64, and arrays must be C-contiguous float64 arrays.
+rng_type = numba.typeof(np.random.default_rng())
+
+@njit(cache=True)
 def maintenance_rate_collaborative(methylated, unmethylated, site_count, param_local):
     hemimethylated = site_count - (methylated + unmethylated)
     return hemimethylated * (param_local[0] + param_local[2]*hemimethylated + param_local[1]*methylated)#r_hm param
     #rate = hemimethylated * (self.params["r_hm"] + self.params["r_hm_h"]*hemimethylated + self.params["r_hm_m"]*methylated)
-@njit
+@njit(cache=True)
 def denovo_rate_collaborative(methylated, unmethylated, site_count, param_local):
     hemimethylated = site_count - (methylated + unmethylated)
     return unmethylated * (param_local[3] + param_local[5]*hemimethylated + param_local[4]*methylated)
     #rate = unmethylated * (self.params["r_uh"] + self.params["r_uh_h"]*hemimethylated + self.params["r_uh_m"]*methylated)
-@njit
+@njit(cache=True)
 def demaintenance_rate_collaborative(methylated, unmethylated, site_count, param_local):
     hemimethylated = site_count - (methylated + unmethylated)
     return hemimethylated * (param_local[9] + param_local[11]*hemimethylated + param_local[10]*unmethylated)
     #rate = hemimethylated * (self.params["r_hu"] + self.params["r_hu_h"]*hemimethylated + self.params["r_hu_u"]*unmethylated)
-@njit
+@njit(cache=True)
 def demethylation_rate_collaborative(methylated, unmethylated, site_count, param_local):
     hemimethylated = site_count - (methylated + unmethylated)
     return methylated * (param_local[6] + param_local[8]*hemimethylated + param_local[7]*unmethylated)
     #rate = methylated * (self.params["r_mh"] + self.params["r_mh_h"]*hemimethylated + self.params["r_mh_u"]*unmethylated)
-@njit
+@njit(cache=True)
 def birth_rate(param_local):
       return param_local[12]
 
-#Helper function that finds the state of the model for given site_count
+#Helper function that finds the integer thresholds used by classify_state for a given site_count.
+#Counts are integers, so "more than 70%" is "count > floor(0.7*site_count)" and "less than 30%" is "count < ceil(0.3*site_count)",
+#with the 70% and 30% taken exactly - computing these once per run means classify_state never has to multiply or compare floats.
+#This is an intentional change from the old float test "count > 0.7*site_count": 0.7*site_count is rounded in floating point, so for some
+#site counts it came out just below the exact value, and a count of exactly 70% was classified as methylated (e.g. 63 of 90 sites, where
+#0.7*90 is 62.999...). Up to 200000 sites, 4676 (site_count, count) pairs are classified differently - none for 100 sites. The exact thresholds
+#also match the switching_times and switching_coordinates kernels, whose old ratio test "count/site_count > 0.7" already gave the exact answer.
+#The 30% test is unchanged for every site count.
+@njit(cache=True)
+def state_thresholds(site_count):
+      upper_threshold = (7 * site_count) // 10
+      lower_threshold = (3 * site_count + 9) // 10
+      return upper_threshold, lower_threshold
+
+#Helper function that finds the state of the model, given the thresholds from state_thresholds
 #1 means >70% methylated, -1 means >70% unmethylated, 0 means somewhere in the middle
 #2 means less than 30% methylated
-@njit
-def classify_state(methylated, unmethylated, site_count):
-      if methylated > 0.7*site_count:
+@njit(cache=True)
+def classify_state(methylated, unmethylated, upper_threshold, lower_threshold):
+      if methylated > upper_threshold:
           return 1
-      elif unmethylated > 0.7*site_count:
+      elif unmethylated > upper_threshold:
           return -1
-      elif unmethylated < 0.3*site_count:
+      elif unmethylated < lower_threshold:
           return 2
       return 0
 
 #This function defines the events that can happen. It's equivalent to the event list in config.py
 #i_local indicates which loop called this function - that is, i_local indicates which event we're doing.
-@njit
+@njit(cache=True)
 def events(methylated, unmethylated, totalpop, i_local, rng_local):
     #maintenance event
     if i_local == 0:
@@ -72,17 +92,50 @@ def events(methylated, unmethylated, totalpop, i_local, rng_local):
         newly_unmethylated = rng_local.binomial(hemimethylated, 0.5)
         return 0, (unmethylated + newly_unmethylated)
 
-@njit
+#Builds a table of cumulative event rates for every (methylated, unmethylated) state.
+#rate_table[m, u, k] holds the summed rates of events 0..k in state (m, u), so rate_table[m, u, 4] is the total rate.
+#Since totalpop is fixed, only the (totalpop+1)(totalpop+2)/2 states with m + u <= totalpop are reachable (5151 for 100 sites),
+#so the table only has to be built once per parameter vector and can be shared by every run that uses those parameters.
+#Unreachable entries (m + u > totalpop) are left at zero.
+@njit((types.float64[::1], types.int64), cache=True)
+def build_rate_table(param_arr, totalpop):
+    rate_table = np.zeros((totalpop+1, totalpop+1, 5))
+    for methylated in range(totalpop+1):
+        for unmethylated in range(totalpop+1-methylated):
+            rate_table[methylated, unmethylated, 0] = maintenance_rate_collaborative(methylated,unmethylated,totalpop,param_arr)
+            rate_table[methylated, unmethylated, 1] = rate_table[methylated, unmethylated, 0] + denovo_rate_collaborative(methylated,unmethylated,totalpop,param_arr)
+            rate_table[methylated, unmethylated, 2] = rate_table[methylated, unmethylated, 1] + demaintenance_rate_collaborative(methylated,unmethylated,totalpop,param_arr)
+            rate_table[methylated, unmethylated, 3] = rate_table[methylated, unmethylated, 2] + demethylation_rate_collaborative(methylated,unmethylated,totalpop,param_arr)
+            rate_table[methylated, unmethylated, 4] = rate_table[methylated, unmethylated, 3] + birth_rate(param_arr)
+    return rate_table
+
+#Picks the event that happens in state (methylated, unmethylated) with a short linear search through the cumulative rates
+#target should be a uniform random number scaled by the total rate of the state
+@njit(cache=True)
+def select_event(rate_table, methylated, unmethylated, target):
+    event_number = 0
+    while event_number < 4 and target >= rate_table[methylated, unmethylated, event_number]:
+        event_number += 1
+    return event_number
+
+@njit((types.int64, types.float64[::1], types.int64, types.int64, types.int64, rng_type), cache=True)
 def GillespieLongRunFun(steps, param_arr, totalpop, pop_methyl, pop_unmethyl, rng):
-    methylated_arr = np.zeros(steps)
-    unmethylated_arr = np.zeros(steps)
+    #counts are stored as int16 (2 bytes each instead of 8), which is plenty for any realistic number of sites
+    if totalpop > 32767:
+        raise ValueError("the long run stores counts as int16, so totalpop must be at most 32767")
+    methylated_arr = np.zeros(steps, dtype=np.int16)
+    unmethylated_arr = np.zeros(steps, dtype=np.int16)
     time_arr = np.zeros(steps) 
     #set the first elements of the methylated/unmethylated arrays to the starting values
     methylated_arr[0] = pop_methyl 
     unmethylated_arr[0] = pop_unmethyl
     #set the first element of the time array to zero, so that it stays synced up with the (un)methylated arrays
     time_arr[0] = 0
-    rates = np.zeros(5)
+    #the parameters never change during a long run, so the rates of every state are computed once up front
+    rate_table = build_rate_table(param_arr, totalpop)
+    upper_threshold, lower_threshold = state_thresholds(totalpop)
+    methylated = pop_methyl
+    unmethylated = pop_unmethyl
     #define our four amounts of cumulative time spent in different areas. By the end these will sum to time_arr[-1]
     methyl_cumulative = 0
     unmethyl_cumulative = 0
@@ -98,20 +151,15 @@ def GillespieLongRunFun(steps, param_arr, totalpop, pop_methyl, pop_unmethyl, rn
     #main loop - each generation or step is one iteration of this loop
     for i in range(1, steps): #start at 1, since the first step is given by pop_methyl/pop_unmethyl
 
-        #find the rates of each event for the current parameters
-        rates[0] = maintenance_rate_collaborative(methylated_arr[i-1],unmethylated_arr[i-1],totalpop,param_arr)
-        rates[1] = denovo_rate_collaborative(methylated_arr[i-1],unmethylated_arr[i-1],totalpop,param_arr)
-        rates[2] = demaintenance_rate_collaborative(methylated_arr[i-1],unmethylated_arr[i-1],totalpop,param_arr)
-        rates[3] = demethylation_rate_collaborative(methylated_arr[i-1],unmethylated_arr[i-1],totalpop,param_arr)
-        rates[4] = birth_rate(param_arr)
-        rate_sum = np.sum(rates)
+        #look up the total rate of the current state
+        rate_sum = rate_table[methylated, unmethylated, 4]
 
         #find the expected wait for an event to happen
         tau = rng.exponential(scale = 1/rate_sum)
         time_arr[i] = tau + time_arr[i-1]
 
         #calculate the time increment after calculating tau but BEFORE calculating the next step
-        curr_state = classify_state(methylated_arr[i-1], unmethylated_arr[i-1], totalpop)
+        curr_state = classify_state(methylated, unmethylated, upper_threshold, lower_threshold)
         if curr_state == 1:
             methyl_cumulative += tau
         elif curr_state == -1:
@@ -126,20 +174,70 @@ def GillespieLongRunFun(steps, param_arr, totalpop, pop_methyl, pop_unmethyl, rn
         unmethyl_cumulative_prop[i] = unmethyl_cumulative/time_arr[i]
         sortamethyl_cumulative_prop[i] = sortamethl_cumulative/time_arr[i]
 
-        #normalize the rates to be within (0,1)
-        normalized_rates= rates / rate_sum
-
-        #select which event happens by comparing the normalized rates to a random variable
-        sum_so_far = 0
-        uniform = rng.uniform()
-        for event_number in range(5):
-            if uniform < normalized_rates[event_number] + sum_so_far:
-                methylated_arr[i], unmethylated_arr[i] = events(methylated_arr[i-1], unmethylated_arr[i-1], totalpop,event_number,rng)
-                break
-            else:
-                sum_so_far += normalized_rates[event_number]
+        #select which event happens by searching the cumulative rates with a scaled random variable
+        event_number = select_event(rate_table, methylated, unmethylated, rng.uniform() * rate_sum)
+        methylated, unmethylated = events(methylated, unmethylated, totalpop,event_number,rng)
+        methylated_arr[i] = methylated
+        unmethylated_arr[i] = unmethylated
 
 
     #we should reach this return point on every run
     return (methyl_cumulative, unmethyl_cumulative, middle_cumulative, time_arr, methyl_cumulative_prop, unmethyl_cumulative_prop, sortamethyl_cumulative_prop)
 
+
+#Streaming version of GillespieLongRunFun - instead of storing every step, it only keeps running totals,
+#so memory use stays constant no matter how many steps are taken (1e10+ steps are fine).
+#The state of the run is passed in and handed back, so a very long run can also be split into several calls:
+#   methylated, unmethylated, time - the current state of the run (use pop_methyl, pop_unmethyl, 0 for a new run)
+#   steps_done - how many steps have already been taken in earlier calls (0 for a new run)
+#   cumulative - array of length 4 holding the time spent methylated, unmethylated, in the middle and sort-of methylated.
+#                it is updated in place, so pass np.zeros(4) for a new run
+#The convergence trace is down-sampled into trace_arr, an array of shape (capacity, 4). Each row holds the time
+#and the cumulative proportions of time spent methylated, unmethylated and sort-of methylated at that point.
+#A row is written every trace_stride steps, or, if trace_interval is above 0, every trace_interval units of simulated time.
+#Writing starts at row trace_count and stops once the array is full.
+#returns the new methylated, unmethylated, time and trace_count
+@njit((types.int64, types.float64[:, :, ::1], types.int64, types.int64, types.int64, types.float64, types.int64, types.float64[::1], types.int64, types.float64, types.float64[:, ::1], types.int64, rng_type), cache=True)
+def GillespieLongRunStreamFun(steps, rate_table, totalpop, methylated, unmethylated, time, steps_done, cumulative, trace_stride, trace_interval, trace_arr, trace_count, rng):
+    upper_threshold, lower_threshold = state_thresholds(totalpop)
+    capacity = trace_arr.shape[0]
+    #for time-based tracing, find the next multiple of trace_interval we have to reach
+    next_trace_time = 0.0
+    if trace_interval > 0:
+        next_trace_time = (np.floor(time / trace_interval) + 1) * trace_interval
+
+    for i in range(steps_done + 1, steps_done + steps + 1):
+        rate_sum = rate_table[methylated, unmethylated, 4]
+        tau = rng.exponential(scale = 1/rate_sum)
+        time += tau
+
+        #add the time increment to the state we were in BEFORE calculating the next step
+        curr_state = classify_state(methylated, unmethylated, upper_threshold, lower_threshold)
+        if curr_state == 1:
+            cumulative[0] += tau
+        elif curr_state == -1:
+            cumulative[1] += tau
+        elif curr_state == 2:
+            cumulative[3] += tau
+        else:
+            cumulative[2] += tau
+
+        event_number = select_event(rate_table, methylated, unmethylated, rng.uniform() * rate_sum)
+        methylated, unmethylated = events(methylated, unmethylated, totalpop,event_number,rng)
+
+        #record a point on the convergence trace if it's due
+        if trace_count < capacity:
+            if trace_interval > 0:
+                due = time >= next_trace_time
+                if due:
+                    next_trace_time = (np.floor(time / trace_interval) + 1) * trace_interval
+            else:
+                due = i % trace_stride == 0
+            if due:
+                trace_arr[trace_count, 0] = time
+                trace_arr[trace_count, 1] = cumulative[0] / time
+                trace_arr[trace_count, 2] = cumulative[1] / time
+                trace_arr[trace_count, 3] = cumulative[3] / time
+                trace_count += 1
+
+    return methylated, unmethylated, time, trace_count
@@ -0,0 +1,108 @@
+import numpy as np
+import scipy.sparse as sparse
+import scipy.sparse.linalg as sparse_linalg
+import scipy.stats as stats
+import gillespie_longrun
+
+"""
+Exact long-run proportions from the stationary distribution of the chain.
+
+With a fixed number of sites, the long run is a continuous-time Markov chain on the (totalpop+1)(totalpop+2)/2 states
+(methylated, unmethylated) with methylated + unmethylated <= totalpop. Over a very long run, the fraction of time spent in each
+state converges to the chain's stationary distribution pi, which solves pi Q = 0 with the entries of pi summing to 1.
+Adding pi up over the classify_state regions gives the same four proportions as simulation_longrun.py,
+without having to take 1e8 steps - and we get the whole stationary landscape over (methylated, unmethylated) as well.
+
+The generator is built from the same rate table as the simulation (gillespie_longrun.build_rate_table).
+"""
+
+#Lists every reachable state of the chain.
+#returns the methylated and unmethylated counts of each state, and an index table where index_table[m, u] is the number of state (m, u)
+#(-1 for the unreachable m + u > totalpop)
+def state_space(totalpop):
+    methylated, unmethylated = np.nonzero(np.add.outer(np.arange(totalpop+1), np.arange(totalpop+1)) <= totalpop)
+    index_table = np.full((totalpop+1, totalpop+1), -1, dtype=np.int64)
+    index_table[methylated, unmethylated] = np.arange(len(methylated))
+    return methylated, unmethylated, index_table
+
+#Builds the generator matrix Q of the chain for one parameter array, from the same rate table the simulation uses.
+#Q[i, j] is the rate of jumping from state i to state j, and each diagonal entry is minus the total rate of leaving that state.
+#Births that leave the state unchanged (no methylated sites and no newly unmethylated sites) don't affect the chain, so they are left out.
+#returns Q as a sparse CSR matrix, with states numbered as in state_space
+def build_generator(param_arr, totalpop):
+    methylated, unmethylated, index_table = state_space(totalpop)
+    rate_table = gillespie_longrun.build_rate_table(param_arr, totalpop)
+    #turn the cumulative rates back into the rate of each event
+    rates = np.diff(rate_table[methylated, unmethylated], prepend=0, axis=1)
+    hemimethylated = totalpop - (methylated + unmethylated)
+    state_count = len(methylated)
+    rows = []
+    cols = []
+    values = []
+
+    #the four single-site events - (event number, change in methylated, change in unmethylated)
+    for event_number, methyl_change, unmethyl_change in [(0, 1, 0), (1, 0, -1), (2, 0, 1), (3, -1, 0)]:
+        possible = rates[:, event_number] > 0
+        rows.append(np.nonzero(possible)[0])
+        cols.append(index_table[methylated[possible] + methyl_change, unmethylated[possible] + unmethyl_change])
+        values.append(rates[possible, event_number])
+
+    #birth events - every methylated site becomes hemimethylated, and each hemimethylated site becomes unmethylated with probability 0.5
+    newly_unmethylated_counts = hemimethylated + 1
+    birth_rows = np.repeat(np.arange(state_count), newly_unmethylated_counts)
+    newly_unmethylated = np.arange(birth_rows.size) - np.repeat(np.cumsum(newly_unmethylated_counts) - newly_unmethylated_counts, newly_unmethylated_counts)
+    birth_cols = index_table[0, unmethylated[birth_rows] + newly_unmethylated]
+    birth_values = rates[birth_rows, 4] * stats.binom.pmf(newly_unmethylated, hemimethylated[birth_rows], 0.5)
+    keep = (birth_rows != birth_cols) & (birth_values > 0)
+    rows.append(birth_rows[keep])
+    cols.append(birth_cols[keep])
+    values.append(birth_values[keep])
+
+    rows = np.concatenate(rows)
+    cols = np.concatenate(cols)
+    values = np.concatenate(values)
+    #the diagonal makes every row sum to zero
+    exit_rates = np.bincount(rows, weights=values, minlength=state_count)
+    rows = np.concatenate([rows, np.arange(state_count)])
+    cols = np.concatenate([cols, np.arange(state_count)])
+    values = np.concatenate([values, -exit_rates])
+    return sparse.csr_matrix((values, (rows, cols)), shape=(state_count, state_count))
+
+#Finds the stationary distribution pi of a generator (pi Q = 0, entries summing to 1).
+#method "direct" does one sparse solve, with one of the (redundant) equations replaced by the normalization.
+#method "power" runs power iteration on the uniformized chain I + Q/rate until the change per iteration is below tolerance,
+#which is slower but never needs a factorization.
+def stationary_distribution(generator, method="direct", tolerance=1e-12, max_iterations=10**7):
+    state_count = generator.shape[0]
+    if method == "direct":
+        equations = sparse.vstack([generator.T.tocsr()[:-1], sparse.csr_matrix(np.ones((1, state_count)))])
+        right_side = np.zeros(state_count)
+        right_side[-1] = 1
+        stationary = sparse_linalg.spsolve(equations.tocsc(), right_side)
+    elif method == "power":
+        uniformization_rate = 1.05 * np.max(-generator.diagonal())
+        jump_transpose = (sparse.identity(state_count, format='csr') + generator / uniformization_rate).T.tocsr()
+        stationary = np.full(state_count, 1 / state_count)
+        for iteration in range(max_iterations):
+            next_stationary = jump_transpose @ stationary
+            if np.abs(next_stationary - stationary).sum() < tolerance:
+                stationary = next_stationary
+                break
+            stationary = next_stationary
+    else:
+        raise ValueError(f"unknown method {method!r}, use 'direct' or 'power'")
+    #clean up tiny negative values from round-off
+    stationary = np.maximum(stationary, 0)
+    return stationary / stationary.sum()
+
+#Finds the long-run proportions of time spent in each classify_state region, and the whole stationary landscape.
+#returns the methylated, unmethylated, middle and sort-of methylated proportions (in the same order as simulation_longrun.py prints them),
+#and a (totalpop+1, totalpop+1) array where landscape[m, u] is the long-run proportion of time spent in state (m, u) (NaN for unreachable states)
+def stationary_proportions(param_arr, totalpop, method="direct"):
+    methylated, unmethylated, index_table = state_space(totalpop)
+    stationary = stationary_distribution(build_generator(param_arr, totalpop), method)
+    upper_threshold, lower_threshold = gillespie_longrun.state_thresholds(totalpop)
+    states = np.where(methylated > upper_threshold, 1, np.where(unmethylated > upper_threshold, -1, np.where(unmethylated < lower_threshold, 2, 0)))
+    landscape = np.full((totalpop+1, totalpop+1), np.nan)
+    landscape[methylated, unmethylated] = stationary
+    return stationary[states == 1].sum(), stationary[states == -1].sum(), stationary[states == 0].sum(), stationary[states == 2].sum(), landscape
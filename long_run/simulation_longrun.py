@@ -1,7 +1,8 @@
 import numpy as np
 import gillespie_longrun as gillespie_longrun
+import markov_longrun
+import checkpoint_longrun
 import matplotlib.pyplot as plt
-import numba
 
 """
 Performs a single, very long, gillespie run to see what proportion of time is spent in each state - 
@@ -9,17 +10,38 @@ Performs a single, very long, gillespie run to see what proportion of time is sp
 "sort-of methylated" refers to a state that is less than 30% unmethylated - in other words,
 it is a state where 70% of the sites are either methylated or hemimethylated.
 
-There are no alternate output options for this program - just edit the parameters and run it to get a graph.
+Just edit the parameters and run it to get a graph. The only alternate output option is use_stationary_solver,
+which skips the simulation and solves for the long-run proportions exactly (see markov_longrun.py).
 """
 
 
 #-----------parameters - edit here-----------
-#number of steps that the gillespie algorithm will take (large values can cause memory issues, starting around 1,000,000,000)
+#number of steps that the gillespie algorithm will take - the run is streamed, so memory use doesn't grow with this number
 trial_max_length = 100000000
+#how many points to keep for the convergence graph - the cumulative proportions are sampled every trial_max_length/trace_points steps
+trace_points = 10000
+#set this above 0 to sample the graph every trace_interval units of simulated time instead (at most trace_points samples are kept)
+trace_interval = 0
+#master seed for the random number generator - leave as None for a new one, or set it to a printed seed to reproduce a run
+master_seed = None
+#checkpointing - set checkpoint_path to a file name to save the run every checkpoint_steps steps. If the program is stopped,
+#running it again with the same checkpoint_path carries on from the last checkpoint (with the seed saved there) - see checkpoint_longrun.py
+checkpoint_path = None
+checkpoint_steps = 10000000
+#set to True to skip the simulation and solve for the long-run proportions exactly instead (see markov_longrun.py) -
+#this takes well under a second, and also shows how the time is spread over every (methylated, unmethylated) state
+use_stationary_solver = False
 #define starting population
 totalpop = 100
 methylatedpop = 50
 unmethylatedpop = 50
+#-----------run config-----------
+#when this program is started by run.py, the values from the run config file replace the ones above (see run.py)
+#only the names in the parameters block can be set
+parameter_names = ("trial_max_length", "trace_points", "trace_interval", "master_seed", "checkpoint_path", "checkpoint_steps",
+                   "use_stationary_solver", "totalpop", "methylatedpop", "unmethylatedpop")
+if "RUN_CONFIG" in globals():
+    globals().update(RUN_CONFIG.parameters(parameter_names))
 #-----------Rates Dictionary---------
 
 default_parameters = {"r_hm": 0.5,          #0
@@ -39,6 +61,10 @@ default_parameters = {"r_hm": 0.5,          #0
                       "birth_rate": 1     #12
 }
 
+#rates from the run config replace the defaults above
+if "RUN_CONFIG" in globals():
+    default_parameters.update(RUN_CONFIG.rates(default_parameters))
+
 #This dictionary just matches each parameter to its place in the list.
 default_indices = {
     "r_hm": 0,          
@@ -61,63 +87,91 @@ default_indices = {
 parameter_labels = ["r_hm", "r_hm_m","r_hm_h", "r_uh", "r_uh_m", "r_uh_h", "r_mh", "r_mh_u", "r_mh_h", "r_hu", "r_hu_u", "r_hu_h", "birth_rate"]
 default_arr = np.array([default_parameters[key] for key in parameter_labels])
 
-#-----------simulation-----------
-@numba.jit()
-def main(rng):
-        methyl_time, unmethyl_time, middle_time, time_arr, methyl_cumulative_prop, unmethyl_cumulative_prop, sortamethyl_cumulative_prop = gillespie_longrun.GillespieLongRunFun(trial_max_length, default_arr, totalpop, methylatedpop, unmethylatedpop, rng)
-        return methyl_time,unmethyl_time,middle_time, time_arr, methyl_cumulative_prop, unmethyl_cumulative_prop, sortamethyl_cumulative_prop
+#-----------stationary solver-----------
+if use_stationary_solver:
+    methylated_prop, unmethylated_prop, time_in_middle_prop, sortamethyl_prop, landscape = markov_longrun.stationary_proportions(default_arr, totalpop)
+    print('Proportions (stationary distribution):')
+    print(f"Methylated : {methylated_prop}, Unmethylated: {unmethylated_prop}, middle: {time_in_middle_prop}, middle (<30% unmethylated) {sortamethyl_prop}")
+    print(f"Sum of proportions: {methylated_prop + unmethylated_prop + time_in_middle_prop + sortamethyl_prop}")
+
+    #plot the long-run proportion of time spent in every state
+    plt.title(f'Methylated : {methylated_prop:.3f}, Unmethylated: {unmethylated_prop:.3f},\n middle: {time_in_middle_prop:.3f}, middle (<30% unmethylated) {sortamethyl_prop:.3f} \n stationary distribution with {totalpop} sites',fontsize=10)
+    plt.imshow(landscape.T, origin='lower', cmap='viridis')
+    plt.colorbar(label='long-run proportion of time spent')
+    plt.xlabel('methylated sites')
+    plt.ylabel('unmethylated sites')
+    plt.show()
+
+else:
+    #-----------simulation-----------
+    #the graph samples every trace_stride steps, unless we sample by simulated time instead
+    trace_stride = max(1, trial_max_length // trace_points)
+
+    def main(rng):
+            if checkpoint_path is not None:
+                return checkpoint_longrun.run_longrun_checkpointed(checkpoint_path, trial_max_length, default_arr, totalpop, methylatedpop, unmethylatedpop,
+                                                                   trace_stride, trace_interval, trace_points, master_seed, checkpoint_steps)
+            #the rates only depend on the parameters, so they are computed once for the whole run
+            rate_table = gillespie_longrun.build_rate_table(default_arr, totalpop)
+            #time spent methylated, unmethylated, in the middle and sort-of methylated - updated by the simulation as it runs
+            cumulative = np.zeros(4)
+            trace_arr = np.zeros((trace_points, 4))
+            final_methyl, final_unmethyl, total_time, trace_count = gillespie_longrun.GillespieLongRunStreamFun(trial_max_length, rate_table, totalpop, methylatedpop, unmethylatedpop, 0.0, 0, cumulative, trace_stride, trace_interval, trace_arr, 0, rng)
+            return cumulative, total_time, trace_arr[:trace_count]
     
-#-----------setup-----------
-
-#create a random number generator - this generator can be seeded if desired
-generator = np.random.default_rng()
-
-#-----------Call simulation-----------
-#call our gillespie algorithm and save the raw data
-methylated_time, unmethylated_time, time_in_middle, time_arr, methyl_cumulative_prop, unmethyl_cumulative_prop, sortamethyl_cumulative_prop = main(generator)
-
-#print the amount of time that our simulation lasted
-total_time = time_arr[-1]
-print(f'Check that everything adds up: \nTotal time: {total_time}')
-
-#calculate the proportion of time that we spent in each state
-total_prop = methyl_cumulative_prop[-1] + unmethyl_cumulative_prop[-1] + sortamethyl_cumulative_prop[-1]
-methylated_prop = methylated_time/total_time
-unmethylated_prop = unmethylated_time/total_time
-time_in_middle_prop = time_in_middle/total_time
-proportions = [methylated_prop,unmethylated_prop,time_in_middle_prop]
-labels = ['methylated_prop','unmethylated_prop','time_in_middle_prop']
-
-#print out the proportions of time that we spent in each state
-print('Proportions:')
-print(f"Methylated : {methylated_prop}, Unmethylated: {unmethylated_prop}, middle: {time_in_middle_prop}, middle (<30% unmethylated) {sortamethyl_cumulative_prop[-1]}")
-print(f"Sum of proportions: {methylated_prop + unmethylated_prop + time_in_middle_prop + sortamethyl_cumulative_prop[-1]}")
-print('Times:')
-print(f"Methylated : {methylated_time}, Unmethylated: {unmethylated_time}, middle: {time_in_middle}, middle (<30% unmethylated) {total_time * sortamethyl_cumulative_prop[-1]}")
-
-#thin out our data by saving only every 100th observation - this makes it easier to graph
-xes = list(range(trial_max_length//100)) 
-#create the arrays that we will use
-methyl_cumulative_prop_thinned = np.zeros(trial_max_length//100)
-unmethyl_cumulative_prop_thinned = np.zeros(trial_max_length//100)
-sortamethyl_cumulative_prop_thinned = np.zeros(trial_max_length//100)
-middle_cumulative_prop_thinned = np.zeros(trial_max_length//100)
-#populate the arrays by picking every 100th number
-for i in range(trial_max_length//100):
-      methyl_cumulative_prop_thinned[i] = methyl_cumulative_prop[i*100]
-      unmethyl_cumulative_prop_thinned[i] = unmethyl_cumulative_prop[i*100]
-      sortamethyl_cumulative_prop_thinned[i] = sortamethyl_cumulative_prop[i*100]
-      middle_cumulative_prop_thinned[i] = 1 - (methyl_cumulative_prop_thinned[i] + unmethyl_cumulative_prop_thinned[i] + sortamethyl_cumulative_prop_thinned[i])
-
-#plot our results
-plt.title(f'Methylated : {methylated_prop:.3f}, Unmethylated: {unmethylated_prop:.3f},\n middle: {time_in_middle_prop:.3f}, middle (<30% unmethylated) {sortamethyl_cumulative_prop[-1]:.3f} \n simulated with {totalpop} sites over {trial_max_length} iterations',fontsize=10)
-plt.xlabel('x-axis samples every hundredth point to improve readability')
-plt.ylabel('cumulative proportion of time spent')
-plt.plot(xes, methyl_cumulative_prop_thinned,label="Methylated")
-plt.plot(xes, unmethyl_cumulative_prop_thinned,label="Unmethylated")
-plt.plot(xes, sortamethyl_cumulative_prop_thinned,label="Sort of methylated")
-plt.plot(xes, middle_cumulative_prop_thinned,label="Transitionary")
-plt.legend(loc='upper right')
-plt.show()
-      
-        
\ No newline at end of file
+    #-----------setup-----------
+
+    #create a random number generator from the master seed, and print the seed so the run can be reproduced
+    #a run that is being resumed keeps the seed saved in its checkpoint
+    if master_seed is None and checkpoint_path is not None:
+        master_seed = checkpoint_longrun.saved_master_seed(checkpoint_path)
+    if master_seed is None:
+        master_seed = np.random.SeedSequence().entropy
+    print("Master seed: ", master_seed)
+    generator = np.random.default_rng(np.random.SeedSequence(master_seed))
+
+    #-----------Call simulation-----------
+    #call our gillespie algorithm and save the running totals and the convergence trace
+    cumulative, total_time, trace_arr = main(generator)
+    methylated_time, unmethylated_time, time_in_middle, sortamethyl_time = cumulative
+
+    #print the amount of time that our simulation lasted
+    print(f'Check that everything adds up: \nTotal time: {total_time}')
+
+    #calculate the proportion of time that we spent in each state
+    methylated_prop = methylated_time/total_time
+    unmethylated_prop = unmethylated_time/total_time
+    time_in_middle_prop = time_in_middle/total_time
+    sortamethyl_prop = sortamethyl_time/total_time
+    proportions = [methylated_prop,unmethylated_prop,time_in_middle_prop]
+    labels = ['methylated_prop','unmethylated_prop','time_in_middle_prop']
+
+    #print out the proportions of time that we spent in each state
+    print('Proportions:')
+    print(f"Methylated : {methylated_prop}, Unmethylated: {unmethylated_prop}, middle: {time_in_middle_prop}, middle (<30% unmethylated) {sortamethyl_prop}")
+    print(f"Sum of proportions: {methylated_prop + unmethylated_prop + time_in_middle_prop + sortamethyl_prop}")
+    print('Times:')
+    print(f"Methylated : {methylated_time}, Unmethylated: {unmethylated_time}, middle: {time_in_middle}, middle (<30% unmethylated) {sortamethyl_time}")
+
+    #the trace is already down-sampled by the simulation, so it can be graphed directly
+    methyl_cumulative_prop_thinned = trace_arr[:,1]
+    unmethyl_cumulative_prop_thinned = trace_arr[:,2]
+    sortamethyl_cumulative_prop_thinned = trace_arr[:,3]
+    middle_cumulative_prop_thinned = 1 - (methyl_cumulative_prop_thinned + unmethyl_cumulative_prop_thinned + sortamethyl_cumulative_prop_thinned)
+    if trace_interval > 0:
+          xes = trace_arr[:,0]
+          x_label = f'simulated time, sampled every {trace_interval} time units'
+    else:
+          xes = trace_stride * np.arange(1, len(trace_arr) + 1)
+          x_label = f'step, sampled every {trace_stride} steps'
+
+    #plot our results
+    plt.title(f'Methylated : {methylated_prop:.3f}, Unmethylated: {unmethylated_prop:.3f},\n middle: {time_in_middle_prop:.3f}, middle (<30% unmethylated) {sortamethyl_prop:.3f} \n simulated with {totalpop} sites over {trial_max_length} iterations',fontsize=10)
+    plt.xlabel(x_label)
+    plt.ylabel('cumulative proportion of time spent')
+    plt.plot(xes, methyl_cumulative_prop_thinned,label="Methylated")
+    plt.plot(xes, unmethyl_cumulative_prop_thinned,label="Unmethylated")
+    plt.plot(xes, sortamethyl_cumulative_prop_thinned,label="Sort of methylated")
+    plt.plot(xes, middle_cumulative_prop_thinned,label="Transitionary")
+    plt.legend(loc='upper right')
+    plt.show()
@@ -0,0 +1,162 @@
+import os
+import sys
+import json
+import time
+import importlib
+import runpy
+import argparse
+import tomllib
+
+"""
+Command-line driver for the simulation programs, so runs can be set up with config files instead of by editing the programs.
+
+Usage:
+    python run.py config.toml
+    python run.py config.json --set batch_size=2000 --set param_end_val=4 --figure sweep.png
+    python run.py --program simulation_longrun --set trial_max_length=1000000000 --rate birth_rate=1.2
+    python run.py --warmup
+
+A run config is a TOML or JSON file like this (see configs/example_sweep.toml):
+    program = "simulation_time"     # simulation_time, twoway_simulation_time, design_simulation_time, eigenvalue_sweep, simulation_coordinate or simulation_longrun
+    [parameters]                    # any of the values in the program's parameters block
+    param_end_val = 4
+    batch_size = 2000
+    [rates]                         # any of the entries of default_parameters
+    birth_rate = 1.2
+
+The program runs exactly as if it had been started directly, except that the values from the config replace the defaults in its parameters block.
+Misspelled parameter or rate names are errors, rather than being silently ignored.
+The simulation kernels take all of these values as arguments, so changing them doesn't cause any recompilation.
+
+The compiled kernels are cached on disk, so they are only compiled the first time - `python run.py --warmup` compiles all of them ahead of time
+(for example once after installing on the batch nodes). Every job reports how long the kernels took to be ready, and its total wall and CPU time.
+"""
+
+#the programs that can be run, and where they are
+PROGRAMS = {
+    "simulation_time": os.path.join("switching_times", "simulation_time.py"),
+    "twoway_simulation_time": os.path.join("switching_times", "twoway_simulation_time.py"),
+    "design_simulation_time": os.path.join("switching_times", "design_simulation_time.py"),
+    "eigenvalue_sweep": os.path.join("switching_times", "eigenvalue_sweep.py"),
+    "simulation_coordinate": os.path.join("switching_coordinates", "simulation_coordinate.py"),
+    "simulation_longrun": os.path.join("long_run", "simulation_longrun.py"),
+}
+
+#the module with the compiled kernels of each program - importing it compiles the kernels, or loads them from the on-disk cache
+KERNEL_MODULES = {
+    "simulation_time": "gillespie_time",
+    "twoway_simulation_time": "gillespie_time",
+    "design_simulation_time": "gillespie_time",
+    "eigenvalue_sweep": "gillespie_time",
+    "simulation_coordinate": "gillespie_coordinate",
+    "simulation_longrun": "gillespie_longrun",
+}
+
+#Imports the kernel module of a program (compiling its kernels, or loading them from the cache) and reports how long it took.
+#returns the number of seconds
+def warm_up(program):
+    sys.path.insert(0, os.path.dirname(os.path.join(os.path.dirname(os.path.abspath(__file__)), PROGRAMS[program])))
+    start = time.perf_counter()
+    module = importlib.import_module(KERNEL_MODULES[program])
+    seconds = time.perf_counter() - start
+    kernels = [kernel for kernel in vars(module).values() if hasattr(kernel, "stats")]
+    cache_hits = sum(sum(kernel.stats.cache_hits.values()) for kernel in kernels)
+    source = "loaded from the cache" if cache_hits > 0 else "compiled"
+    print(f"{KERNEL_MODULES[program]}: kernels ready in {seconds:.2f}s ({source})")
+    return seconds
+
+class RunConfig:
+    """The values from a run config, handed to the program as RUN_CONFIG. Each program asks for them in its run config blocks,
+    and every name is checked against the names the program allows, so a misspelled (or internal) name is an error instead of being silently ignored."""
+    def __init__(self, parameters, rates):
+        self.parameter_values = parameters
+        self.rate_values = rates
+
+    #returns the parameter values to set, after checking that they are all in parameter_names (the names in the program's parameters block)
+    def parameters(self, parameter_names):
+        check_names(self.parameter_values, parameter_names, "parameters")
+        return self.parameter_values
+
+    #returns the rates to set, after checking that they are all entries of the program's default_parameters
+    def rates(self, default_parameters):
+        check_names(self.rate_values, default_parameters, "rates")
+        return self.rate_values
+
+#Raises a ValueError naming every key of values that isn't in allowed
+def check_names(values, allowed, kind):
+    unknown = set(values) - set(allowed)
+    if unknown:
+        raise ValueError(f"unknown {kind} in run config: {sorted(unknown)}")
+
+#Reads a TOML or JSON run config, depending on the file extension
+def load_config(path):
+    if path.endswith(".json"):
+        with open(path) as config_file:
+            return json.load(config_file)
+    with open(path, "rb") as config_file:
+        return tomllib.load(config_file)
+
+#Turns the KEY=VALUE strings from --set and --rate into a dictionary - values are read as JSON when possible (numbers, lists, true/false, null)
+#and are kept as strings otherwise
+def parse_assignments(assignments):
+    values = {}
+    for assignment in assignments:
+        key, separator, text = assignment.partition("=")
+        if separator == "":
+            raise ValueError(f"expected KEY=VALUE, got {assignment!r}")
+        try:
+            values[key.strip()] = json.loads(text)
+        except json.JSONDecodeError:
+            values[key.strip()] = text
+    return values
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a methylation simulation program with a TOML or JSON run config.")
+    parser.add_argument("config", nargs="?", help="run config file (.toml or .json)")
+    parser.add_argument("--program", choices=sorted(PROGRAMS), help="program to run (overrides the config's program)")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", help="set a value from the parameters block (can be repeated)")
+    parser.add_argument("--rate", action="append", default=[], metavar="KEY=VALUE", help="set an entry of default_parameters (can be repeated)")
+    parser.add_argument("--figure", metavar="PATH", help="save the final figure to PATH instead of showing it (for batch nodes)")
+    parser.add_argument("--no-show", action="store_true", help="don't open any plot windows")
+    parser.add_argument("--warmup", action="store_true", help="compile (or load from the cache) the kernels of every program, then stop")
+    args = parser.parse_args(argv)
+
+    if args.warmup:
+        for program in sorted(set(KERNEL_MODULES.values())):
+            warm_up(next(name for name, module in KERNEL_MODULES.items() if module == program))
+        return
+
+    config = load_config(args.config) if args.config is not None else {}
+    program = args.program or config.get("program")
+    if program not in PROGRAMS:
+        parser.error(f"choose a program with --program or `program = ...` in the config: one of {sorted(PROGRAMS)}")
+
+    unknown_sections = set(config) - {"program", "parameters", "rates"}
+    if unknown_sections:
+        parser.error(f"unknown entries in {args.config}: {sorted(unknown_sections)}")
+    run_config = RunConfig({**config.get("parameters", {}), **parse_assignments(args.set)},
+                           {**config.get("rates", {}), **parse_assignments(args.rate)})
+
+    #without a display, draw the figures off-screen
+    if args.figure is not None or args.no_show:
+        import matplotlib
+        matplotlib.use("Agg")
+
+    #the programs import their neighbours by name, so their folder has to be on the path (warm_up puts it there)
+    job_start = time.perf_counter()
+    cpu_start = time.process_time()
+    ready_seconds = warm_up(program)
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), PROGRAMS[program])
+    #the program isn't run as __main__, so worker processes that re-import the main module (spawn, forkserver) import this file,
+    #whose code is behind the __main__ check below, instead of running the whole program again
+    runpy.run_path(script, init_globals={"RUN_CONFIG": run_config}, run_name="__run__")
+
+    if args.figure is not None:
+        import matplotlib.pyplot as plt
+        plt.gcf().savefig(args.figure)
+        print("Figure saved to", args.figure)
+    #CPU time counts every thread, so it is the cost of the job on a shared node
+    print(f"Job finished: kernels ready after {ready_seconds:.2f}s, {time.perf_counter() - job_start:.2f}s wall time, {time.process_time() - cpu_start:.2f}s CPU time")
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 import numpy as np
 import gillespie_coordinate
+import lockstep_coordinate
 import matplotlib.pyplot as plt
 import numba
 import statistics
@@ -26,6 +27,20 @@ methylatedpop = 15
 unmethylatedpop = 75
 #SwitchDirection - a simulation terminates when it reaches this state
 SwitchDirection = 1 #1 -> mostly methylated, -1-> mostly unmethylated
+#runs are split into chunks of this size, and each chunk gets its own random number generator
+chunk_size = 250
+#master seed for the random number generators - leave as None for a new one, or set it to a printed seed to reproduce a run
+master_seed = None
+#simulation engine - "compiled" runs the chunks one run at a time in the numba kernel, "lockstep" advances all of a chunk's runs together
+#(see lockstep_coordinate.py), which is usually faster
+engine = "compiled"
+#-----------run config-----------
+#when this program is started by run.py, the values from the run config file replace the ones above (see run.py)
+#only the names in the parameters block can be set
+parameter_names = ("batch_size", "trial_max_length", "totalpop", "methylatedpop", "unmethylatedpop", "SwitchDirection", "chunk_size", "master_seed",
+                   "engine")
+if "RUN_CONFIG" in globals():
+    globals().update(RUN_CONFIG.parameters(parameter_names))
 #-----------Rates Dictionary---------
 default_parameters = {"r_hm": 0.5,          #0
                       "r_hm_m": 20/totalpop, #1
@@ -43,6 +58,10 @@ default_parameters = {"r_hm": 0.5,          #0
                       "birth_rate": 1.6         #12
 }
 
+#rates from the run config replace the defaults above
+if "RUN_CONFIG" in globals():
+    default_parameters.update(RUN_CONFIG.rates(default_parameters))
+
 #This dictionary just matches each parameter to its place in the list.
 default_indices = {
     "r_hm": 0,          
@@ -65,22 +84,51 @@ parameter_labels = ["r_hm", "r_hm_m","r_hm_h", "r_uh", "r_uh_m", "r_uh_h", "r_mh
 #this line creates a numpy array with the same values as the dictionary - it is VITAL that they stay in the same order!!
 #changing the order of either the labels or the stuff in this list will create subtle errors in the rate calculations!
 default_arr = np.array([default_parameters[key] for key in parameter_labels])
+#the parameters are the same for every run, so the rates of every state are computed once and shared by all runs
+rate_table = gillespie_coordinate.build_rate_table(default_arr, totalpop)
 
-#-----------simulation - unmethylated to methylated-----------
-@numba.jit(nopython=True, parallel=True)
-def main(rng):
+#runs the batch with the lockstep engine instead of main - one lockstep batch per chunk, with that chunk's generator
+#returns the same output as main: the switching times and a list of (methylated, unmethylated) crossing coordinates
+def lockstep_main(rngs, rate_table):
+    output_array = np.zeros(batch_size)
+    coordinate_array = np.zeros((batch_size, 2), dtype=np.int64)
+    for chunk in range(len(rngs)):
+        start = chunk*chunk_size
+        stop = min((chunk+1)*chunk_size, batch_size)
+        lockstep_coordinate.GillespieLockstepFun(trial_max_length, rate_table, totalpop, methylatedpop, unmethylatedpop, SwitchDirection, output_array[start:stop], coordinate_array[start:stop], rngs[chunk])
+    return output_array, [tuple(coordinate) for coordinate in coordinate_array.tolist()]
+
+#-----------simulation-----------
+#main runs both switching directions. The settings are passed in as arguments rather than read from the globals, so numba doesn't
+#compile them in as constants, and changing them (for example from a run config) doesn't need a new compilation.
+#cache=True keeps the compiled function on disk (in __pycache__), so later runs skip the compilation.
+@numba.jit(nopython=True, parallel=True, cache=True)
+def main(rngs, rate_table, batch_size, chunk_size, trial_max_length, totalpop, methylatedpop, unmethylatedpop, SwitchDirection):
     output_array = np.zeros(batch_size)
     crossing_coordinates = [(-1,-1)] * batch_size
 
     #run a batch of identical gillespie algorithms, store the results in output_array[step]
-    for i in prange(batch_size):
-        output_array[i],crossing_coordinates[i]  = gillespie_coordinate.GillespieSwitchFun(trial_max_length, default_arr, totalpop, methylatedpop, unmethylatedpop, SwitchDirection,rng)
+    #each chunk of runs uses its own generator, so the chunks can safely run at the same time
+    for chunk in prange(len(rngs)):
+        for i in range(chunk*chunk_size, min((chunk+1)*chunk_size, batch_size)):
+            output_array[i],crossing_coordinates[i]  = gillespie_coordinate.GillespieSwitchTableFun(trial_max_length, rate_table, totalpop, methylatedpop, unmethylatedpop, SwitchDirection,rngs[chunk])
     return output_array,crossing_coordinates
 
-generator = np.random.default_rng()
+#-----------simulation - unmethylated to methylated-----------
+#one independent generator per chunk, spawned from the master seed with SeedSequence.spawn -
+#sharing one generator between parallel runs is a race, and makes the results impossible to reproduce
+if master_seed is None:
+    master_seed = np.random.SeedSequence().entropy
+print("Master seed: ", master_seed)
+chunk_count = (batch_size + chunk_size - 1) // chunk_size
+seed_sequences = np.random.SeedSequence(master_seed).spawn(2)
+generators = [np.random.default_rng(seed) for seed in seed_sequences[0].spawn(chunk_count)]
 
 #-----------Call simulation-----------
-output,crossing_coordinates = main(generator)
+if engine == "lockstep":
+    output,crossing_coordinates = lockstep_main(generators, rate_table)
+else:
+    output,crossing_coordinates = main(generators, rate_table, batch_size, chunk_size, trial_max_length, totalpop, methylatedpop, unmethylatedpop, SwitchDirection)
 
 #-----------Process results#----------
 #filter out all timed-out runs and their coordinates
@@ -104,20 +152,15 @@ methylatedpop = unmethylatedpop
 unmethylatedpop = temp
 
 #-----------simulation - methylated to unmethylated-----------
-@numba.jit(nopython=True, parallel=True)
-def main(rng):
-    output_array = np.zeros(batch_size)
-    crossing_coordinates = [(-1,-1)] * batch_size
-
-    #run a batch of identical gillespie algorithms, store the results in output_array[step]
-    for i in range(batch_size):
-        output_array[i],crossing_coordinates[i]  = gillespie_coordinate.GillespieSwitchFun(trial_max_length, default_arr, totalpop, methylatedpop, unmethylatedpop, SwitchDirection,rng)
-    return output_array,crossing_coordinates
-
-generator = np.random.default_rng()
+#this uses the same main as the first direction - only the starting populations, the direction and the generators change
+#the M->U runs use the second stream spawned from the master seed
+generators = [np.random.default_rng(seed) for seed in seed_sequences[1].spawn(chunk_count)]
 
 #-----------Call simulation-----------
-output,crossing_coordinates = main(generator)
+if engine == "lockstep":
+    output,crossing_coordinates = lockstep_main(generators, rate_table)
+else:
+    output,crossing_coordinates = main(generators, rate_table, batch_size, chunk_size, trial_max_length, totalpop, methylatedpop, unmethylatedpop, SwitchDirection)
 
 #-----------Process results-----------
 #filter out all timed-out runs and their coordinates
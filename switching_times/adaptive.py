@@ -0,0 +1,80 @@
+import numpy as np
+import scipy.stats as stats
+import scheduler
+import seeding
+
+"""
+Sequential-stopping batches for parameter sweeps.
+
+Instead of running a fixed batch_size at every sweep point, runs are added in increments, and a sweep point stops
+as soon as the confidence interval of its estimate is narrow enough (or it has used up its run budget).
+This spends the runs where the variance is, instead of spreading them evenly across the sweep.
+
+Two estimates can be used to decide when to stop:
+    "mean" - the empirical mean switching time, with a Student-t interval
+    "exponential" - the exponential fit parameter (the fitted scale, with location locked to 0), with its exact chi-squared interval.
+    For this estimate the relative width only depends on the number of valid runs.
+Only valid (not timed-out) runs count towards the estimates, just like in the fits.
+"""
+
+#Finds the half-width of the confidence interval of the chosen estimate, divided by the estimate itself.
+#returns infinity if there aren't enough valid runs to make an interval
+def relative_half_width(valid_times, metric="mean", confidence=0.95):
+    n = len(valid_times)
+    if n < 2:
+        return np.inf
+    mean = np.mean(valid_times)
+    if mean <= 0:
+        return np.inf
+    if metric == "mean":
+        half_width = stats.t.ppf(0.5 + confidence/2, n - 1) * np.std(valid_times, ddof=1) / np.sqrt(n)
+        return half_width / mean
+    elif metric == "exponential":
+        #2*n*mean/scale follows a chi-squared distribution with 2n degrees of freedom
+        lower = 2*n*mean / stats.chi2.ppf(0.5 + confidence/2, 2*n)
+        upper = 2*n*mean / stats.chi2.ppf(0.5 - confidence/2, 2*n)
+        return (upper - lower) / (2*mean)
+    raise ValueError(f"unknown metric {metric!r}, use 'mean' or 'exponential'")
+
+#Runs a sweep where each point stops once its relative CI half-width reaches target_rel_half_width, or once it has max_runs runs.
+#Runs are added increment at a time (increment has to be a multiple of chunk_size, so every chunk keeps the same random stream),
+#and every round schedules the chunks of all unfinished points together through scheduler.run_chunks (engine is passed on to it).
+#returns:
+#   output_array - (step_count, max_runs) array of switching times, NaN past the runs that were actually done
+#   run_counts - how many runs each point used
+#   half_widths - the final relative CI half-width of each point
+def run_adaptive_sweep(param_arrs, totalpop, methylatedpop, unmethylatedpop, SwitchDirection, trial_max_length, target_rel_half_width,
+                       max_runs=5000, increment=500, metric="mean", confidence=0.95, chunk_size=250, workers=None, master_seed=None, stream=0, engine="compiled"):
+    if increment % chunk_size != 0:
+        raise ValueError("increment has to be a multiple of chunk_size")
+    if master_seed is None:
+        master_seed = seeding.new_master_seed()
+    step_count = len(param_arrs)
+    rate_tables = scheduler.rate_tables_for(param_arrs, totalpop, engine)
+    output_array = np.full((step_count, max_runs), np.nan)
+    run_counts = np.zeros(step_count, dtype=np.int64)
+    half_widths = np.full(step_count, np.inf)
+    active = list(range(step_count))
+
+    while len(active) > 0:
+        #schedule the next increment of every unfinished point as one set of chunks
+        chunks = []
+        for step in active:
+            stop = min(run_counts[step] + increment, max_runs)
+            for start in range(run_counts[step], stop, chunk_size):
+                chunks.append((step, start, min(start + chunk_size, stop)))
+            run_counts[step] = stop
+        rngs = seeding.chunk_generators(master_seed, chunks, chunk_size, stream)
+        scheduler.run_chunks(chunks, rate_tables, output_array, trial_max_length, totalpop, methylatedpop, unmethylatedpop, SwitchDirection, rngs, workers, engine)
+
+        #check which points have converged or used up their budget
+        still_active = []
+        for step in active:
+            row = output_array[step, :run_counts[step]]
+            half_widths[step] = relative_half_width(row[row >= 0], metric, confidence)
+            if half_widths[step] > target_rel_half_width and run_counts[step] < max_runs:
+                still_active.append(step)
+        print(f"{step_count - len(still_active)} of {step_count} sweep points finished, {run_counts.sum()} runs so far")
+        active = still_active
+
+    return output_array, run_counts, half_widths
@@ -0,0 +1,74 @@
+import numpy as np
+import rare_event
+import markov_time
+import matplotlib.pyplot as plt
+import time
+
+"""
+Checks forward flux sampling (rare_event.run_ffs) against the exact mean switching time (markov_time.exact_sweep), in both directions.
+
+Every case is run with several master seeds. For each case it prints the exact mean switching time, the mean and relative S.D. of the
+FFS estimates over the seeds, the average relative half-width of their intervals, and how many of the intervals cover the exact value
+(with a 95% interval, about 19 out of 20). It also prints the relative S.D. of a single replicate's rate next to the binomial estimate
+from its counts, which leaves out the correlations between crossings and between the trials of each stage.
+The estimates are then graphed as a ratio to the exact value.
+
+Edit the parameters in the `parameters` block.
+"""
+
+#-----------parameters - edit here-----------
+#cases to check - (birth_rate, methylatedpop, unmethylatedpop, SwitchDirection), chosen so that the switch is rare (mean time in the hundreds or more)
+cases = [(0.2, 71, 13, -1), (0.3, 71, 13, -1), (2.5, 13, 71, 1), (3, 13, 71, 1)]
+totalpop = 100
+#number of master seeds per case
+seeds = 20
+#FFS settings, as in simulation_time.py
+ffs_interface_count = 15
+ffs_trials = 1000
+ffs_replicates = 10
+
+#-----------benchmark-----------
+#the rates dictionary of the simulation programs
+def make_param_arr(birth_rate):
+    return np.array([0.5, 20/totalpop, 10/totalpop, 0.35, 11/totalpop, 5.5/totalpop, 0.1, 10/totalpop, 5/totalpop, 0.1, 10/totalpop, 5/totalpop, birth_rate])
+
+ratios = np.zeros((len(cases), seeds))
+ratio_errors = np.zeros((2, len(cases), seeds))
+print(f"{'case':>22} {'exact':>9} {'FFS mean':>9} {'rel s.d.':>8} {'rel c.i.':>8} {'covered':>7} {'replicate rel s.d.':>18} {'binomial':>8} {'s/run':>6}")
+for row, (birth_rate, methylatedpop, unmethylatedpop, SwitchDirection) in enumerate(cases):
+    param_arr = make_param_arr(birth_rate)
+    exact = markov_time.exact_sweep([param_arr], totalpop, methylatedpop, unmethylatedpop, SwitchDirection)[0][0]
+    estimates = np.zeros(seeds)
+    intervals = np.zeros((seeds, 2))
+    replicate_spreads = np.zeros(seeds)
+    binomial_spreads = np.zeros(seeds)
+    start = time.perf_counter()
+    for seed in range(seeds):
+        result = rare_event.run_ffs(param_arr, totalpop, methylatedpop, unmethylatedpop, SwitchDirection, interface_count=ffs_interface_count,
+                                    flux_crossings=ffs_trials, trials_per_interface=ffs_trials, replicates=ffs_replicates, master_seed=seed + 1)
+        estimates[seed] = result["mean_switching_time"]
+        intervals[seed] = result["mean_interval"]
+        replicate_spreads[seed] = result["replicate_rates"].std(ddof=1) / result["rate"]
+        probabilities = result["probabilities"]
+        binomial_spreads[seed] = np.sqrt(1 / ffs_trials + np.sum((1 - probabilities) / (probabilities * ffs_trials)))
+    seconds = (time.perf_counter() - start) / seeds
+    covered = np.sum((intervals[:, 0] <= exact) & (exact <= intervals[:, 1]))
+    half_widths = (intervals[:, 1] - intervals[:, 0]) / (2 * estimates)
+    case = f"b={birth_rate} ({methylatedpop},{unmethylatedpop})->{SwitchDirection:+d}"
+    print(f"{case:>22} {exact:>9.1f} {estimates.mean():>9.1f} {estimates.std(ddof=1) / estimates.mean():>8.3f} {half_widths.mean():>8.3f} {covered:>4}/{seeds:<2} "
+          f"{replicate_spreads.mean():>18.3f} {binomial_spreads.mean():>8.3f} {seconds:>6.2f}")
+    ratios[row] = estimates / exact
+    ratio_errors[0, row] = (estimates - intervals[:, 0]) / exact
+    ratio_errors[1, row] = (intervals[:, 1] - estimates) / exact
+
+#-----------graphing-----------
+plt.close()
+for row, (birth_rate, methylatedpop, unmethylatedpop, SwitchDirection) in enumerate(cases):
+    plt.errorbar(row + np.linspace(-0.3, 0.3, seeds), ratios[row], yerr=ratio_errors[:, row], marker='x', linestyle='',
+                 label=f"birth rate {birth_rate}, ({methylatedpop}, {unmethylatedpop}) towards {SwitchDirection:+d}")
+plt.axhline(1, color='gray', linestyle='dotted')
+plt.xticks([])
+plt.title(f"Forward flux sampling against the exact mean switching time\n{seeds} seeds per case, {ffs_replicates} replicates of {ffs_trials} trials per interface")
+plt.ylabel('FFS mean switching time / exact mean switching time')
+plt.legend(loc='upper right')
+plt.show()
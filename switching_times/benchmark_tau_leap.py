@@ -0,0 +1,75 @@
+import numpy as np
+import gillespie_time
+import matplotlib.pyplot as plt
+import time
+
+"""
+Benchmarks the tau-leaping engine (gillespie_time.GillespieTauLeapFun) against exact simulation (gillespie_time.GillespieSwitchFun)
+as the number of sites grows.
+
+Both use the same collaborative rate functions, computed as they go (a rate table for 100,000 sites would not fit in memory).
+The collaborative rates are scaled by totalpop like in the simulation programs, so the dynamics stay the same as the site count grows
+and only the number of events per unit time goes up - which is what makes exact simulation slow, and tau-leaping worthwhile.
+
+For every site count and every accuracy in epsilons, it prints the time per run, the speed-up over exact simulation,
+and the mean switching time with its standard error, so the accuracy of each epsilon can be checked. The speed-ups are then graphed.
+
+Edit the parameters in the `parameters` block.
+"""
+
+#-----------parameters - edit here-----------
+#site counts to benchmark
+site_counts = [100, 1000, 10000, 100000]
+#tau-leaping accuracies to compare (smaller is more accurate and slower)
+epsilons = [0.01, 0.03, 0.1]
+#number of runs for each site count and engine
+runs = 200
+#starting populations as fractions of the sites, and the direction
+methylated_fraction = 0.1
+unmethylated_fraction = 0.9
+SwitchDirection = 1 #1 -> mostly methylated, -1-> mostly unmethylated
+#birth rate - kept low, since with many sites a switch against frequent births becomes extremely rare
+birth_rate = 0.3
+#runs are stopped after this many steps
+trial_max_length = 10**9
+seed = 1
+
+#-----------benchmark-----------
+#the rates dictionary of the simulation programs, for totalpop sites
+def make_param_arr(totalpop):
+    return np.array([0.5, 20/totalpop, 10/totalpop, 0.35, 11/totalpop, 5.5/totalpop, 0.1, 10/totalpop, 5/totalpop, 0.1, 10/totalpop, 5/totalpop, birth_rate])
+
+#runs `runs` runs with one engine - returns the seconds per run and the switching times
+def time_runs(run_one):
+    start = time.perf_counter()
+    times = np.array([run_one() for _ in range(runs)])
+    return (time.perf_counter() - start) / runs, times
+
+rng = np.random.default_rng(seed)
+speedups = np.zeros((len(site_counts), len(epsilons)))
+print(f"{'sites':>8} {'engine':>14} {'s/run':>10} {'speed-up':>9} {'mean time':>10} {'s.e.':>7} {'timeouts':>8}")
+for row, totalpop in enumerate(site_counts):
+    param_arr = make_param_arr(totalpop)
+    methylatedpop = int(methylated_fraction * totalpop)
+    unmethylatedpop = int(unmethylated_fraction * totalpop)
+    exact_seconds, exact_times = time_runs(lambda: gillespie_time.GillespieSwitchFun(trial_max_length, param_arr, totalpop, methylatedpop, unmethylatedpop, SwitchDirection, rng))
+    valid = exact_times[exact_times >= 0]
+    print(f"{totalpop:>8} {'exact':>14} {exact_seconds:>10.2e} {1:>9.1f} {valid.mean():>10.3f} {valid.std() / np.sqrt(len(valid)):>7.3f} {runs - len(valid):>8}")
+    for column, epsilon in enumerate(epsilons):
+        leap_seconds, leap_times = time_runs(lambda: gillespie_time.GillespieTauLeapFun(trial_max_length, param_arr, totalpop, methylatedpop, unmethylatedpop, SwitchDirection, epsilon, rng))
+        speedups[row, column] = exact_seconds / leap_seconds
+        valid = leap_times[leap_times >= 0]
+        print(f"{totalpop:>8} {'tauleap:' + str(epsilon):>14} {leap_seconds:>10.2e} {speedups[row, column]:>9.1f} {valid.mean():>10.3f} {valid.std() / np.sqrt(len(valid)):>7.3f} {runs - len(valid):>8}")
+
+#-----------graphing-----------
+plt.close()
+for column, epsilon in enumerate(epsilons):
+    plt.plot(site_counts, speedups[:, column], marker='.', label="tauleap:" + str(epsilon))
+plt.xscale('log')
+plt.yscale('log')
+plt.axhline(1, color='gray', linestyle='dotted')
+plt.title(f"Tau-leaping speed-up over exact simulation\n{runs} runs per site count, birth rate {birth_rate}")
+plt.xlabel('Number of sites (totalpop)')
+plt.ylabel('Speed-up (exact time / tau-leaping time)')
+plt.legend(loc='upper left')
+plt.show()
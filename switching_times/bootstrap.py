@@ -0,0 +1,109 @@
+import os
+import numpy as np
+import numba
+from numba import njit, types
+from concurrent.futures import ThreadPoolExecutor
+import fitting
+import seeding
+
+"""
+Bootstrap confidence intervals for the fitted switching-time curves.
+
+Each replicate resamples a sweep point's runs (timed-out ones included) with replacement, by index, and refits.
+Every fit the simulation programs graph only needs a few sums over the finished runs - their count, sum, sum of squares and sum of logs -
+so the nogil kernel BootstrapSumsFun draws the resamples and accumulates those sums without ever building a resampled array,
+and the fits are then made from the sums for every replicate of every point at once (the gamma shape with fitting.gamma_shape_mle).
+The sweep points are spread over a pool of threads, like the chunks in scheduler.py.
+
+The intervals are percentile intervals. As in the simulation programs, a replicate where more than half of the runs timed out has no fit,
+and the fits' intervals are NaN at points where the original runs have no fit.
+The KS errors are left out - they need a sort per replicate, and a bootstrap of a KS statistic isn't a meaningful interval anyway.
+
+Every point gets its own generator (seeding.analysis_seed_sequence), so the intervals are reproducible from the master seed.
+"""
+
+rng_type = numba.typeof(np.random.default_rng())
+
+#Draws `replicates` resamples of times (one point's runs, negative for time-outs) and stores, for every resample,
+#the number of finished runs, the sum and sum of squares of their times minus shift, and the sum of their log_times, in sums[replicate]
+#shift should be close to the mean time, so the sum of squares doesn't lose precision
+@njit((types.float64[::1], types.float64[::1], types.int64, types.float64, types.float64[:, ::1], rng_type), nogil=True, cache=True)
+def BootstrapSumsFun(times, log_times, replicates, shift, sums, rng):
+    run_count = len(times)
+    for replicate in range(replicates):
+        count = 0.0
+        total = 0.0
+        squares = 0.0
+        logs = 0.0
+        for _ in range(run_count):
+            #scaling a uniform draw is several times faster than rng.integers here
+            index = int(rng.random() * run_count)
+            if times[index] >= 0:
+                difference = times[index] - shift
+                count += 1
+                total += difference
+                squares += difference * difference
+                logs += log_times[index]
+        sums[replicate, 0] = count
+        sums[replicate, 1] = total
+        sums[replicate, 2] = squares
+        sums[replicate, 3] = logs
+
+#Bootstrap replicates of every fit at every point of output (a (step_count, batch_size) array of switching times, negative for time-outs).
+#run_counts gives how many runs of each row were made (for sequential stopping) - by default, every run in the row.
+#returns a dictionary of name -> (step_count, replicates) array, with the same names as fitting.fit_sweep, plus timeout_fraction
+def bootstrap_replicates(output, run_counts=None, replicates=1000, master_seed=None, stream=0, workers=None):
+    output = np.asarray(output, dtype=float)
+    if run_counts is None:
+        run_counts = np.full(len(output), output.shape[1])
+    if master_seed is None:
+        master_seed = seeding.new_master_seed()
+    if workers is None:
+        workers = os.cpu_count()
+    step_count = len(output)
+    sums = np.zeros((step_count, replicates, 4))
+    shifts = np.zeros(step_count)
+
+    def resample_point(step):
+        times = np.ascontiguousarray(output[step, :run_counts[step]])
+        valid = times[times >= 0]
+        shifts[step] = valid.mean() if len(valid) > 0 else 0.0
+        with np.errstate(divide="ignore"):
+            log_times = np.log(np.where(times > 0, times, 0.0))
+        rng = np.random.default_rng(seeding.analysis_seed_sequence(master_seed, stream, step))
+        BootstrapSumsFun(times, log_times, replicates, shifts[step], sums[step], rng)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(resample_point, range(step_count)))
+
+    counts = sums[:, :, 0]
+    enough = counts > np.asarray(run_counts)[:, None] / 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        centred_mean = sums[:, :, 1] / counts
+        mean = np.where(enough, shifts[:, None] + centred_mean, np.nan)
+        sd = np.where(enough, np.sqrt(np.maximum(sums[:, :, 2] / counts - centred_mean**2, 0.0)), np.nan)
+        s = np.log(mean) - sums[:, :, 3] / counts
+        solvable = enough & (s > 0) & np.isfinite(s)
+        shape = np.where(solvable, fitting.gamma_shape_mle(np.where(solvable, s, 1.0)), np.nan)
+    return {"exponential_parameter": mean, "empirical_mean": mean, "normal_mean": mean, "normal_sd": sd,
+            "gamma_shape": shape, "gamma_scale": mean / shape, "timeout_fraction": 1 - counts / np.asarray(run_counts)[:, None]}
+
+#Percentile confidence intervals (at level `confidence`) for every fit at every point - see bootstrap_replicates.
+#returns a dictionary of name -> (lower, upper), each an array with one value per point (NaN where the points have no fit)
+def bootstrap_sweep(output, run_counts=None, replicates=1000, confidence=0.95, master_seed=None, stream=0, workers=None):
+    values = bootstrap_replicates(output, run_counts, replicates, master_seed, stream, workers)
+    point_fits = fitting.fit_sweep(output, run_counts, workers)
+    has_fit = ~np.isnan(point_fits["exponential_parameter"])
+    tail = 100 * (1 - confidence) / 2
+    intervals = {}
+    for name, replicate_values in values.items():
+        lower = np.full(len(replicate_values), np.nan)
+        upper = np.full(len(replicate_values), np.nan)
+        #points where the fit fails in most replicates don't get an interval
+        usable = np.mean(~np.isnan(replicate_values), axis=1) >= 0.5
+        if name != "timeout_fraction":
+            usable &= has_fit
+        if usable.any():
+            lower[usable], upper[usable] = np.nanpercentile(replicate_values[usable], [tail, 100 - tail], axis=1)
+        intervals[name] = (lower, upper)
+    return intervals
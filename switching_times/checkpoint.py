@@ -0,0 +1,93 @@
+import os
+import json
+import time
+import threading
+import numpy as np
+import scheduler
+import seeding
+
+"""
+Checkpoint and resume for long parameter sweeps.
+
+run_checkpointed_sweep runs a fixed-batch sweep like scheduler.run_sweep, but every checkpoint_seconds it saves the switching times
+of every finished chunk to checkpoint_path, together with everything needed to carry on (the parameters, populations, master seed, stream...).
+If the process is killed, calling run_checkpointed_sweep again with the same arguments - or resume_sweep with just the path -
+runs only the chunks that hadn't finished.
+
+Every chunk's generator is made from the master seed and the chunk's position (see seeding.py), so a chunk that was cut off part-way
+is simply run again from the start of its stream, and a resumed sweep gives exactly the same results as one that was never interrupted
+(and the same results as scheduler.run_sweep with the same master seed and stream).
+"""
+
+#Writes the checkpoint under a temporary name first, so being killed during a save never leaves a broken checkpoint behind
+def save_checkpoint(checkpoint_path, config, output_array, chunk_done):
+    temp_path = checkpoint_path + ".tmp"
+    with open(temp_path, "wb") as checkpoint_file:
+        np.savez(checkpoint_file, config=json.dumps(config), output_array=output_array, chunk_done=chunk_done)
+    os.replace(temp_path, checkpoint_path)
+
+#returns the config dictionary, the output array and the array of finished chunks saved in a checkpoint
+def load_checkpoint(checkpoint_path):
+    with np.load(checkpoint_path) as data:
+        return json.loads(str(data["config"])), data["output_array"], data["chunk_done"]
+
+#Returns the master seed saved in checkpoint_path, or None if there's no checkpoint there yet -
+#the simulation programs use this so that a resumed sweep keeps its original seed
+def saved_master_seed(checkpoint_path):
+    if not os.path.exists(checkpoint_path):
+        return None
+    return load_checkpoint(checkpoint_path)[0]["master_seed"]
+
+#Runs (or continues) a sweep, saving a checkpoint every checkpoint_seconds and once more at the end.
+#The arguments are the same as scheduler.run_sweep, except that master_seed replaces rngs - the generators are rebuilt from it when resuming.
+#If checkpoint_path already holds a checkpoint of a different sweep, a ValueError is raised rather than mixing the two.
+#returns the (step_count, batch_size) array of switching times and the chunk timings of the chunks run by this call
+def run_checkpointed_sweep(checkpoint_path, param_arrs, totalpop, methylatedpop, unmethylatedpop, SwitchDirection, batch_size, trial_max_length,
+                           chunk_size=250, workers=None, master_seed=None, stream=0, engine="compiled", checkpoint_seconds=60):
+    if master_seed is None:
+        master_seed = seeding.new_master_seed()
+    config = {"param_arrs": [[float(value) for value in param_arr] for param_arr in param_arrs], "totalpop": int(totalpop),
+              "methylatedpop": int(methylatedpop), "unmethylatedpop": int(unmethylatedpop), "SwitchDirection": int(SwitchDirection),
+              "batch_size": int(batch_size), "trial_max_length": int(trial_max_length), "chunk_size": int(chunk_size),
+              "master_seed": int(master_seed), "stream": int(stream), "engine": engine}
+    step_count = len(param_arrs)
+    chunks = scheduler.make_chunks(step_count, batch_size, chunk_size)
+
+    if os.path.exists(checkpoint_path):
+        saved_config, output_array, chunk_done = load_checkpoint(checkpoint_path)
+        if saved_config != config:
+            raise ValueError(f"{checkpoint_path} is a checkpoint of a different sweep - remove it or use another path")
+        print(f"Resuming from {checkpoint_path}: {int(chunk_done.sum())} of {len(chunks)} chunks already done")
+    else:
+        output_array = np.zeros(shape=(step_count, batch_size))
+        chunk_done = np.zeros(len(chunks), dtype=bool)
+
+    remaining = np.flatnonzero(~chunk_done)
+    remaining_chunks = [chunks[index] for index in remaining]
+    rngs = seeding.chunk_generators(master_seed, remaining_chunks, chunk_size, stream)
+    rate_tables = scheduler.rate_tables_for(param_arrs, totalpop, engine)
+
+    save_lock = threading.Lock()
+    last_save = [time.perf_counter()]
+    #mark each chunk as done once its results are written, and save whenever checkpoint_seconds have passed since the last save
+    def on_chunk_done(chunk_index):
+        with save_lock:
+            chunk_done[remaining[chunk_index]] = True
+            if time.perf_counter() - last_save[0] >= checkpoint_seconds:
+                #only the finished chunks are marked as done, so chunks that are still running are never trusted on resume
+                save_checkpoint(checkpoint_path, config, output_array, chunk_done.copy())
+                last_save[0] = time.perf_counter()
+
+    chunk_timings = scheduler.run_chunks(remaining_chunks, rate_tables, output_array, trial_max_length, totalpop, methylatedpop, unmethylatedpop,
+                                         SwitchDirection, rngs, workers, engine, on_chunk_done)
+    save_checkpoint(checkpoint_path, config, output_array, chunk_done)
+    return output_array, chunk_timings
+
+#Resume entry point - continues the sweep saved in checkpoint_path using only the settings stored in it.
+#returns the same as run_checkpointed_sweep
+def resume_sweep(checkpoint_path, workers=None, checkpoint_seconds=60):
+    config, output_array, chunk_done = load_checkpoint(checkpoint_path)
+    param_arrs = [np.array(param_arr) for param_arr in config["param_arrs"]]
+    return run_checkpointed_sweep(checkpoint_path, param_arrs, config["totalpop"], config["methylatedpop"], config["unmethylatedpop"], config["SwitchDirection"],
+                                  config["batch_size"], config["trial_max_length"], config["chunk_size"], workers, config["master_seed"], config["stream"],
+                                  config["engine"], checkpoint_seconds)
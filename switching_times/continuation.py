@@ -0,0 +1,122 @@
+import os
+import json
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+import gillespie_time
+import scheduler
+import seeding
+
+"""
+Sweeps with a simulated-time horizon, whose unfinished runs are kept and can be continued later.
+
+In a normal sweep, trial_max_length is both the size of the run and its time-out, and a run that times out is thrown away as a negative time.
+Here every run carries its state (methylated, unmethylated, simulated time, and whether it has switched), and each pass continues
+the runs that haven't switched yet - until they switch, reach the pass's time horizon, or have taken steps_per_pass - 1 more events (like trial_max_length,
+steps_per_pass counts the starting state)
+(see gillespie_time.GillespieCensoredChunkFun). Runs that still haven't switched are censored observations: their switching time is known
+to be longer than their time. The censored fits in fitting.py use them, instead of fitting only the runs that finished (which is biased low).
+
+A run state is a dictionary of arrays, with one row per sweep point and one column per run:
+    methylated, unmethylated - each run's current state
+    times                    - each run's simulated time (its switching time once it has switched)
+    switched                 - 1 for runs that have switched, 0 for censored ones
+    passes                   - how many passes have been run
+save_run_state and load_run_state keep it in an .npz file, so a later program run can continue the same runs with a larger horizon.
+With engine="tauleap[:epsilon]" the runs are continued with the tau-leaping kernel (gillespie_time.GillespieTauLeapCensoredChunkFun), for large site counts.
+There is no lockstep version, so engine="lockstep" runs like "compiled".
+Each pass over a chunk uses its own generator (seeding.continuation_seed_sequence). The first pass uses the chunk's normal generator,
+so with no time horizon and the "compiled" or "tauleap" engine, the first pass gives exactly scheduler.run_sweep's times with trial_max_length = steps_per_pass
+(time-outs included, as censored runs).
+"""
+
+#returns a run state with batch_size runs at each of step_count points, all at the starting population at time 0
+def new_run_state(step_count, batch_size, methylatedpop, unmethylatedpop):
+    return {"methylated": np.full((step_count, batch_size), methylatedpop, dtype=np.int64),
+            "unmethylated": np.full((step_count, batch_size), unmethylatedpop, dtype=np.int64),
+            "times": np.zeros((step_count, batch_size)),
+            "switched": np.zeros((step_count, batch_size), dtype=np.int8),
+            "passes": 0}
+
+#Runs one pass over every run of run_state that hasn't switched, in place - each is continued until it switches,
+#reaches time_horizon (simulated time, None for no limit) or has taken steps_per_pass - 1 more events.
+#The chunks are run on a pool of worker threads, like scheduler.run_chunks.
+def advance_sweep(run_state, param_arrs, totalpop, SwitchDirection, time_horizon, steps_per_pass, chunk_size=250, workers=None, master_seed=0, stream=0, engine="compiled"):
+    if workers is None:
+        workers = os.cpu_count()
+    step_count, batch_size = run_state["times"].shape
+    horizon = np.inf if time_horizon is None else float(time_horizon)
+    engine_name, epsilon = scheduler.parse_engine(engine)
+    rate_tables = scheduler.rate_tables_for(param_arrs, totalpop, engine)
+    chunks = scheduler.make_chunks(step_count, batch_size, chunk_size)
+    pass_number = run_state["passes"]
+
+    def run_one(chunk):
+        step, start, stop = chunk
+        if run_state["switched"][step, start:stop].all():
+            return
+        rng = np.random.default_rng(seeding.continuation_seed_sequence(master_seed, stream, step, start // chunk_size, pass_number))
+        if engine_name == "tauleap":
+            gillespie_time.GillespieTauLeapCensoredChunkFun(steps_per_pass, horizon, rate_tables[step], totalpop, SwitchDirection, epsilon,
+                                                            run_state["methylated"][step, start:stop], run_state["unmethylated"][step, start:stop],
+                                                            run_state["times"][step, start:stop], run_state["switched"][step, start:stop], rng)
+            return
+        gillespie_time.GillespieCensoredChunkFun(steps_per_pass, horizon, rate_tables[step], totalpop, SwitchDirection,
+                                                 run_state["methylated"][step, start:stop], run_state["unmethylated"][step, start:stop],
+                                                 run_state["times"][step, start:stop], run_state["switched"][step, start:stop], rng)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        #list() makes sure any error raised inside a chunk is passed on here
+        list(pool.map(run_one, chunks))
+    run_state["passes"] = pass_number + 1
+    return run_state
+
+#Switching times in the usual form - the time of every switched run, and minus the time of every censored one
+def signed_times(run_state):
+    return np.where(run_state["switched"] == 1, run_state["times"], -run_state["times"])
+
+#Saves a run state, and the settings it was made with (a dictionary), to an .npz file
+def save_run_state(path, run_state, config):
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "wb") as state_file:
+        np.savez(state_file, methylated=run_state["methylated"], unmethylated=run_state["unmethylated"], times=run_state["times"],
+                 switched=run_state["switched"], passes=run_state["passes"], config=json.dumps(config))
+    os.replace(temporary_path, path)
+
+#returns the run state and settings saved by save_run_state
+def load_run_state(path):
+    with np.load(path) as data:
+        run_state = {name: data[name].copy() for name in ("methylated", "unmethylated", "times", "switched")}
+        run_state["passes"] = int(data["passes"])
+        return run_state, json.loads(str(data["config"]))
+
+#returns the master seed a saved run state was made with, or None if there is no run state at run_state_path yet
+def saved_master_seed(run_state_path):
+    if not os.path.exists(run_state_path):
+        return None
+    return load_run_state(run_state_path)[1]["master_seed"]
+
+#Runs `passes` passes of a sweep with a time horizon - pass n (counting from 0 over every pass the run state has had) stops at
+#(n + 1) * time_horizon, so every pass lets the censored runs go on for another time_horizon (with time_horizon None, passes are only limited by steps_per_pass).
+#If run_state_path is given, the run state is loaded from it when it exists (it must have been made with the same settings) and saved after every pass,
+#so running the sweep again continues the same runs with more passes.
+#returns the run state
+def run_horizon_sweep(param_arrs, totalpop, methylatedpop, unmethylatedpop, SwitchDirection, batch_size, time_horizon, steps_per_pass, passes,
+                      chunk_size=250, workers=None, master_seed=0, stream=0, run_state_path=None, engine="compiled"):
+    config = {"param_arrs": [[float(value) for value in param_arr] for param_arr in param_arrs], "totalpop": int(totalpop), "methylatedpop": int(methylatedpop),
+              "unmethylatedpop": int(unmethylatedpop), "SwitchDirection": int(SwitchDirection), "batch_size": int(batch_size),
+              "time_horizon": time_horizon, "chunk_size": int(chunk_size), "master_seed": int(master_seed), "stream": int(stream),
+              "engine": engine}
+    if run_state_path is not None and os.path.exists(run_state_path):
+        run_state, saved_config = load_run_state(run_state_path)
+        if saved_config != config:
+            raise ValueError(f"{run_state_path} was made with different settings - remove it or change run_state_path")
+        print(f"Continuing {run_state_path} after {run_state['passes']} passes")
+    else:
+        run_state = new_run_state(len(param_arrs), batch_size, methylatedpop, unmethylatedpop)
+    for _ in range(passes):
+        horizon = None if time_horizon is None else (run_state["passes"] + 1) * time_horizon
+        advance_sweep(run_state, param_arrs, totalpop, SwitchDirection, horizon, steps_per_pass, chunk_size, workers, master_seed, stream, engine)
+        print(f"Pass {run_state['passes']}: {1 - run_state['switched'].mean():.1%} of runs censored" + ("" if horizon is None else f" at time {horizon}"))
+        if run_state_path is not None:
+            save_run_state(run_state_path, run_state, config)
+    return run_state
@@ -0,0 +1,100 @@
+import json
+import numpy as np
+from scipy.stats import qmc
+import scheduler
+import seeding
+
+"""
+Multi-dimensional parameter sweeps.
+
+A design is a set of points in the space of any subset of the 13 rates, given as an array with one row per point and one column per varied rate.
+Designs can be full grids (grid_design), Latin hypercubes (latin_hypercube_design) or scrambled Sobol sequences (sobol_design) -
+the space-filling designs cover many rates with far fewer points than a grid.
+Every point of a design is turned into a full parameter array (design_param_arrs) and all of them are run together by scheduler.run_sweep,
+so the whole design shares one pool of workers.
+
+The results are kept as labelled arrays: a dictionary of named arrays, the names of their dimensions, and the coordinates along each dimension.
+For a grid the dimensions are the varied rates (so mean_switching_time[i, j, k] belongs to the i-th, j-th and k-th values of the three rates),
+and for the space-filling designs there is one "point" dimension with the value of every rate as a coordinate.
+save_labelled and load_labelled store them as .npz files.
+"""
+
+#Full grid over the rates in ranges, a dictionary of rate label -> (begin, end, count), like param_begin_val, param_end_val and step_count.
+#returns the (point_count, rate_count) array of points (the last rate changes fastest) and a dictionary of rate label -> values along its axis
+def grid_design(ranges):
+    axes = {label: np.linspace(begin, end, int(count)) for label, (begin, end, count) in ranges.items()}
+    mesh = np.meshgrid(*axes.values(), indexing="ij")
+    points = np.column_stack([values.ravel() for values in mesh])
+    return points, axes
+
+#Latin hypercube of point_count points inside bounds, a dictionary of rate label -> (low, high)
+def latin_hypercube_design(bounds, point_count, seed=None):
+    sample = qmc.LatinHypercube(d=len(bounds), seed=seed).random(point_count)
+    return qmc.scale(sample, [low for low, high in bounds.values()], [high for low, high in bounds.values()])
+
+#Scrambled Sobol sequence of point_count points inside bounds (rate label -> (low, high)).
+#Sobol points are best balanced when point_count is a power of 2.
+def sobol_design(bounds, point_count, seed=None):
+    sample = qmc.Sobol(d=len(bounds), scramble=True, seed=seed).random(point_count)
+    return qmc.scale(sample, [low for low, high in bounds.values()], [high for low, high in bounds.values()])
+
+#Makes one parameter array per point - a copy of default_arr with the rates in labels replaced by the point's values.
+#parameter_labels gives the order of the rates in default_arr
+def design_param_arrs(default_arr, parameter_labels, labels, points):
+    indices = [parameter_labels.index(label) for label in labels]
+    param_arrs = []
+    for point in points:
+        temp_arr = default_arr.copy()
+        temp_arr[indices] = point
+        param_arrs.append(temp_arr)
+    return param_arrs
+
+#Runs batch_size runs at every point of a design, all through one scheduler.run_sweep.
+#returns the (point_count, batch_size) array of switching times (negative values are time-outs) and the chunk timings
+def run_design_sweep(default_arr, parameter_labels, labels, points, totalpop, methylatedpop, unmethylatedpop, SwitchDirection, batch_size, trial_max_length,
+                     chunk_size=250, workers=None, master_seed=None, stream=0, engine="compiled"):
+    if master_seed is None:
+        master_seed = seeding.new_master_seed()
+    param_arrs = design_param_arrs(default_arr, parameter_labels, labels, points)
+    rngs = seeding.chunk_generators(master_seed, scheduler.make_chunks(len(param_arrs), batch_size, chunk_size), chunk_size, stream)
+    return scheduler.run_sweep(param_arrs, totalpop, methylatedpop, unmethylatedpop, SwitchDirection, batch_size, trial_max_length, chunk_size, workers, rngs, engine)
+
+#Summarizes every point: the mean and standard deviation of the switching times that didn't time out, and the fraction that timed out.
+#Like the simulation programs, the mean and standard deviation are NaN when more than half of the runs timed out.
+#returns a dictionary of name -> array with one value per point
+def summarize(output_array):
+    valid = output_array >= 0
+    valid_counts = valid.sum(axis=1)
+    enough = valid_counts > output_array.shape[1] / 2
+    valid_times = np.where(valid, output_array, np.nan)
+    with np.errstate(invalid="ignore"):
+        mean_time = np.where(enough, np.nanmean(valid_times, axis=1), np.nan)
+        sd_time = np.where(enough, np.nanstd(valid_times, axis=1), np.nan)
+    return {"mean_switching_time": mean_time, "sd_switching_time": sd_time, "timeout_fraction": 1 - valid_counts / output_array.shape[1]}
+
+#Turns per-point results into labelled arrays.
+#For a grid (axes from grid_design) every array is reshaped to one dimension per rate; otherwise there is one "point" dimension
+#and the rates' values at each point are the coordinates.
+#returns (arrays, dims, coords) - the dictionary of arrays, the list of dimension names and a dictionary of coordinate name -> values
+def labelled_results(results, labels, points, axes=None):
+    if axes is not None:
+        shape = tuple(len(values) for values in axes.values())
+        arrays = {name: values.reshape(shape + values.shape[1:]) for name, values in results.items()}
+        return arrays, list(labels), {label: np.asarray(values) for label, values in axes.items()}
+    coords = {label: points[:, column] for column, label in enumerate(labels)}
+    return dict(results), ["point"], coords
+
+#Saves labelled arrays to an .npz file - the arrays, their coordinates, and the dimension names (and any extra metadata) as JSON
+def save_labelled(path, arrays, dims, coords, metadata=None):
+    contents = {"data_" + name: values for name, values in arrays.items()}
+    contents.update({"coord_" + name: values for name, values in coords.items()})
+    contents["dims"] = json.dumps(dims)
+    contents["metadata"] = json.dumps(metadata if metadata is not None else {})
+    np.savez_compressed(path, **contents)
+
+#returns the (arrays, dims, coords, metadata) saved by save_labelled
+def load_labelled(path):
+    with np.load(path) as data:
+        arrays = {name[len("data_"):]: data[name] for name in data.files if name.startswith("data_")}
+        coords = {name[len("coord_"):]: data[name] for name in data.files if name.startswith("coord_")}
+        return arrays, json.loads(str(data["dims"])), coords, json.loads(str(data["metadata"]))
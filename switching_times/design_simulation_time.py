@@ -0,0 +1,137 @@
+import numpy as np
+import matplotlib.pyplot as plt
+import scheduler
+import seeding
+import design
+
+"""
+Performs many gillespie runs at every point of a multi-dimensional parameter design, to map how the switching time
+depends on several rates at once (for example birth rate x de novo rate x maintenance rate).
+
+Edit the parameters in the `parameters` block. Choose the design type, and give the range of every rate you want to vary:
+    - "grid" runs every combination of the values, so `ranges` gives (begin, end, count) for each rate
+    - "lhs" (Latin hypercube) and "sobol" spread point_count points over the ranges, and only use the (begin, end) of each range
+The other rates keep the values in the rates dictionary.
+
+The mean switching time, its standard deviation and the fraction of timed-out runs at every point are saved to output_path
+as labelled arrays (see design.py), and the mean switching time is graphed.
+"""
+
+
+#-----------parameters - edit here-----------
+#the type of design - "grid", "lhs" or "sobol"
+design_type = "grid"
+#the rates to vary, each with (begin, end, count) - the count is only used by grids
+ranges = {"birth_rate": (0.5, 2.0, 16),
+          "r_uh": (0.2, 0.5, 8)}
+#number of points for "lhs" and "sobol" designs (Sobol designs are best balanced with a power of 2)
+point_count = 128
+#define batch size - this determines how many runs are averaged at each point
+batch_size = 2000
+#define length of trials in steps (default 10000) - they will usually stop earlier, this is more for allocating space
+trial_max_length = 10000
+#define starting population (number of sites)
+totalpop = 100
+methylatedpop = 10
+unmethylatedpop = 90
+#SwitchDirection - a simulation terminates when it reaches this state
+SwitchDirection = 1 #1 -> mostly methylated, -1-> mostly unmethylated
+#runs are handed out to the worker threads in chunks of this size - smaller chunks balance better, larger ones have less overhead
+chunk_size = 250
+#number of worker threads (None uses every core)
+workers = None
+#master seed for the random number generators (and the lhs/sobol designs) - leave as None for a new one, or set it to a printed seed to reproduce a sweep
+master_seed = None
+#simulation engine - "compiled", "lockstep" or "tauleap[:epsilon]" (see scheduler.py)
+engine = "compiled"
+#where to save the results
+output_path = "design_results.npz"
+#-----------run config-----------
+#when this program is started by run.py, the values from the run config file replace the ones above (see run.py)
+#only the names in the parameters block can be set
+parameter_names = ("design_type", "ranges", "point_count", "batch_size", "trial_max_length", "totalpop", "methylatedpop", "unmethylatedpop",
+                   "SwitchDirection", "chunk_size", "workers", "master_seed", "engine", "output_path")
+if "RUN_CONFIG" in globals():
+    globals().update(RUN_CONFIG.parameters(parameter_names))
+#-----------Rates Dictionary---------
+default_parameters = {"r_hm": 0.5,          #0
+                      "r_hm_m": 20/totalpop, #1
+                      "r_hm_h": 10/totalpop, #2
+                      "r_uh": 0.35,         #3
+                      "r_uh_m": 11/totalpop,#4
+                      "r_uh_h": 5.5/totalpop,#5
+                      "r_mh": 0.1,           #6
+                      "r_mh_u": 10/totalpop, #7
+                      "r_mh_h": 5/totalpop,  #8
+                      "r_hu": 0.1,            #9
+                      "r_hu_u": 10/totalpop, #10
+                      "r_hu_h": 5/totalpop,   #11
+                      "birth_rate": 1         #12
+}
+
+#rates from the run config replace the defaults above
+if "RUN_CONFIG" in globals():
+    default_parameters.update(RUN_CONFIG.rates(default_parameters))
+
+parameter_labels = ["r_hm", "r_hm_m","r_hm_h", "r_uh", "r_uh_m", "r_uh_h", "r_mh", "r_mh_u", "r_mh_h", "r_hu", "r_hu_u", "r_hu_h", "birth_rate"]
+
+#this line creates a numpy array with the same values as the dictionary - it is VITAL that they stay in the same order!!
+#changing the order of either the labels or the stuff in this list will create subtle errors in the rate calculations!
+default_arr = np.array([default_parameters[key] for key in parameter_labels])
+
+#-----------design-----------
+unknown_labels = set(ranges) - set(parameter_labels)
+if unknown_labels:
+    raise ValueError(f"unknown rates in ranges: {sorted(unknown_labels)}")
+if master_seed is None:
+    master_seed = seeding.new_master_seed()
+print("Master seed: ", master_seed)
+
+labels = list(ranges)
+axes = None
+if design_type == "grid":
+    points, axes = design.grid_design(ranges)
+elif design_type == "lhs":
+    points = design.latin_hypercube_design({label: ranges[label][:2] for label in labels}, point_count, np.random.default_rng(master_seed))
+elif design_type == "sobol":
+    points = design.sobol_design({label: ranges[label][:2] for label in labels}, point_count, np.random.default_rng(master_seed))
+else:
+    raise ValueError("design_type must be 'grid', 'lhs' or 'sobol'")
+print(f"{design_type} design over {labels}: {len(points)} points, {len(points) * batch_size} runs")
+
+#-----------simulation-----------
+#every point of the design is scheduled through the same pool of workers
+output_array, chunk_timings = design.run_design_sweep(default_arr, parameter_labels, labels, points, totalpop, methylatedpop, unmethylatedpop, SwitchDirection,
+                                                      batch_size, trial_max_length, chunk_size, workers, master_seed, 0, engine)
+scheduler.print_timing_report(chunk_timings, len(points))
+
+#-----------postprocessing-----------
+arrays, dims, coords = design.labelled_results(design.summarize(output_array), labels, points, axes)
+metadata = {"design_type": design_type, "batch_size": batch_size, "trial_max_length": trial_max_length, "totalpop": totalpop,
+            "methylatedpop": methylatedpop, "unmethylatedpop": unmethylatedpop, "SwitchDirection": SwitchDirection,
+            "master_seed": int(master_seed), "default_parameters": default_parameters}
+design.save_labelled(output_path, arrays, dims, coords, metadata)
+print("Results saved to", output_path, "with dimensions", dims)
+
+#-----------graphing-----------
+plt.close()
+direction_str = 'M -> U' if SwitchDirection == -1 else 'U -> M'
+run_stats = f"{design_type} design, {batch_size} runs per point, at most {trial_max_length} steps each"
+if axes is not None and len(labels) == 2:
+    #a 2D grid is shown as an image of the mean switching time
+    plt.pcolormesh(coords[labels[0]], coords[labels[1]], arrays["mean_switching_time"].T, shading='nearest', cmap='viridis')
+    plt.colorbar(label='mean switching time')
+elif len(labels) >= 2:
+    #otherwise the points are shown against the first two rates, coloured by their mean switching time
+    first, second = (coords[labels[0]], coords[labels[1]]) if axes is None else np.meshgrid(coords[labels[0]], coords[labels[1]], indexing="ij")[:2]
+    mean_time = arrays["mean_switching_time"] if axes is None else arrays["mean_switching_time"].reshape(len(coords[labels[0]]), len(coords[labels[1]]), -1).mean(axis=2)
+    plt.scatter(np.ravel(first), np.ravel(second), c=np.ravel(mean_time), cmap='viridis')
+    plt.colorbar(label='mean switching time')
+else:
+    plt.plot(coords[labels[0]], arrays["mean_switching_time"], marker='.')
+    plt.ylabel('mean switching time')
+plt.title(f"Mean switching time, {direction_str}\n" + run_stats)
+plt.xlabel('Value of parameter ' + labels[0])
+if len(labels) >= 2:
+    plt.ylabel('Value of parameter ' + labels[1])
+plt.show()
@@ -0,0 +1,183 @@
+import os
+import sys
+import queue
+import secrets
+import threading
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.connection import Listener, Client
+import gillespie_time
+import lockstep
+import scheduler
+import seeding
+
+"""
+Distributed sweeps, for sweeps that are too big for the threads of one machine.
+
+A sweep is cut into shards - the same (step, start, stop) chunks that scheduler.py uses - and each shard is sent to a backend as a small,
+self-contained task: the parameter array, the populations and the chunk's seed. Whoever runs the shard rebuilds its rate table and
+its generator from those, so a distributed sweep gives exactly the same output_array as scheduler.run_sweep with the same master seed.
+
+Backends:
+    ProcessPoolBackend - a pool of worker processes on this machine (mostly for testing, or to get around anything that holds the GIL)
+    SocketBackend      - listens on a network address, and hands shards to worker processes on any number of nodes.
+                         Start the workers with `python distributed.py worker HOST PORT AUTHKEY`
+Any object with a run(indexed_tasks) method that yields (index, times) pairs - or (index, exception) for a shard that failed - can be used as a backend.
+
+Security: multiprocessing.connection unpickles whatever an authenticated peer sends, so anyone who knows the authkey can run code on the coordinator
+and on the workers. SocketBackend only listens on this machine (127.0.0.1) unless it is given another address, and if it isn't given an authkey
+it makes a random one, which has to be passed to the workers. Only listen on a network that you trust.
+
+Fault tolerance: a shard whose worker dies, disconnects or times out comes back as lost, and run_distributed_sweep sends it out again,
+up to max_retries times. Any other error is an error in the shard itself (it would happen again on every worker), so it is raised straight away.
+"""
+
+#the errors that mean a shard was lost on the way (a dead worker process, a dropped connection or a time-out), rather than failed
+LOST_SHARD_ERRORS = (BrokenProcessPool, EOFError, OSError, TimeoutError)
+
+#the rate tables a worker process has built so far, by parameter array - most shards of a sweep share their point's table
+_rate_tables = {}
+
+#Runs one shard. task is a dictionary made by make_tasks, and the result is the array of stop-start switching times.
+def run_shard(task):
+    engine, epsilon = scheduler.parse_engine(task["engine"])
+    key = (tuple(task["param_arr"]), task["totalpop"], engine)
+    if key not in _rate_tables:
+        _rate_tables[key] = scheduler.rate_tables_for([task["param_arr"]], task["totalpop"], engine)[0]
+    rate_table = _rate_tables[key]
+    rng = np.random.default_rng(seeding.chunk_seed_sequence(task["master_seed"], task["stream"], task["step"], task["start"] // task["chunk_size"]))
+    run_count = task["stop"] - task["start"]
+    output = np.zeros(run_count)
+    if engine == "lockstep":
+        lockstep.GillespieLockstepFun(task["trial_max_length"], rate_table, task["totalpop"], task["methylatedpop"], task["unmethylatedpop"], task["SwitchDirection"], output, rng)
+        return output
+    if engine == "tauleap":
+        gillespie_time.GillespieTauLeapChunkFun(task["trial_max_length"], rate_table, task["totalpop"], task["methylatedpop"], task["unmethylatedpop"], task["SwitchDirection"],
+                                                epsilon, output, rng)
+        return output
+    gillespie_time.GillespieChunkFun(task["trial_max_length"], rate_table, task["totalpop"], task["methylatedpop"], task["unmethylatedpop"], task["SwitchDirection"], output, rng)
+    return output
+
+#Makes one task per chunk of the sweep
+def make_tasks(param_arrs, totalpop, methylatedpop, unmethylatedpop, SwitchDirection, batch_size, trial_max_length, chunk_size, master_seed, stream, engine):
+    tasks = []
+    for step, start, stop in scheduler.make_chunks(len(param_arrs), batch_size, chunk_size):
+        tasks.append({"param_arr": [float(value) for value in param_arrs[step]], "totalpop": int(totalpop), "methylatedpop": int(methylatedpop),
+                      "unmethylatedpop": int(unmethylatedpop), "SwitchDirection": int(SwitchDirection), "trial_max_length": int(trial_max_length),
+                      "step": step, "start": start, "stop": stop, "chunk_size": int(chunk_size), "master_seed": int(master_seed), "stream": int(stream),
+                      "engine": engine})
+    return tasks
+
+class ProcessPoolBackend:
+    """Runs shards on a pool of worker processes on this machine. If a worker process dies, its shards are reported as lost
+    and the pool is started again for the next round."""
+    def __init__(self, workers=None):
+        self.workers = workers if workers is not None else os.cpu_count()
+
+    def run(self, indexed_tasks):
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            futures = {pool.submit(run_shard, task): index for index, task in indexed_tasks}
+            for future in as_completed(futures):
+                try:
+                    yield futures[future], future.result()
+                except Exception as error:
+                    yield futures[future], error
+
+class SocketBackend:
+    """Hands shards out to worker processes that connect over the network (see serve_worker). Each worker gets one shard at a time;
+    a worker that disconnects, or doesn't answer within shard_timeout seconds, is dropped and its shard is reported as lost.
+    Workers can join at any time, including part-way through a sweep.
+    Without an authkey, a random one is made - it is kept in self.authkey (as text) for passing on to the workers."""
+    def __init__(self, address=("127.0.0.1", 6000), authkey=None, shard_timeout=3600):
+        if authkey is None:
+            authkey = secrets.token_hex(16).encode()
+        self.authkey = authkey.decode()
+        self.listener = Listener(address, authkey=authkey)
+        self.shard_timeout = shard_timeout
+        self.tasks = queue.Queue()
+        self.results = queue.Queue()
+        self.connections = []
+        threading.Thread(target=self._accept_workers, daemon=True).start()
+
+    def _accept_workers(self):
+        while True:
+            try:
+                connection = self.listener.accept()
+            except OSError:
+                return
+            self.connections.append(connection)
+            threading.Thread(target=self._serve, args=(connection,), daemon=True).start()
+
+    #feeds one worker connection until it fails - the shard it was working on goes back to the coordinator as lost
+    def _serve(self, connection):
+        while True:
+            index, task = self.tasks.get()
+            try:
+                connection.send(task)
+                if not connection.poll(self.shard_timeout):
+                    raise TimeoutError(f"worker took longer than {self.shard_timeout}s")
+                self.results.put((index, connection.recv()))
+            except Exception as error:
+                self.results.put((index, error))
+                connection.close()
+                return
+
+    def run(self, indexed_tasks):
+        indexed_tasks = list(indexed_tasks)
+        for indexed_task in indexed_tasks:
+            self.tasks.put(indexed_task)
+        for _ in range(len(indexed_tasks)):
+            yield self.results.get()
+
+    #stops listening, and disconnects the workers so they exit
+    def close(self):
+        self.listener.close()
+        for connection in self.connections:
+            connection.close()
+
+#Worker loop for SocketBackend - connects to the coordinator at address and runs shards until the coordinator goes away.
+#A shard that raises an error sends the error back, so the coordinator can tell it apart from a lost worker.
+def serve_worker(address, authkey):
+    connection = Client(address, authkey=authkey)
+    try:
+        while True:
+            task = connection.recv()
+            try:
+                result = run_shard(task)
+            except Exception as error:
+                result = error
+            connection.send(result)
+    except (EOFError, OSError):
+        pass
+
+#Runs a sweep on a backend, and merges the shards into the same (step_count, batch_size) output_array as scheduler.run_sweep.
+#Lost shards (see LOST_SHARD_ERRORS) are sent out again, up to max_retries times each, before giving up with a RuntimeError.
+#Any other error from a shard is raised as it is.
+def run_distributed_sweep(backend, param_arrs, totalpop, methylatedpop, unmethylatedpop, SwitchDirection, batch_size, trial_max_length,
+                          chunk_size=250, master_seed=None, stream=0, engine="compiled", max_retries=3):
+    if master_seed is None:
+        master_seed = seeding.new_master_seed()
+    tasks = make_tasks(param_arrs, totalpop, methylatedpop, unmethylatedpop, SwitchDirection, batch_size, trial_max_length, chunk_size, master_seed, stream, engine)
+    output_array = np.zeros(shape=(len(param_arrs), batch_size))
+    failures = np.zeros(len(tasks), dtype=np.int64)
+    pending = set(range(len(tasks)))
+    while len(pending) > 0:
+        for index, result in backend.run([(index, tasks[index]) for index in sorted(pending)]):
+            if isinstance(result, Exception):
+                if not isinstance(result, LOST_SHARD_ERRORS):
+                    raise result
+                failures[index] += 1
+                print(f"Shard {index} was lost ({result!r}), attempt {failures[index]} of {max_retries + 1}")
+                if failures[index] > max_retries:
+                    raise RuntimeError(f"shard {index} failed {failures[index]} times") from result
+                continue
+            output_array[tasks[index]["step"], tasks[index]["start"]:tasks[index]["stop"]] = result
+            pending.discard(index)
+    return output_array
+
+if __name__ == "__main__":
+    #python distributed.py worker HOST PORT AUTHKEY - the authkey is the one the coordinator printed (or was given)
+    if len(sys.argv) != 5 or sys.argv[1] != "worker":
+        sys.exit("usage: python distributed.py worker HOST PORT AUTHKEY")
+    serve_worker((sys.argv[2], int(sys.argv[3])), sys.argv[4].encode())
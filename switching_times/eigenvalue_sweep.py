@@ -0,0 +1,113 @@
+import numpy as np
+import markov_time
+import matplotlib.pyplot as plt
+import time
+
+"""
+Maps the exponential parameters of both switching directions over a dense grid of parameter values,
+using the slowest relaxation rate of the Markov chain instead of simulating (see markov_time.switching_rate_sweep).
+
+Each point takes about 50 ms for 100 sites (a sparse LU factorization per point), so the default 10,000 values take about 8 minutes -
+this is useful for finding narrow features like the window where both exponential parameters are equal.
+The rates come from a two-basin approximation, so check them against twoway_simulation_time.py (or markov_time.exact_sweep)
+in the regions you care about. The spectral gap line shows where the two basins are well separated (bigger is better), but even with a
+clear gap the values can be well off the mean switching times near the transition - at birth_rate = 0.61 the M->U parameter is 133 here
+and 92.9 exactly (see markov_time.switching_rate_sweep).
+
+Edit the parameters in the `parameters` block.
+"""
+
+#-----------parameters - edit here-----------
+#the sweep will use step_count evenly spaced values of the target parameter between param_begin_val and param_end_val
+param_begin_val = 0.01
+param_end_val = 3
+step_count = 10000
+# define a parameter to vary - must be in the parameters dictionary
+param_to_change = "birth_rate"
+#define starting population (number of sites)
+totalpop = 100
+#-----------run config-----------
+#when this program is started by run.py, the values from the run config file replace the ones above (see run.py)
+#only the names in the parameters block can be set
+parameter_names = ("param_begin_val", "param_end_val", "step_count", "param_to_change", "totalpop")
+if "RUN_CONFIG" in globals():
+    globals().update(RUN_CONFIG.parameters(parameter_names))
+#-----------Rates Dictionary---------
+default_parameters = {"r_hm": 0.5,          #0
+                      "r_hm_m": 20/totalpop, #1
+                      "r_hm_h": 10/totalpop, #2
+                      "r_uh": 0.35,         #3
+                      "r_uh_m": 11/totalpop,#4
+                      "r_uh_h": 5.5/totalpop,#5
+                      "r_mh": 0.1,           #6
+                      "r_mh_u": 10/totalpop, #7
+                      "r_mh_h": 5/totalpop,  #8
+                      "r_hu": 0.1,            #9
+                      "r_hu_u": 10/totalpop, #10
+                      "r_hu_h": 5/totalpop,   #11
+                      "birth_rate": 1         #12
+}
+
+#rates from the run config replace the defaults above
+if "RUN_CONFIG" in globals():
+    default_parameters.update(RUN_CONFIG.rates(default_parameters))
+
+#This dictionary just matches each parameter to its place in the list.
+default_indices = {
+    "r_hm": 0,          
+    "r_hm_m": 1,
+    "r_hm_h": 2,
+    "r_uh": 3,
+    "r_uh_m": 4, 
+    "r_uh_h": 5,
+    "r_mh": 6,
+    "r_mh_u": 7,
+    "r_mh_h": 8,
+    "r_hu": 9,
+    "r_hu_u": 10,
+    "r_hu_h": 11,
+    "birth_rate": 12
+
+}
+
+parameter_labels = ["r_hm", "r_hm_m","r_hm_h", "r_uh", "r_uh_m", "r_uh_h", "r_mh", "r_mh_u", "r_mh_h", "r_hu", "r_hu_u", "r_hu_h", "birth_rate"]
+
+#this line creates a numpy array with the same values as the dictionary - it is VITAL that they stay in the same order!!
+#changing the order of either the labels or the stuff in this list will create subtle errors in the rate calculations!
+default_arr = np.array([default_parameters[key] for key in parameter_labels])
+#This line just calculates where the parameter we want to change occurs in the list
+index_to_change = default_indices[param_to_change]
+
+#the values of the parameter we are testing, and a copy of the default parameters for each of them
+step_array = np.linspace(param_begin_val, param_end_val, step_count)
+param_arrs = []
+for value in step_array:
+    temp_arr = default_arr.copy()
+    temp_arr[index_to_change] = value
+    param_arrs.append(temp_arr)
+
+#-----------Call solver-----------
+start = time.perf_counter()
+relaxation_rates, MtoU_rates, UtoM_rates, spectral_gaps = markov_time.switching_rate_sweep(param_arrs, totalpop)
+print(f"Solved {step_count} points in {time.perf_counter() - start:.1f}s")
+
+#the exponential parameter is the mean switching time, which is 1/rate
+exponential_parameters_MtoU = 1 / MtoU_rates
+exponential_parameters_UtoM = 1 / UtoM_rates
+
+#report where the two exponential parameters cross
+crossings = np.nonzero(np.diff(np.sign(exponential_parameters_MtoU - exponential_parameters_UtoM)))[0]
+for index in crossings:
+    print(f"Exponential parameters are equal between {param_to_change} = {step_array[index]:.5f} and {step_array[index+1]:.5f}")
+
+#-----------graphing-----------
+plt.close()
+plt.plot(step_array, exponential_parameters_MtoU, label="exponential parameter, M->U")
+plt.plot(step_array, exponential_parameters_UtoM, label="exponential parameter, U->M", linestyle='dashed')
+plt.plot(step_array, spectral_gaps, label="spectral gap", linestyle='dotted')
+plt.yscale('log')
+plt.title(f"Switching rates from the slowest relaxation of the chain\nPopulation = {totalpop}, {step_count} parameter values")
+plt.xlabel('Value of parameter '+ param_to_change)
+plt.ylabel('Exponential parameter of switching time distribution')
+plt.legend(loc='upper right')
+plt.show()
@@ -0,0 +1,147 @@
+import os
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from scipy import special
+import scipy.stats as stats
+
+"""
+Batched fitting of switching-time distributions.
+
+Fitting every sweep point separately with scipy (stats.expon.fit, the iterative stats.gamma.fit and three stats.kstest calls per point)
+often takes longer than the simulation itself. fit_sweep fits the whole output array at once instead:
+    - the runs of each point are masked to the ones that didn't time out (and, for sequential stopping, to the first run_counts[step] runs)
+    - exponential and normal fits use their closed-form maximum likelihood estimates (the same values stats.expon.fit(floc=0) and stats.norm.fit give)
+    - the gamma shape (with the location fixed at 0, like stats.gamma.fit(floc=0)) is found with a vectorized Newton solver on every point at once
+    - the KS statistics come from each point's sorted switching times, so each one is a single pass over the sorted array
+The points are split into blocks that are fitted on a pool of threads (numpy and scipy.special release the GIL for the heavy parts).
+
+Like the simulation programs, no fits are made at a point where more than half of the runs timed out - those values are NaN.
+
+For runs with a time horizon (see continuation.py), where unfinished runs are kept as censored observations, the censored fits use every run:
+censored_exponential_fit (closed form, with a chi-square interval), censored_gamma_fit, and the Kaplan-Meier survival curve (kaplan_meier).
+"""
+
+#Solves log(k) - digamma(k) = s for the gamma shape k, for every element of s at once (s > 0).
+#Starts from Minka's closed-form approximation, which is within a few percent, so a handful of Newton steps is enough.
+def gamma_shape_mle(s, tolerance=1e-12, max_iterations=50):
+    s = np.asarray(s, dtype=float)
+    shape = (3 - s + np.sqrt((s - 3)**2 + 24 * s)) / (12 * s)
+    for _ in range(max_iterations):
+        step = (np.log(shape) - special.digamma(shape) - s) / (1 / shape - special.polygamma(1, shape))
+        #never step to a shape of 0 or below - halve the shape instead
+        shape = np.where(shape - step > 0, shape - step, shape / 2)
+        if np.all(np.abs(step) <= tolerance * shape):
+            break
+    return shape
+
+#KS statistic of every row of sorted_times (sorted, padded at the end) against its fitted CDF values cdf, using the first counts[row] entries of each row
+def ks_statistic(cdf, counts):
+    position = np.arange(cdf.shape[1])[None, :]
+    inside = position < counts[:, None]
+    n = np.maximum(counts, 1)[:, None]
+    above = np.where(inside, (position + 1) / n - cdf, -np.inf).max(axis=1)
+    below = np.where(inside, cdf - position / n, -np.inf).max(axis=1)
+    return np.maximum(above, below)
+
+#Fits one block of rows - see fit_sweep
+def _fit_rows(times, run_counts):
+    valid = (times >= 0) & (np.arange(times.shape[1])[None, :] < run_counts[:, None])
+    valid_counts = valid.sum(axis=1)
+    enough = valid_counts > run_counts / 2
+    counts = np.where(enough, valid_counts, 0)
+    n = np.maximum(counts, 1)
+
+    #invalid runs are moved to the end of every row, so the first counts[row] entries are that row's sorted switching times
+    sorted_times = np.sort(np.where(valid, times, np.inf), axis=1)
+    inside = np.arange(times.shape[1])[None, :] < counts[:, None]
+    used = np.where(inside, sorted_times, 0.0)
+
+    mean = used.sum(axis=1) / n
+    sd = np.sqrt(np.where(inside, (sorted_times - mean[:, None])**2, 0.0).sum(axis=1) / n)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean_log = np.where(inside, np.log(np.where(inside, sorted_times, 1.0)), 0.0).sum(axis=1) / n
+        #s = log(mean) - mean(log(x)) is always positive unless every time is the same
+        s = np.log(np.where(enough, mean, 1.0)) - mean_log
+        solvable = enough & (s > 0) & np.isfinite(s)
+        shape = np.where(solvable, gamma_shape_mle(np.where(solvable, s, 1.0)), np.nan)
+        scale = mean / shape
+
+        exponential_cdf = -np.expm1(-used / mean[:, None])
+        normal_cdf = special.ndtr((used - mean[:, None]) / sd[:, None])
+        gamma_cdf = special.gammainc(np.where(solvable, shape, 1.0)[:, None], used / np.where(solvable, scale, 1.0)[:, None])
+
+    def only_enough(values):
+        return np.where(enough, values, np.nan)
+
+    return {"valid_counts": valid_counts,
+            "timeouts": run_counts - valid_counts,
+            "exponential_parameter": only_enough(mean),
+            "empirical_mean": only_enough(mean),
+            "normal_mean": only_enough(mean),
+            "normal_sd": only_enough(sd),
+            "gamma_shape": np.where(solvable, shape, np.nan),
+            "gamma_scale": np.where(solvable, scale, np.nan),
+            "exponential_KS": only_enough(ks_statistic(exponential_cdf, counts)),
+            "normal_KS": only_enough(ks_statistic(normal_cdf, counts)),
+            "gamma_KS": np.where(solvable, ks_statistic(gamma_cdf, counts), np.nan)}
+
+#Fits every row (sweep point) of output, a (step_count, batch_size) array of switching times where negative values are time-outs.
+#run_counts gives how many runs of each row were made (for sequential stopping) - by default, every run in the row.
+#returns a dictionary of name -> array with one value per sweep point:
+#    valid_counts, timeouts                         - runs that finished and runs that timed out
+#    exponential_parameter, empirical_mean          - the mean switching time (the exponential MLE, with the location at 0)
+#    normal_mean, normal_sd                         - the normal MLE
+#    gamma_shape, gamma_scale                       - the gamma MLE, with the location at 0
+#    exponential_KS, normal_KS, gamma_KS            - KS statistics of the three fits (not scaled)
+def fit_sweep(output, run_counts=None, workers=None, block_size=8):
+    output = np.asarray(output, dtype=float)
+    if run_counts is None:
+        run_counts = np.full(len(output), output.shape[1])
+    run_counts = np.asarray(run_counts, dtype=np.int64)
+    if workers is None:
+        workers = os.cpu_count()
+    blocks = [(start, min(start + block_size, len(output))) for start in range(0, len(output), block_size)]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(lambda block: _fit_rows(output[block[0]:block[1]], run_counts[block[0]:block[1]]), blocks))
+    if len(results) == 0:
+        return _fit_rows(output, run_counts)
+    return {name: np.concatenate([result[name] for result in results]) for name in results[0]}
+
+#Exponential fit with censored runs, for every row: times holds every run's time, and switched is 1 for the runs that switched (0 for censored ones).
+#The maximum likelihood scale is the total time of all runs divided by the number of switches. Its interval uses 2 * total / scale ~ chi-square(2 * switches).
+#returns the scale (the mean switching time) and the lower and upper ends of its `confidence` interval, one value per row (NaN where nothing switched)
+def censored_exponential_fit(times, switched, confidence=0.95):
+    switches = np.sum(switched, axis=-1)
+    total = np.sum(times, axis=-1)
+    degrees = np.maximum(2 * switches, 1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scale = np.where(switches > 0, total / switches, np.nan)
+        lower = np.where(switches > 0, 2 * total / stats.chi2.ppf((1 + confidence) / 2, degrees), np.nan)
+        upper = np.where(switches > 0, 2 * total / stats.chi2.ppf((1 - confidence) / 2, degrees), np.nan)
+    return scale, lower, upper
+
+#Gamma fit (location 0) with censored runs, for every row - see censored_exponential_fit.
+#The censored likelihood has no closed form, so every row is fitted with scipy.
+#returns the shape and scale, one value per row (NaN where fewer than two runs switched)
+def censored_gamma_fit(times, switched):
+    times = np.atleast_2d(times)
+    switched = np.atleast_2d(switched)
+    shape = np.full(len(times), np.nan)
+    scale = np.full(len(times), np.nan)
+    for row in range(len(times)):
+        finished = switched[row] == 1
+        if finished.sum() >= 2:
+            data = stats.CensoredData(uncensored=times[row, finished], right=times[row, ~finished])
+            shape[row], location, scale[row] = stats.gamma.fit(data, floc=0)
+    return shape, scale
+
+#Kaplan-Meier estimate of the survival curve (the probability of not having switched yet) of one point's runs.
+#returns the times at which runs switched and the survival just after each of them
+def kaplan_meier(times, switched):
+    order = np.argsort(times, kind="stable")
+    times = np.asarray(times)[order]
+    switched = np.asarray(switched)[order]
+    at_risk = len(times) - np.arange(len(times))
+    factors = np.where(switched == 1, 1 - 1 / at_risk, 1.0)
+    survival = np.cumprod(factors)
+    return times[switched == 1], survival[switched == 1]
@@ -1,5 +1,6 @@
 import numpy as np
-from numba import njit
+import numba
+from numba import njit, types
 import matplotlib.pyplot as plt
 
 """
@@ -11,43 +12,55 @@ This code does not support debugging toggles, and doesn't print output at the si
 There might be some weirdness with rng, see here: https://numba.readthedocs.io/en/stable/reference/pysupported.html
 """
 
-@njit
+#The kernels are cached on disk (in __pycache__), so they are only compiled the first time they are used - later runs load them in a fraction of a second.
+#The kernels that are called from python have explicit signatures, which means they are compiled (or loaded from the cache) as soon as this module is imported,
+#and a run never stops part-way to compile. Integers are int64, rates and times are float64, and arrays must be C-contiguous float64 arrays.
+rng_type = numba.typeof(np.random.default_rng())
+
+@njit(cache=True)
 def maintenance_rate_collaborative(methylated, unmethylated, site_count, param_local):
     hemimethylated = site_count - (methylated + unmethylated)
     return hemimethylated * (param_local[0] + param_local[2]*hemimethylated + param_local[1]*methylated)#r_hm param
     #rate = hemimethylated * (self.params["r_hm"] + self.params["r_hm_h"]*hemimethylated + self.params["r_hm_m"]*methylated)
-@njit
+@njit(cache=True)
 def denovo_rate_collaborative(methylated, unmethylated, site_count, param_local):
     hemimethylated = site_count - (methylated + unmethylated)
     return unmethylated * (param_local[3] + param_local[5]*hemimethylated + param_local[4]*methylated)
     #rate = unmethylated * (self.params["r_uh"] + self.params["r_uh_h"]*hemimethylated + self.params["r_uh_m"]*methylated)
-@njit
+@njit(cache=True)
 def demaintenance_rate_collaborative(methylated, unmethylated, site_count, param_local):
     hemimethylated = site_count - (methylated + unmethylated)
     return hemimethylated * (param_local[9] + param_local[11]*hemimethylated + param_local[10]*unmethylated)
     #rate = hemimethylated * (self.params["r_hu"] + self.params["r_hu_h"]*hemimethylated + self.params["r_hu_u"]*unmethylated)
-@njit
+@njit(cache=True)
 def demethylation_rate_collaborative(methylated, unmethylated, site_count, param_local):
     hemimethylated = site_count - (methylated + unmethylated)
     return methylated * (param_local[6] + param_local[8]*hemimethylated + param_local[7]*unmethylated)
     #rate = methylated * (self.params["r_mh"] + self.params["r_mh_h"]*hemimethylated + self.params["r_mh_u"]*unmethylated)
-@njit
+@njit(cache=True)
 def birth_rate(param_local):
       return param_local[12]
 
-#Helper function that finds the state of the model for given site_count
+#Helper function that finds the integer count a state has to exceed to be more than 70% of site_count.
+#Counts are integers, so "count/site_count > 0.7" is the same as "count > floor(0.7*site_count)" - computing
+#this once per run means find_state never has to divide or use floats.
+@njit(cache=True)
+def state_threshold(site_count):
+      return (7 * site_count) // 10
+
+#Helper function that finds the state of the model, given the threshold from state_threshold
 #1 means >70% methylated, -1 means >70% unmethylated, 0 means somewhere in the middle
-@njit
-def find_state(methylated, unmethylated, site_count):
-      if (methylated/ site_count) > 0.7:
+@njit(cache=True)
+def find_state(methylated, unmethylated, threshold):
+      if methylated > threshold:
             return 1
-      if (unmethylated/ site_count) > 0.7:
+      if unmethylated > threshold:
             return -1
       return 0
 
 #This function defines the events that can happen. It's equivalent to the event list in config.py
 #i_local indicates which loop called this function - that is, i_local indicates which event we're doing.
-@njit
+@njit(cache=True)
 def events(methylated, unmethylated, totalpop, i_local, rng_local):
     #maintenance event
     if i_local == 0:
@@ -67,21 +80,118 @@ def events(methylated, unmethylated, totalpop, i_local, rng_local):
         newly_unmethylated = rng_local.binomial(hemimethylated, 0.5)
         return 0, (unmethylated + newly_unmethylated)
 
-@njit
+#Builds a table of cumulative event rates for every (methylated, unmethylated) state.
+#rate_table[m, u, k] holds the summed rates of events 0..k in state (m, u), so rate_table[m, u, 4] is the total rate.
+#Since totalpop is fixed, only the (totalpop+1)(totalpop+2)/2 states with m + u <= totalpop are reachable (5151 for 100 sites),
+#so the table only has to be built once per parameter vector and can be shared by every run that uses those parameters.
+#Unreachable entries (m + u > totalpop) are left at zero.
+@njit((types.float64[::1], types.int64), cache=True)
+def build_rate_table(param_arr, totalpop):
+    rate_table = np.zeros((totalpop+1, totalpop+1, 5))
+    for methylated in range(totalpop+1):
+        for unmethylated in range(totalpop+1-methylated):
+            rate_table[methylated, unmethylated, 0] = maintenance_rate_collaborative(methylated,unmethylated,totalpop,param_arr)
+            rate_table[methylated, unmethylated, 1] = rate_table[methylated, unmethylated, 0] + denovo_rate_collaborative(methylated,unmethylated,totalpop,param_arr)
+            rate_table[methylated, unmethylated, 2] = rate_table[methylated, unmethylated, 1] + demaintenance_rate_collaborative(methylated,unmethylated,totalpop,param_arr)
+            rate_table[methylated, unmethylated, 3] = rate_table[methylated, unmethylated, 2] + demethylation_rate_collaborative(methylated,unmethylated,totalpop,param_arr)
+            rate_table[methylated, unmethylated, 4] = rate_table[methylated, unmethylated, 3] + birth_rate(param_arr)
+    return rate_table
+
+#Picks the event that happens in state (methylated, unmethylated) with a short linear search through the cumulative rates
+#target should be a uniform random number scaled by the total rate of the state
+@njit(cache=True)
+def select_event(rate_table, methylated, unmethylated, target):
+    event_number = 0
+    while event_number < 4 and target >= rate_table[methylated, unmethylated, event_number]:
+        event_number += 1
+    return event_number
+
+@njit((types.int64, types.float64[::1], types.int64, types.int64, types.int64, types.int64, rng_type), cache=True)
 def GillespieSwitchFun(steps, param_arr, totalpop, pop_methyl, pop_unmethyl, SwitchDirection, rng):
-    methylated_arr = np.zeros(steps)
-    unmethylated_arr = np.zeros(steps)
+    #the current state is carried as three scalars instead of arrays - we only ever need the previous step,
+    #so nothing is allocated per call and steps only acts as the timeout
+    methylated = pop_methyl
+    unmethylated = pop_unmethyl
+    time = 0.0
+    threshold = state_threshold(totalpop)
+
+    #main loop - each generation or step is one iteration of this loop
+    for i in range(1, steps): #start at 1, since the first step is given by pop_methyl/pop_unmethyl
+
+        #find the cumulative rates of each event for the current parameters - kept as scalars like the state, so nothing is allocated
+        cumulative_0 = maintenance_rate_collaborative(methylated,unmethylated,totalpop,param_arr)
+        cumulative_1 = cumulative_0 + denovo_rate_collaborative(methylated,unmethylated,totalpop,param_arr)
+        cumulative_2 = cumulative_1 + demaintenance_rate_collaborative(methylated,unmethylated,totalpop,param_arr)
+        cumulative_3 = cumulative_2 + demethylation_rate_collaborative(methylated,unmethylated,totalpop,param_arr)
+        rate_sum = cumulative_3 + birth_rate(param_arr)
+
+        #find the expected wait for an event to happen
+        tau = rng.exponential(scale = 1/rate_sum)
+        time += tau
+
+        #select which event happens by comparing the cumulative (unnormalized) rates to a scaled random variable
+        uniform = rng.uniform() * rate_sum
+        if uniform < cumulative_0:
+            event_number = 0
+        elif uniform < cumulative_1:
+            event_number = 1
+        elif uniform < cumulative_2:
+            event_number = 2
+        elif uniform < cumulative_3:
+            event_number = 3
+        else:
+            event_number = 4
+        methylated, unmethylated = events(methylated, unmethylated, totalpop,event_number,rng)
+
+        # decide which state we are in - if we switched, this block will terminate the program
+        curr_state = find_state(methylated, unmethylated, threshold)
+        if curr_state == SwitchDirection:
+            return time
+        
+    #we timed out - return a negative value to indicate that this isn't a normal run.
+    return -1 * time
+
+#Same as GillespieSwitchFun, but reads the rates from a table made by build_rate_table instead of recomputing them,
+#so each step is one table lookup, one exponential draw and a short search. Use this when running a batch with the same parameters.
+@njit((types.int64, types.float64[:, :, ::1], types.int64, types.int64, types.int64, types.int64, rng_type), cache=True)
+def GillespieSwitchTableFun(steps, rate_table, totalpop, pop_methyl, pop_unmethyl, SwitchDirection, rng):
+    methylated = pop_methyl
+    unmethylated = pop_unmethyl
+    time = 0.0
+    threshold = state_threshold(totalpop)
+
+    for i in range(1, steps):
+        rate_sum = rate_table[methylated, unmethylated, 4]
+        time += rng.exponential(scale = 1/rate_sum)
+
+        event_number = select_event(rate_table, methylated, unmethylated, rng.uniform() * rate_sum)
+        methylated, unmethylated = events(methylated, unmethylated, totalpop,event_number,rng)
+
+        curr_state = find_state(methylated, unmethylated, threshold)
+        if curr_state == SwitchDirection:
+            return time
+
+    #we timed out - return a negative value to indicate that this isn't a normal run.
+    return -1 * time
+
+#Same as GillespieSwitchFun, but also records the whole trajectory. This is opt-in only, since the three arrays
+#of length steps are by far the most expensive part of a run - use it for debugging or plotting single runs.
+#returns the switching time (negative on a time-out) and the methylated, unmethylated and time arrays, trimmed to the steps taken
+@njit((types.int64, types.float64[::1], types.int64, types.int64, types.int64, types.int64, rng_type), cache=True)
+def GillespieSwitchTrajectoryFun(steps, param_arr, totalpop, pop_methyl, pop_unmethyl, SwitchDirection, rng):
+    #counts are stored as int16 (2 bytes each), which is plenty for any realistic number of sites
+    if totalpop > 32767:
+        raise ValueError("trajectory recording stores counts as int16, so totalpop must be at most 32767")
+    methylated_arr = np.zeros(steps, dtype=np.int16)
+    unmethylated_arr = np.zeros(steps, dtype=np.int16)
     methylated_arr[0] = pop_methyl 
     unmethylated_arr[0] = pop_unmethyl
     time_arr = np.zeros(steps) 
     time_arr[0] = 0 #initialize first value to zero to stay in sync with (un)methylated_arr
-    start_state = find_state(pop_methyl,pop_unmethyl, totalpop)
-    rates = np.zeros(5) #using numpy array may or may not be optimal here - possible refactor point
-
-    #main loop - each generation or step is one iteration of this loop
-    for i in range(1, steps): #start at 1, since the first step is given by pop_methyl/pop_unmethyl
+    threshold = state_threshold(totalpop)
+    rates = np.zeros(5)
 
-        #find the rates of each event for the current parameters
+    for i in range(1, steps):
         rates[0] = maintenance_rate_collaborative(methylated_arr[i-1],unmethylated_arr[i-1],totalpop,param_arr)
         rates[1] = denovo_rate_collaborative(methylated_arr[i-1],unmethylated_arr[i-1],totalpop,param_arr)
         rates[2] = demaintenance_rate_collaborative(methylated_arr[i-1],unmethylated_arr[i-1],totalpop,param_arr)
@@ -89,27 +199,194 @@ def GillespieSwitchFun(steps, param_arr, totalpop, pop_methyl, pop_unmethyl, Swi
         rates[4] = birth_rate(param_arr)
         rate_sum = np.sum(rates)
 
-        #find the expected wait for an event to happen
         tau = rng.exponential(scale = 1/rate_sum)
         time_arr[i] = tau + time_arr[i-1]
 
-        #normalize the rates to be within (0,1)
-        normalized_rates= rates / rate_sum
-
-        #select which event happens by comparing the normalized rates to a random variable
         sum_so_far = 0
-        uniform = rng.uniform()
+        uniform = rng.uniform() * rate_sum
         for event_number in range(5):
-            if uniform < normalized_rates[event_number] + sum_so_far:
+            sum_so_far += rates[event_number]
+            if uniform < sum_so_far:
                 methylated_arr[i], unmethylated_arr[i] = events(methylated_arr[i-1], unmethylated_arr[i-1], totalpop,event_number,rng)
                 break
+
+        curr_state = find_state(methylated_arr[i], unmethylated_arr[i], threshold)
+        if curr_state == SwitchDirection:
+            return time_arr[i], methylated_arr[:i+1], unmethylated_arr[:i+1], time_arr[:i+1]
+
+    return -1 * time_arr[i], methylated_arr, unmethylated_arr, time_arr
+
+#Runs one chunk of a batch - fills output with switching times from GillespieSwitchTableFun, one run per entry.
+#nogil lets several chunks run at the same time from ordinary python threads (see scheduler.py),
+#so each chunk needs its own rng.
+@njit((types.int64, types.float64[:, :, ::1], types.int64, types.int64, types.int64, types.int64, types.float64[::1], rng_type), nogil=True, cache=True)
+def GillespieChunkFun(steps, rate_table, totalpop, pop_methyl, pop_unmethyl, SwitchDirection, output, rng):
+    for i in range(output.shape[0]):
+        output[i] = GillespieSwitchTableFun(steps, rate_table, totalpop, pop_methyl, pop_unmethyl, SwitchDirection, rng)
+
+#Resumable version of GillespieChunkFun for runs with a simulated-time horizon.
+#Each run's state is kept in methylated[i], unmethylated[i] and times[i] (its simulated time so far), and switched[i] is 1 once it has switched.
+#Every run that hasn't switched yet is continued from its state until it switches, reaches time_horizon, or has taken steps - 1 more events
+#(steps counts the starting state, like in GillespieSwitchTableFun).
+#A run that reaches the horizon is stopped at exactly time_horizon - the waiting times are memoryless, so continuing it later with a larger horizon
+#gives the same distribution as never having stopped it. Runs that haven't switched are censored: their time is a lower bound on their switching time.
+#With time_horizon = inf the draws are the same as GillespieSwitchTableFun's, so fresh runs get the same times as GillespieChunkFun with the same steps
+#and rng - including the runs that time out.
+@njit((types.int64, types.float64, types.float64[:, :, ::1], types.int64, types.int64, types.int64[::1], types.int64[::1], types.float64[::1], types.int8[::1], rng_type), nogil=True, cache=True)
+def GillespieCensoredChunkFun(steps, time_horizon, rate_table, totalpop, SwitchDirection, methylated, unmethylated, times, switched, rng):
+    threshold = state_threshold(totalpop)
+    for i in range(times.shape[0]):
+        if switched[i] == 1:
+            continue
+        run_methylated = methylated[i]
+        run_unmethylated = unmethylated[i]
+        time = times[i]
+        for step in range(1, steps):
+            rate_sum = rate_table[run_methylated, run_unmethylated, 4]
+            tau = rng.exponential(scale = 1/rate_sum)
+            if time + tau > time_horizon:
+                time = time_horizon
+                break
+            time += tau
+
+            event_number = select_event(rate_table, run_methylated, run_unmethylated, rng.uniform() * rate_sum)
+            run_methylated, run_unmethylated = events(run_methylated, run_unmethylated, totalpop, event_number, rng)
+
+            if find_state(run_methylated, run_unmethylated, threshold) == SwitchDirection:
+                switched[i] = 1
+                break
+        methylated[i] = run_methylated
+        unmethylated[i] = run_unmethylated
+        times[i] = time
+
+#Largest leap that keeps the expected change and the standard deviation of the change of one species below epsilon * count / 2
+#(the rates are quadratic in the counts, so a relative change of epsilon / 2 in a count changes the rates by about epsilon).
+#mean and variance are the mean and variance of the species' change per unit time. The bound never goes below one site.
+@njit(cache=True)
+def species_leap(count, mean, variance, epsilon):
+    bound = max(epsilon * count / 2, 1.0)
+    leap = np.inf
+    if mean != 0:
+        leap = bound / abs(mean)
+    if variance > 0:
+        leap = min(leap, bound * bound / variance)
+    return leap
+
+#Tau-leaping run for GillespieTauLeapFun (below) and GillespieTauLeapCensoredChunkFun: continues a run from (methylated, unmethylated) at `time`
+#for at most `steps` steps, stopping when it switches or reaches time_horizon (a leap that would pass the horizon is cut short at it).
+#returns the final methylated and unmethylated counts, the time, and whether the run switched
+@njit(cache=True)
+def tau_leap_run(steps, time_horizon, param_arr, totalpop, methylated, unmethylated, time, SwitchDirection, epsilon, rng):
+    threshold = state_threshold(totalpop)
+    births = birth_rate(param_arr)
+    #the waiting time to the next birth is memoryless, so a continued run can draw a new one
+    next_birth = time + rng.exponential(scale = 1/births) if births > 0 else np.inf
+    rates = np.zeros(4)
+
+    for i in range(steps):
+        hemimethylated = totalpop - (methylated + unmethylated)
+        rates[0] = maintenance_rate_collaborative(methylated,unmethylated,totalpop,param_arr)
+        rates[1] = denovo_rate_collaborative(methylated,unmethylated,totalpop,param_arr)
+        rates[2] = demaintenance_rate_collaborative(methylated,unmethylated,totalpop,param_arr)
+        rates[3] = demethylation_rate_collaborative(methylated,unmethylated,totalpop,param_arr)
+        rate_sum = rates[0] + rates[1] + rates[2] + rates[3]
+        to_horizon = False
+
+        tau = 0.0
+        if epsilon > 0:
+            tau = min(species_leap(methylated, rates[0] - rates[3], rates[0] + rates[3], epsilon),
+                      species_leap(unmethylated, rates[2] - rates[1], rates[1] + rates[2], epsilon),
+                      species_leap(hemimethylated, rates[1] + rates[3] - rates[0] - rates[2], rate_sum, epsilon))
+        #how far the count that decides the switch is from the threshold, and how far it could move in one leap
+        if SwitchDirection == 1:
+            distance = threshold + 1 - methylated
+            reach = abs(rates[0] - rates[3]) * tau + 3 * np.sqrt((rates[0] + rates[3]) * tau)
+        else:
+            distance = threshold + 1 - unmethylated
+            reach = abs(rates[2] - rates[1]) * tau + 3 * np.sqrt((rates[1] + rates[2]) * tau)
+
+        if tau * rate_sum < 10 or reach >= distance:
+            #exact single event - either the next methylation event or the next birth, whichever comes first
+            wait = rng.exponential(scale = 1/rate_sum) if rate_sum > 0 else np.inf
+            if min(time + wait, next_birth) > time_horizon:
+                time = time_horizon
+                break
+            if time + wait >= next_birth:
+                time = next_birth
+                methylated, unmethylated = events(methylated, unmethylated, totalpop, 4, rng)
+                next_birth = time + rng.exponential(scale = 1/births)
             else:
-                sum_so_far += normalized_rates[event_number]
+                time += wait
+                sum_so_far = 0.0
+                uniform = rng.uniform() * rate_sum
+                for event_number in range(4):
+                    sum_so_far += rates[event_number]
+                    if uniform < sum_so_far:
+                        methylated, unmethylated = events(methylated, unmethylated, totalpop, event_number, rng)
+                        break
+        else:
+            birth_in_leap = time + tau >= next_birth and next_birth <= time_horizon
+            if birth_in_leap:
+                tau = next_birth - time
+            elif time + tau > time_horizon:
+                tau = time_horizon - time
+                to_horizon = True
+            #a leap that would make a count negative is retried with half the length
+            while True:
+                new_methylated = methylated + rng.poisson(rates[0] * tau) - rng.poisson(rates[3] * tau)
+                new_unmethylated = unmethylated - rng.poisson(rates[1] * tau) + rng.poisson(rates[2] * tau)
+                if new_methylated >= 0 and new_unmethylated >= 0 and new_methylated + new_unmethylated <= totalpop:
+                    break
+                tau /= 2
+                birth_in_leap = False
+                to_horizon = False
+            methylated = new_methylated
+            unmethylated = new_unmethylated
+            time = time_horizon if to_horizon else time + tau
+            if birth_in_leap:
+                methylated, unmethylated = events(methylated, unmethylated, totalpop, 4, rng)
+                next_birth = time + rng.exponential(scale = 1/births)
 
-        # decide which state we are in - if we switched, this block will terminate the program
-        curr_state = find_state(methylated_arr[i], unmethylated_arr[i], totalpop)
+        curr_state = find_state(methylated, unmethylated, threshold)
         if curr_state == SwitchDirection:
-            return time_arr[i]
-        
+            return methylated, unmethylated, time, True
+        if to_horizon:
+            break
+
+    return methylated, unmethylated, time, False
+
+#Tau-leaping version of GillespieSwitchFun for large site counts, with the same collaborative rate functions.
+#Instead of one event at a time, each step leaps forward by tau and fires a Poisson number of each of the four methylation events.
+#tau is chosen from epsilon (Cao, Gillespie and Petzold's tau selection, on the methylated, unmethylated and hemimethylated counts) -
+#smaller epsilon is more accurate and slower, and epsilon = 0 is exact SSA.
+#It falls back to exact single events whenever a leap would only cover a few events, or could reach the 70% threshold of the target state,
+#so the switching time itself is found exactly. Birth has a constant rate, so the births are kept as their own exact clock:
+#a leap is cut short at the next birth, and the birth is applied exactly like in events.
+#returns the switching time, or minus the time after `steps` steps (leaps and single events) if the run timed out
+@njit((types.int64, types.float64[::1], types.int64, types.int64, types.int64, types.int64, types.float64, rng_type), cache=True)
+def GillespieTauLeapFun(steps, param_arr, totalpop, pop_methyl, pop_unmethyl, SwitchDirection, epsilon, rng):
+    methylated, unmethylated, time, switched = tau_leap_run(steps - 1, np.inf, param_arr, totalpop, pop_methyl, pop_unmethyl, 0.0, SwitchDirection, epsilon, rng)
+    if switched:
+        return time
     #we timed out - return a negative value to indicate that this isn't a normal run.
-    return -1 * time_arr[i]
+    return -1 * time
+
+#Runs one chunk of a batch with GillespieTauLeapFun - like GillespieChunkFun, but from the parameter array instead of a rate table,
+#since a rate table for tens of thousands of sites would not fit in memory
+@njit((types.int64, types.float64[::1], types.int64, types.int64, types.int64, types.int64, types.float64, types.float64[::1], rng_type), nogil=True, cache=True)
+def GillespieTauLeapChunkFun(steps, param_arr, totalpop, pop_methyl, pop_unmethyl, SwitchDirection, epsilon, output, rng):
+    for i in range(output.shape[0]):
+        output[i] = GillespieTauLeapFun(steps, param_arr, totalpop, pop_methyl, pop_unmethyl, SwitchDirection, epsilon, rng)
+
+#Resumable tau-leaping version of GillespieCensoredChunkFun, for runs with a simulated-time horizon at large site counts (see continuation.py).
+#The run states are kept in the same arrays, and each run that hasn't switched is continued with tau_leap_run - until it switches,
+#reaches time_horizon, or has taken steps - 1 more steps (leaps and single events), like GillespieTauLeapFun.
+@njit((types.int64, types.float64, types.float64[::1], types.int64, types.int64, types.float64, types.int64[::1], types.int64[::1], types.float64[::1], types.int8[::1], rng_type), nogil=True, cache=True)
+def GillespieTauLeapCensoredChunkFun(steps, time_horizon, param_arr, totalpop, SwitchDirection, epsilon, methylated, unmethylated, times, switched, rng):
+    for i in range(times.shape[0]):
+        if switched[i] == 1:
+            continue
+        methylated[i], unmethylated[i], times[i], run_switched = tau_leap_run(steps - 1, time_horizon, param_arr, totalpop, methylated[i], unmethylated[i], times[i],
+                                                                              SwitchDirection, epsilon, rng)
+        if run_switched:
+            switched[i] = 1
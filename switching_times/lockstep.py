@@ -0,0 +1,80 @@
+import numpy as np
+import numba
+from numba import njit, types
+import gillespie_time
+
+"""
+Lockstep engine for batches of independent gillespie runs.
+
+Instead of running each simulation of a batch to the end one after another, the whole batch is stored as a structure of arrays
+(each run's state and time) and every run that is still going takes its next step before any run takes the one after it.
+The kernel is compiled with numba and releases the GIL, so it can be used in place of gillespie_time.GillespieChunkFun (see scheduler.py).
+Compared to the one-run-at-a-time kernel, each step is cheaper:
+    - each state is one flat index, methylated*(totalpop+1) + unmethylated, so its cumulative rates are one row of the flattened rate table
+      and events 0-3 (maintenance, denovo, demaintenance, demethylation) are a single addition to the index
+    - whether a state is switched is one look-up in a table made once per chunk, instead of find_state's comparisons
+    - the runs don't depend on each other, so the processor can overlap the table look-ups of neighbouring runs
+Runs that switch are swapped out of the active part of the arrays, so the work per step shrinks as the batch finishes.
+
+The results follow the same rules as gillespie_time.GillespieSwitchTableFun - switching times, with negative values for time-outs -
+but the random numbers are drawn in a different order, so the individual runs differ.
+"""
+
+rng_type = numba.typeof(np.random.default_rng())
+
+#Runs output.shape[0] identical gillespie simulations in lockstep, all starting from (pop_methyl, pop_unmethyl), and writes their switching times into output
+#(negative values mean that run timed out after `steps` steps).
+#Like gillespie_time.GillespieChunkFun, several chunks can run at the same time from python threads, each with its own rng.
+@njit((types.int64, types.float64[:, :, ::1], types.int64, types.int64, types.int64, types.int64, types.float64[::1], rng_type), nogil=True, cache=True)
+def GillespieLockstepFun(steps, rate_table, totalpop, pop_methyl, pop_unmethyl, SwitchDirection, output, rng):
+    width = totalpop + 1
+    flat_table = rate_table.reshape(width * width, 5)
+    #the change in the flat index for events 0-3 - births are handled separately
+    event_shift = np.array([width, -1, 1, -width])
+    threshold = gillespie_time.state_threshold(totalpop)
+    is_target = np.zeros(width * width, dtype=np.bool_)
+    for methylated in range(width):
+        for unmethylated in range(width - methylated):
+            is_target[methylated * width + unmethylated] = gillespie_time.find_state(methylated, unmethylated, threshold) == SwitchDirection
+
+    #the structure of arrays for the runs - the first `active` entries are the runs that are still going, and run_ids says where each one's result belongs
+    batch = output.shape[0]
+    run_ids = np.arange(batch)
+    state = np.full(batch, pop_methyl * width + pop_unmethyl, dtype=np.int64)
+    time = np.zeros(batch)
+    active = batch
+
+    for i in range(1, steps):
+        run = 0
+        while run < active:
+            flat_state = state[run]
+            rate_sum = flat_table[flat_state, 4]
+            time[run] += rng.standard_exponential() / rate_sum
+
+            #the same choice select_event makes, on the flat row
+            target = rng.random() * rate_sum
+            event_number = 0
+            while event_number < 4 and target >= flat_table[flat_state, event_number]:
+                event_number += 1
+            if event_number == 4:
+                methylated, unmethylated = gillespie_time.events(flat_state // width, flat_state % width, totalpop, event_number, rng)
+                flat_state = methylated * width + unmethylated
+            else:
+                flat_state += event_shift[event_number]
+
+            if is_target[flat_state]:
+                #record the switch, and move the last active run into this slot
+                output[run_ids[run]] = time[run]
+                active -= 1
+                run_ids[run] = run_ids[active]
+                state[run] = state[active]
+                time[run] = time[active]
+            else:
+                state[run] = flat_state
+                run += 1
+        if active == 0:
+            break
+
+    #anything left has timed out - return a negative value to indicate that this isn't a normal run.
+    for run in range(active):
+        output[run_ids[run]] = -1 * time[run]
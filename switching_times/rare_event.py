@@ -0,0 +1,231 @@
+import os
+import numpy as np
+import numba
+from numba import njit, types
+from concurrent.futures import ThreadPoolExecutor
+from scipy import stats
+import gillespie_time
+import seeding
+
+"""
+Forward flux sampling (FFS) for switches that are too rare to simulate directly.
+
+When a switch takes far longer than trial_max_length steps, almost every run times out and the simulation programs can't fit anything.
+FFS splits the switch into a chain of small steps along a reaction coordinate, and only simulates the pieces of trajectories that make progress.
+It uses the same dynamics as gillespie_time.GillespieSwitchTableFun (the same rate table, event selection and events).
+
+The reaction coordinate is lambda = SwitchDirection * (methylated - unmethylated), which grows as the system moves towards the target state.
+    - the starting basin A is lambda <= lambda_A, where lambda_A is the coordinate of the starting population
+    - the target B is the switched state, exactly as in the simulation (find_state(...) == SwitchDirection)
+    - the interfaces lambda_0 < lambda_1 < ... lie between them. Every state in B has lambda >= 2 * (threshold + 1) - totalpop,
+      so the last interface is at most that, and the last stage runs from it to B itself
+The flux stage runs ordinary trajectories from the starting population and records the state every time one leaves A and crosses lambda_0.
+The flux through lambda_0 is the number of crossings per unit time. Each later stage starts trials from the states
+recorded at the previous interface, and counts how many reach the next interface (or B) before falling back into A.
+Their successful end states are the starting states of the next stage.
+
+The switching rate is k = flux * P(lambda_1 | lambda_0) * ... * P(B | lambda_n). For a rare switch the switching time is exponential
+with mean 1/k - this is the regime FFS is for, since the time spent in A is much longer than the time the switch itself takes.
+The binomial error of the counts (1/crossings + sum over stages of (1 - p) / (p * trials)) is too small: the crossings of one
+flux trajectory are correlated, and every stage starts its trials from a resample of the previous stage's successes, so the trials share
+ancestors. run_ffs therefore makes several independent FFS runs (replicates) and takes the error from the spread of their rates.
+Checked against markov_time.exact_sweep in both directions (see benchmark_rare_event.py), the spread of single runs is up to about twice
+the binomial estimate, and with 10 replicates about 19 out of 20 of the 95% intervals cover the exact mean switching time.
+
+The flux trajectories and the trials of every stage are run in chunks on a pool of threads (the kernels release the GIL).
+Every chunk has its own generator, from seeding.chunk_seed_sequence(master_seed, stream, stage, chunk_number) with stage 0 for the flux
+(with the replicate number added to the spawn key for every replicate after the first), so a run is reproducible from its master seed
+whatever the number of threads.
+"""
+
+rng_type = numba.typeof(np.random.default_rng())
+
+#One Gillespie step, like GillespieSwitchTableFun - returns the new (methylated, unmethylated) and the time the step took
+@njit(cache=True)
+def ffs_step(rate_table, totalpop, methylated, unmethylated, rng):
+    rate_sum = rate_table[methylated, unmethylated, 4]
+    tau = rng.exponential(scale = 1/rate_sum)
+    event_number = gillespie_time.select_event(rate_table, methylated, unmethylated, rng.uniform() * rate_sum)
+    methylated, unmethylated = gillespie_time.events(methylated, unmethylated, totalpop, event_number, rng)
+    return methylated, unmethylated, tau
+
+#Flux stage: runs one trajectory from the starting population until it has crossed lambda_0 (coming from A) crossings.shape[0] times,
+#or max_steps steps have passed. The state just after every crossing is stored in crossings.
+#A trajectory that reaches B is restarted from the starting population.
+#returns the number of crossings and the simulated time
+@njit((types.float64[:, :, ::1], types.int64, types.int64, types.int64, types.int64, types.int64, types.int64, types.int64[:, ::1], types.int64, rng_type), nogil=True, cache=True)
+def FluxFun(rate_table, totalpop, pop_methyl, pop_unmethyl, SwitchDirection, lambda_A, lambda_0, crossings, max_steps, rng):
+    methylated = pop_methyl
+    unmethylated = pop_unmethyl
+    threshold = gillespie_time.state_threshold(totalpop)
+    in_basin = SwitchDirection * (methylated - unmethylated) <= lambda_A
+    crossing_count = 0
+    time = 0.0
+    for i in range(max_steps):
+        if crossing_count == crossings.shape[0]:
+            break
+        methylated, unmethylated, tau = ffs_step(rate_table, totalpop, methylated, unmethylated, rng)
+        time += tau
+        if gillespie_time.find_state(methylated, unmethylated, threshold) == SwitchDirection:
+            methylated = pop_methyl
+            unmethylated = pop_unmethyl
+            in_basin = SwitchDirection * (methylated - unmethylated) <= lambda_A
+            continue
+        coordinate = SwitchDirection * (methylated - unmethylated)
+        if coordinate <= lambda_A:
+            in_basin = True
+        elif in_basin and coordinate >= lambda_0:
+            crossings[crossing_count, 0] = methylated
+            crossings[crossing_count, 1] = unmethylated
+            crossing_count += 1
+            in_basin = False
+    return crossing_count, time
+
+#Whether a trial has reached lambda_next, or B if to_switch is 1
+@njit(cache=True)
+def reached_target(methylated, unmethylated, threshold, SwitchDirection, lambda_next, to_switch):
+    if to_switch == 1:
+        return gillespie_time.find_state(methylated, unmethylated, threshold) == SwitchDirection
+    return SwitchDirection * (methylated - unmethylated) >= lambda_next
+
+#Interface stage: runs one trial per row of ends, each from a random state in starts, until it reaches lambda_next
+#(or B, if to_switch is 1) or falls back to lambda_A. Trials that take more than max_steps steps count as unresolved.
+#A birth can carry the coordinate over several interfaces in one step, so a start can already be past lambda_next -
+#that trial is a success straight away, since its path crossed lambda_next in the same step as lambda_i.
+#The end states of the successful trials are stored in the first rows of ends.
+#returns the number of successful and unresolved trials
+@njit((types.float64[:, :, ::1], types.int64, types.int64, types.int64, types.int64, types.int64, types.int64[:, ::1], types.int64[:, ::1], types.int64, rng_type), nogil=True, cache=True)
+def InterfaceFun(rate_table, totalpop, SwitchDirection, lambda_A, lambda_next, to_switch, starts, ends, max_steps, rng):
+    threshold = gillespie_time.state_threshold(totalpop)
+    successes = 0
+    unresolved = 0
+    for trial in range(ends.shape[0]):
+        start_index = int(rng.random() * starts.shape[0])
+        methylated = starts[start_index, 0]
+        unmethylated = starts[start_index, 1]
+        steps = 0
+        while True:
+            if reached_target(methylated, unmethylated, threshold, SwitchDirection, lambda_next, to_switch):
+                ends[successes, 0] = methylated
+                ends[successes, 1] = unmethylated
+                successes += 1
+                break
+            if SwitchDirection * (methylated - unmethylated) <= lambda_A:
+                break
+            if steps == max_steps:
+                unresolved += 1
+                break
+            methylated, unmethylated, tau = ffs_step(rate_table, totalpop, methylated, unmethylated, rng)
+            steps += 1
+    return successes, unresolved
+
+#Evenly spaced interfaces between the starting population's coordinate and the edge of B
+def default_interfaces(totalpop, methylatedpop, unmethylatedpop, SwitchDirection, interface_count):
+    lambda_A = SwitchDirection * (methylatedpop - unmethylatedpop)
+    lambda_B = 2 * (gillespie_time.state_threshold(totalpop) + 1) - totalpop
+    return np.unique(np.round(np.linspace(lambda_A, lambda_B, interface_count + 1)[1:]).astype(np.int64))
+
+#One independent FFS run: the flux stage, then every interface stage. chunk_rng(stage, chunk_number) gives the generator of each chunk.
+#returns the rate, the flux, and the number of trials, successes and unresolved trials of every stage (stages after one with no successes have no trials)
+def ffs_replicate(rate_table, totalpop, methylatedpop, unmethylatedpop, SwitchDirection, lambda_A, interfaces, flux_crossings, trials_per_interface,
+                  chunk_size, max_steps, workers, chunk_rng):
+    #flux stage - one trajectory per chunk
+    flux_chunks = [(start, min(start + chunk_size, flux_crossings)) for start in range(0, flux_crossings, chunk_size)]
+    crossings = np.zeros((flux_crossings, 2), dtype=np.int64)
+    flux_results = [None] * len(flux_chunks)
+
+    def run_flux(chunk_number):
+        start, stop = flux_chunks[chunk_number]
+        flux_results[chunk_number] = FluxFun(rate_table, totalpop, methylatedpop, unmethylatedpop, SwitchDirection, lambda_A, interfaces[0],
+                                             crossings[start:stop], max_steps, chunk_rng(0, chunk_number))
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(run_flux, range(len(flux_chunks))))
+    crossing_count = sum(count for count, time in flux_results)
+    flux = crossing_count / sum(time for count, time in flux_results)
+    starts = np.concatenate([crossings[start:start + flux_results[number][0]] for number, (start, stop) in enumerate(flux_chunks)])
+
+    #interface stages - the last one runs to the switched state itself
+    targets = list(interfaces[1:]) + [None]
+    probabilities = np.zeros(len(targets))
+    trials = np.zeros(len(targets), dtype=np.int64)
+    successes = np.zeros(len(targets), dtype=np.int64)
+    unresolved = np.zeros(len(targets), dtype=np.int64)
+    trial_chunks = [(start, min(start + chunk_size, trials_per_interface)) for start in range(0, trials_per_interface, chunk_size)]
+    for stage, target in enumerate(targets):
+        if len(starts) == 0:
+            break
+        ends = np.zeros((trials_per_interface, 2), dtype=np.int64)
+        stage_results = [None] * len(trial_chunks)
+
+        def run_trials(chunk_number):
+            start, stop = trial_chunks[chunk_number]
+            stage_results[chunk_number] = InterfaceFun(rate_table, totalpop, SwitchDirection, lambda_A, -1 if target is None else target, 1 if target is None else 0,
+                                                       starts, ends[start:stop], max_steps, chunk_rng(stage + 1, chunk_number))
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(run_trials, range(len(trial_chunks))))
+        trials[stage] = trials_per_interface
+        successes[stage] = sum(result[0] for result in stage_results)
+        unresolved[stage] = sum(result[1] for result in stage_results)
+        probabilities[stage] = successes[stage] / trials_per_interface
+        starts = np.concatenate([ends[start:start + stage_results[number][0]] for number, (start, stop) in enumerate(trial_chunks)])
+
+    return flux * np.prod(probabilities), flux, trials, successes, unresolved
+
+#Estimates the switching rate from (methylatedpop, unmethylatedpop) towards SwitchDirection with forward flux sampling.
+#interfaces are the lambda values of the interfaces (by default interface_count evenly spaced ones, see default_interfaces).
+#Every one of the replicates independent FFS runs collects flux_crossings crossings of the first interface and runs trials_per_interface
+#trials at every stage, both chunk_size at a time. A trajectory or trial is given up after max_steps steps.
+#The rate is the mean of the replicates' rates, and its interval is a t interval from their spread.
+#returns a dictionary with:
+#    rate, mean_switching_time (1/rate), and their confidence_level intervals (rate_interval, mean_interval)
+#    replicate_rates, flux (the mean over the replicates), probabilities (pooled over the replicates, one per stage), interfaces,
+#    successes and unresolved (trials per stage that hit max_steps), both summed over the replicates
+def run_ffs(param_arr, totalpop, methylatedpop, unmethylatedpop, SwitchDirection, interfaces=None, interface_count=10, flux_crossings=1000,
+            trials_per_interface=1000, replicates=10, chunk_size=250, max_steps=10**8, workers=None, master_seed=None, stream=0, confidence_level=0.95):
+    if workers is None:
+        workers = os.cpu_count()
+    if master_seed is None:
+        master_seed = seeding.new_master_seed()
+    if replicates < 2:
+        raise ValueError("replicates must be at least 2 - the interval comes from the spread between them")
+    lambda_A = SwitchDirection * (methylatedpop - unmethylatedpop)
+    if interfaces is None:
+        interfaces = default_interfaces(totalpop, methylatedpop, unmethylatedpop, SwitchDirection, interface_count)
+    interfaces = np.asarray(interfaces, dtype=np.int64)
+    if len(interfaces) == 0 or interfaces[0] <= lambda_A or np.any(np.diff(interfaces) <= 0):
+        raise ValueError("interfaces must increase, and start above the starting population's coordinate " + str(lambda_A))
+    if interfaces[-1] > 2 * (gillespie_time.state_threshold(totalpop) + 1) - totalpop:
+        raise ValueError("the last interface must not be inside the switched state")
+    rate_table = gillespie_time.build_rate_table(np.asarray(param_arr, dtype=float), totalpop)
+
+    replicate_rates = np.zeros(replicates)
+    fluxes = np.zeros(replicates)
+    trials = np.zeros(len(interfaces), dtype=np.int64)
+    successes = np.zeros(len(interfaces), dtype=np.int64)
+    unresolved = np.zeros(len(interfaces), dtype=np.int64)
+    for replicate in range(replicates):
+        #replicate 0 uses the same generators as a single run always has, and every later replicate gets its own children of them
+        def chunk_rng(stage, chunk_number):
+            if replicate == 0:
+                return np.random.default_rng(seeding.chunk_seed_sequence(master_seed, stream, stage, chunk_number))
+            return np.random.default_rng(np.random.SeedSequence(master_seed, spawn_key=(stream, stage, chunk_number, replicate)))
+
+        replicate_rates[replicate], fluxes[replicate], replicate_trials, replicate_successes, replicate_unresolved = ffs_replicate(
+            rate_table, totalpop, methylatedpop, unmethylatedpop, SwitchDirection, lambda_A, interfaces, flux_crossings, trials_per_interface,
+            chunk_size, max_steps, workers, chunk_rng)
+        trials += replicate_trials
+        successes += replicate_successes
+        unresolved += replicate_unresolved
+
+    #the crossings of a flux trajectory are correlated, and every stage resamples the previous stage's successes, so the binomial error of
+    #the counts is too small - the spread between independent replicates includes all of that
+    rate = replicate_rates.mean()
+    half_width = stats.t.ppf((1 + confidence_level) / 2, replicates - 1) * replicate_rates.std(ddof=1) / np.sqrt(replicates)
+    rate_interval = (max(rate - half_width, 0.0), rate + half_width)
+    probabilities = successes / np.maximum(trials, 1)
+    return {"rate": rate, "mean_switching_time": 1 / rate if rate > 0 else np.inf,
+            "rate_interval": rate_interval, "mean_interval": (1 / rate_interval[1] if rate_interval[1] > 0 else np.inf, 1 / rate_interval[0] if rate_interval[0] > 0 else np.inf),
+            "replicate_rates": replicate_rates, "flux": fluxes.mean(), "probabilities": probabilities, "interfaces": interfaces,
+            "successes": successes, "unresolved": unresolved}
@@ -0,0 +1,132 @@
+import numpy as np
+import scipy.stats as stats
+import scheduler
+import seeding
+
+"""
+Adaptive refinement of a one-parameter sweep.
+
+Evenly spaced sweeps spend most of their runs where nothing is happening, while the interesting behaviour - the onset of time-outs,
+a sudden change in the switching time, or the point where the M->U and U->M switching times cross - happens in narrow windows.
+run_refined_sweep starts from a coarse set of points and then, round by round, adds the midpoints of the intervals where the results
+change the most, until no interval changes by more than `tolerance`, the intervals are down to min_spacing, or max_points points have been run.
+
+How much an interval changes is measured on each of these metrics, scaled by the metric's range over the current points, and the largest is used:
+    "mean"     - the mean switching time of the runs that didn't time out
+    "timeouts" - the fraction of runs that timed out
+    "ks"       - the KS statistic of the exponential fit
+Every metric is an estimate from a finite batch, so where a curve is flat the differences between neighbouring points are mostly sampling noise.
+A change only counts if it is larger than `significance` standard errors of the difference, sqrt(se_left^2 + se_right^2) - otherwise
+noise alone would make every interval look interesting, and the refinement would just bisect everything.
+An interval where a metric is only defined at one end (more than half of the runs timed out at the other) counts as a full change.
+When two directions are swept together, an interval where their mean switching times cross also counts as a full change.
+
+Every point gets its own random streams, numbered in the order the points were added, so a refined sweep is reproducible from its master seed.
+"""
+
+#Finds the metrics of one point from its switching times (negative values are time-outs), and their standard errors (name + "_se").
+#Like the simulation programs, the mean and KS statistic are NaN when more than half of the runs timed out.
+#    mean     - the standard error of the mean
+#    timeouts - the binomial standard error, from (timeouts + 1) / (runs + 2) so that a point with no time-outs doesn't get a standard error of 0
+#    ks       - 0.26 / sqrt(runs), the standard deviation of the KS statistic of a sample of that size that does follow the fitted distribution
+def point_metrics(times):
+    valid = times[times >= 0]
+    smoothed_timeouts = (len(times) - len(valid) + 1) / (len(times) + 2)
+    metrics = {"mean": np.nan, "timeouts": 1 - len(valid) / len(times), "ks": np.nan,
+               "mean_se": np.nan, "timeouts_se": np.sqrt(smoothed_timeouts * (1 - smoothed_timeouts) / len(times)), "ks_se": np.nan}
+    if len(valid) > len(times) / 2:
+        metrics["mean"] = valid.mean()
+        metrics["ks"] = stats.kstest(valid, 'expon', args=(0, metrics["mean"])).statistic
+        metrics["mean_se"] = valid.std(ddof=1) / np.sqrt(len(valid)) if len(valid) > 1 else np.inf
+        metrics["ks_se"] = 0.26 / np.sqrt(len(valid))
+    return metrics
+
+#Scores every interval between neighbouring points (values must be sorted) by how much the metrics change across it.
+#metric_values is a list with one dictionary of metric name -> array over the points for each direction, with the standard errors under name + "_se".
+#Changes smaller than `significance` standard errors of the difference score 0.
+def interval_scores(metric_values, metrics, significance=3.0):
+    scores = np.zeros(len(metric_values[0]["timeouts"]) - 1)
+    for direction_values in metric_values:
+        for name in metrics:
+            values = direction_values[name]
+            standard_errors = direction_values[name + "_se"]
+            change = np.zeros(len(scores))
+            if np.any(~np.isnan(values)):
+                span = np.nanmax(values) - np.nanmin(values)
+                if span > 0:
+                    difference = np.abs(np.diff(values))
+                    with np.errstate(invalid="ignore"):
+                        significant = difference > significance * np.sqrt(standard_errors[:-1]**2 + standard_errors[1:]**2)
+                    change = np.where(significant, np.nan_to_num(difference / span), 0.0)
+            #the metric appears or disappears inside this interval, so something is changing quickly there
+            one_sided = np.isnan(values[:-1]) != np.isnan(values[1:])
+            scores = np.maximum(scores, np.where(one_sided, 1.0, change))
+    if len(metric_values) == 2:
+        difference = metric_values[0]["mean"] - metric_values[1]["mean"]
+        crossing = np.sign(difference[:-1]) * np.sign(difference[1:]) < 0
+        scores = np.where(crossing, 1.0, scores)
+    return scores
+
+#Runs batch_size runs at each of the given parameter values, for every direction.
+#point_ids give each point's number for seeding, and directions is a list of (methylatedpop, unmethylatedpop, SwitchDirection) -
+#direction d uses random stream d
+#returns one (len(values), batch_size) array of switching times per direction
+def run_points(default_arr, index_to_change, values, point_ids, directions, totalpop, batch_size, trial_max_length, chunk_size, workers, master_seed, engine):
+    param_arrs = []
+    for value in values:
+        temp_arr = default_arr.copy()
+        temp_arr[index_to_change] = value
+        param_arrs.append(temp_arr)
+    chunks = scheduler.make_chunks(len(values), batch_size, chunk_size)
+    seed_chunks = [(point_ids[step], start, stop) for step, start, stop in chunks]
+    outputs = []
+    for stream, (methylatedpop, unmethylatedpop, SwitchDirection) in enumerate(directions):
+        rngs = seeding.chunk_generators(master_seed, seed_chunks, chunk_size, stream)
+        output_array, chunk_timings = scheduler.run_sweep(param_arrs, totalpop, methylatedpop, unmethylatedpop, SwitchDirection, batch_size, trial_max_length,
+                                                          chunk_size, workers, rngs, engine)
+        outputs.append(output_array)
+    return outputs
+
+#Runs an adaptively refined sweep of parameter index_to_change, starting from initial_values.
+#directions is a list of (methylatedpop, unmethylatedpop, SwitchDirection) - one for a normal sweep, or two to also refine where they cross.
+#Each round adds up to points_per_round midpoints (by default, as many as there were initial values).
+#significance is how many standard errors a change between neighbouring points has to be before it counts (see interval_scores).
+#returns the sorted parameter values and one (point_count, batch_size) array of switching times per direction, in the same order
+def run_refined_sweep(default_arr, index_to_change, initial_values, directions, totalpop, batch_size, trial_max_length, max_points,
+                      min_spacing=0.0, tolerance=0.05, metrics=("mean", "timeouts", "ks"), points_per_round=None,
+                      chunk_size=250, workers=None, master_seed=None, engine="compiled", significance=3.0):
+    if master_seed is None:
+        master_seed = seeding.new_master_seed()
+    if points_per_round is None:
+        points_per_round = len(initial_values)
+    values = np.array(initial_values, dtype=float)
+    outputs = run_points(default_arr, index_to_change, values, np.arange(len(values)), directions, totalpop, batch_size, trial_max_length,
+                         chunk_size, workers, master_seed, engine)
+    round_number = 0
+
+    while len(values) < max_points:
+        order = np.argsort(values)
+        values = values[order]
+        outputs = [output_array[order] for output_array in outputs]
+        metric_values = []
+        for output_array in outputs:
+            point_values = [point_metrics(row) for row in output_array]
+            metric_values.append({name: np.array([point[name] for point in point_values]) for name in point_values[0]})
+        scores = interval_scores(metric_values, metrics, significance)
+        #an interval can only be split if both halves would still be at least min_spacing wide
+        eligible = (np.diff(values) >= 2 * min_spacing) & (scores > tolerance)
+        if not eligible.any():
+            break
+        candidates = np.flatnonzero(eligible)
+        chosen = candidates[np.argsort(-scores[candidates], kind="stable")][:min(points_per_round, max_points - len(values))]
+        new_values = (values[chosen] + values[chosen + 1]) / 2
+        round_number += 1
+        print(f"Refinement round {round_number}: adding {len(new_values)} points at {np.round(np.sort(new_values), 5)}")
+
+        new_outputs = run_points(default_arr, index_to_change, new_values, np.arange(len(values), len(values) + len(new_values)), directions, totalpop,
+                                 batch_size, trial_max_length, chunk_size, workers, master_seed, engine)
+        values = np.concatenate((values, new_values))
+        outputs = [np.concatenate((output_array, new_output)) for output_array, new_output in zip(outputs, new_outputs)]
+
+    order = np.argsort(values)
+    return values[order], [output_array[order] for output_array in outputs]
@@ -0,0 +1,114 @@
+import os
+import json
+import hashlib
+import tempfile
+import numpy as np
+import scheduler
+import seeding
+
+"""
+Persistent, content-addressed store for the switching times of sweep points.
+
+Each sweep point is saved as its own compressed .npz file, named by a hash of everything that determines its results:
+the parameter array, the site count, the starting populations, SwitchDirection, trial_max_length, the master seed and stream,
+the chunk size and the engine. Two sweeps that share a point - for example 0-3 and 0-4 with the same step size - therefore share its file,
+and a later sweep only simulates the points that are missing, or the extra runs when it asks for a bigger batch than was saved.
+
+The random streams of a stored point are keyed by the point itself rather than by its position in the sweep
+(see point_seed_step), so the cached runs of a point are the same whichever sweep it was first computed in.
+This means a cached sweep does not give the same numbers as scheduler.run_sweep with the same master seed, but it is just as reproducible.
+"""
+
+#Returns the hex key of one sweep point - the sha256 of a canonical description of everything that affects its results
+def point_key(param_arr, totalpop, methylatedpop, unmethylatedpop, SwitchDirection, trial_max_length, master_seed, stream=0, chunk_size=250, engine="compiled"):
+    description = {
+        "param_arr": [float(value).hex() for value in param_arr],
+        "totalpop": int(totalpop),
+        "methylatedpop": int(methylatedpop),
+        "unmethylatedpop": int(unmethylatedpop),
+        "SwitchDirection": int(SwitchDirection),
+        "trial_max_length": int(trial_max_length),
+        "master_seed": int(master_seed),
+        "stream": int(stream),
+        "chunk_size": int(chunk_size),
+        "engine": engine,
+    }
+    return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+#The `step` used to seed a stored point's chunks (see seeding.chunk_seed_sequence) - taken from its key,
+#so it doesn't change when the point moves to a different place in a sweep
+def point_seed_step(key):
+    return int(key[:16], 16)
+
+def point_path(store_dir, key):
+    return os.path.join(store_dir, key + ".npz")
+
+#Returns the saved switching times of a point, or None if it isn't in the store
+def load_point(store_dir, key):
+    path = point_path(store_dir, key)
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        return data["times"]
+
+#Saves the switching times of a point along with a JSON description of it (for reading the store by hand).
+#The file is written under a new, unique temporary name first, so an interrupted save never leaves a broken point behind,
+#and two sweeps saving the same point at the same time can't write into each other's file (the last one to finish wins, and both are complete).
+def save_point(store_dir, key, times, metadata):
+    os.makedirs(store_dir, exist_ok=True)
+    path = point_path(store_dir, key)
+    handle, temp_path = tempfile.mkstemp(dir=store_dir, prefix=key + ".", suffix=".tmp.npz")
+    try:
+        with os.fdopen(handle, "wb") as temp_file:
+            np.savez_compressed(temp_file, times=times, metadata=json.dumps(metadata))
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+#Runs a sweep like scheduler.run_sweep, but loads every point it can from store_dir and only simulates what is missing.
+#Points with fewer saved runs than batch_size are topped up, starting from the first incomplete chunk, and saved again.
+#returns the (step_count, batch_size) array of switching times and the chunk timings of whatever had to be simulated (possibly empty)
+def run_cached_sweep(store_dir, param_arrs, totalpop, methylatedpop, unmethylatedpop, SwitchDirection, batch_size, trial_max_length,
+                     chunk_size=250, workers=None, master_seed=None, stream=0, engine="compiled"):
+    if master_seed is None:
+        master_seed = seeding.new_master_seed()
+    step_count = len(param_arrs)
+    output_array = np.zeros(shape=(step_count, batch_size))
+    keys = [point_key(param_arr, totalpop, methylatedpop, unmethylatedpop, SwitchDirection, trial_max_length, master_seed, stream, chunk_size, engine)
+            for param_arr in param_arrs]
+    saved_counts = np.zeros(step_count, dtype=np.int64)
+    saved_times = [None] * step_count
+
+    chunks = []
+    seed_chunks = []
+    for step in range(step_count):
+        times = load_point(store_dir, keys[step])
+        if times is not None:
+            saved_times[step] = times
+            saved_counts[step] = min(len(times), batch_size)
+            output_array[step, :saved_counts[step]] = times[:saved_counts[step]]
+        #a partly saved chunk is rerun from its start, so that every chunk still gets its own whole stream
+        first_start = (saved_counts[step] // chunk_size) * chunk_size if saved_counts[step] < batch_size else batch_size
+        for start in range(first_start, batch_size, chunk_size):
+            chunks.append((step, start, min(start + chunk_size, batch_size)))
+            seed_chunks.append((point_seed_step(keys[step]), start, min(start + chunk_size, batch_size)))
+    cached_points = int(np.count_nonzero(saved_counts >= batch_size))
+    print(f"Result store: {cached_points} of {step_count} points cached, simulating {len(chunks)} chunks")
+
+    if len(chunks) == 0:
+        return output_array, np.zeros((0, 6))
+    rngs = seeding.chunk_generators(master_seed, seed_chunks, chunk_size, stream)
+    rate_tables = scheduler.rate_tables_for(param_arrs, totalpop, engine)
+    chunk_timings = scheduler.run_chunks(chunks, rate_tables, output_array, trial_max_length, totalpop, methylatedpop, unmethylatedpop, SwitchDirection, rngs, workers, engine)
+
+    for step in sorted(set(chunk[0] for chunk in chunks)):
+        #keep any saved runs past batch_size, so a smaller batch never shrinks what is in the store
+        times = output_array[step]
+        if saved_times[step] is not None and len(saved_times[step]) > batch_size:
+            times = np.concatenate((times, saved_times[step][batch_size:]))
+        metadata = {"param_arr": [float(value) for value in param_arrs[step]], "totalpop": totalpop, "methylatedpop": methylatedpop,
+                    "unmethylatedpop": unmethylatedpop, "SwitchDirection": SwitchDirection, "trial_max_length": trial_max_length,
+                    "master_seed": int(master_seed), "stream": stream, "chunk_size": chunk_size, "engine": engine}
+        save_point(store_dir, keys[step], times, metadata)
+    return output_array, chunk_timings
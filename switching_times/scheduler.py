@@ -0,0 +1,122 @@
+import os
+import time
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+import gillespie_time
+import lockstep
+import seeding
+
+"""
+Dynamic load-balanced scheduler for parameter sweeps.
+
+Instead of giving each sweep point one thread for all of its runs (where a few slow points leave most cores idle at the end),
+the (sweep point, run) space is split into small chunks that are handed out to worker threads as they become free.
+The chunks call the nogil kernel gillespie_time.GillespieChunkFun, so the threads really do run in parallel.
+With engine="lockstep" each chunk is instead run by lockstep.GillespieLockstepFun, which advances all of the chunk's runs together
+(also nogil) and is usually faster.
+engine="tauleap" runs each chunk with the tau-leaping kernel gillespie_time.GillespieTauLeapChunkFun, for large site counts -
+its accuracy can be given after a colon ("tauleap:0.01", see parse_engine).
+
+Every chunk is timed, and print_timing_report summarizes how evenly the work was spread over the workers.
+"""
+
+#Splits the (sweep point, run) space into chunks of at most chunk_size runs.
+#returns a list of (step, start, stop) tuples - each chunk covers runs start to stop-1 of sweep point `step`
+def make_chunks(step_count, batch_size, chunk_size):
+    chunks = []
+    for step in range(step_count):
+        for start in range(0, batch_size, chunk_size):
+            chunks.append((step, start, min(start + chunk_size, batch_size)))
+    return chunks
+
+#Splits an engine name into the engine and the tau-leaping accuracy epsilon: "tauleap:0.01" is tau-leaping with epsilon 0.01,
+#and plain "tauleap" uses 0.03. Keeping the accuracy in the name means it is passed on (and recorded, e.g. by result_store.py) wherever the engine is.
+def parse_engine(engine):
+    name, separator, accuracy = engine.partition(":")
+    if name not in ("compiled", "lockstep", "tauleap") or (separator and name != "tauleap"):
+        raise ValueError("engine must be 'compiled', 'lockstep' or 'tauleap' (optionally 'tauleap:<epsilon>')")
+    return name, float(accuracy) if accuracy else 0.03
+
+#Makes what run_chunks needs for every sweep point - the rate table from gillespie_time.build_rate_table,
+#or for tau-leaping the parameter array itself (it computes the rates as it goes, since a table for many thousands of sites wouldn't fit in memory)
+#param_arrs can hold lists as well as arrays (distributed.py sends plain lists) - they are converted to the float arrays the kernels expect
+def rate_tables_for(param_arrs, totalpop, engine):
+    param_arrs = [np.asarray(param_arr, dtype=float) for param_arr in param_arrs]
+    if parse_engine(engine)[0] == "tauleap":
+        return param_arrs
+    return [gillespie_time.build_rate_table(param_arr, totalpop) for param_arr in param_arrs]
+
+#Runs every chunk on a pool of worker threads and writes the switching times into output_array[step][start:stop].
+#Workers take the next chunk from a shared queue as soon as they finish one, so the load balances itself.
+#rate_tables holds one table per sweep point (see rate_tables_for), and rngs holds one generator per chunk.
+#engine is "compiled" (one run after another in the numba kernel), "lockstep" (the whole chunk together, see lockstep.py) or "tauleap[:epsilon]"
+#if on_chunk_done is given, it is called with the chunk's index (from the worker thread) as soon as that chunk's results are written
+#if row_directions is given, the runs of row r of output_array start from row_directions[r] = (methylatedpop, unmethylatedpop, SwitchDirection)
+#instead of the three single values - this is how twoway.py runs both directions as one set of chunks
+#returns an array with one row per chunk: step, start, stop, worker, start time and end time (seconds since the sweep began)
+def run_chunks(chunks, rate_tables, output_array, trial_max_length, totalpop, methylatedpop, unmethylatedpop, SwitchDirection, rngs, workers=None, engine="compiled", on_chunk_done=None,
+               row_directions=None):
+    engine, epsilon = parse_engine(engine)
+    if workers is None:
+        workers = os.cpu_count()
+    chunk_timings = np.zeros((len(chunks), 6))
+    #each thread gets the next worker number the first time it finishes a chunk - the lock stops two threads taking the same number
+    worker_ids = {}
+    worker_ids_lock = threading.Lock()
+    sweep_start = time.perf_counter()
+
+    def run_one(chunk_index):
+        step, start, stop = chunks[chunk_index]
+        if row_directions is None:
+            methylated, unmethylated, direction = methylatedpop, unmethylatedpop, SwitchDirection
+        else:
+            methylated, unmethylated, direction = row_directions[step]
+        chunk_start = time.perf_counter()
+        if engine == "lockstep":
+            lockstep.GillespieLockstepFun(trial_max_length, rate_tables[step], totalpop, methylated, unmethylated, direction, output_array[step, start:stop], rngs[chunk_index])
+        elif engine == "tauleap":
+            gillespie_time.GillespieTauLeapChunkFun(trial_max_length, rate_tables[step], totalpop, methylated, unmethylated, direction, epsilon, output_array[step, start:stop], rngs[chunk_index])
+        else:
+            gillespie_time.GillespieChunkFun(trial_max_length, rate_tables[step], totalpop, methylated, unmethylated, direction, output_array[step, start:stop], rngs[chunk_index])
+        chunk_end = time.perf_counter()
+        with worker_ids_lock:
+            worker = worker_ids.setdefault(threading.get_ident(), len(worker_ids))
+        chunk_timings[chunk_index] = (step, start, stop, worker, chunk_start - sweep_start, chunk_end - sweep_start)
+        if on_chunk_done is not None:
+            on_chunk_done(chunk_index)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        #list() makes sure any error raised inside a chunk is passed on here
+        list(pool.map(run_one, range(len(chunks))))
+    return chunk_timings
+
+#Runs a whole sweep - one batch of batch_size runs for every parameter array in param_arrs.
+#rngs holds one generator per chunk (see seeding.chunk_generators) - if it isn't given, a new master seed is used.
+#returns the (step_count, batch_size) array of switching times (negative values are time-outs) and the chunk timings from run_chunks
+def run_sweep(param_arrs, totalpop, methylatedpop, unmethylatedpop, SwitchDirection, batch_size, trial_max_length, chunk_size=250, workers=None, rngs=None, engine="compiled"):
+    step_count = len(param_arrs)
+    chunks = make_chunks(step_count, batch_size, chunk_size)
+    if rngs is None:
+        rngs = seeding.chunk_generators(seeding.new_master_seed(), chunks, chunk_size)
+    #the rates only depend on the parameters, so every run of a sweep point shares one table
+    rate_tables = rate_tables_for(param_arrs, totalpop, engine)
+    output_array = np.zeros(shape=(step_count, batch_size))
+    chunk_timings = run_chunks(chunks, rate_tables, output_array, trial_max_length, totalpop, methylatedpop, unmethylatedpop, SwitchDirection, rngs, workers, engine)
+    return output_array, chunk_timings
+
+#Prints how long each sweep point took in total, the slowest chunks, and how busy the workers were.
+#With good load balancing every worker should finish at about the same time.
+def print_timing_report(chunk_timings, step_count):
+    durations = chunk_timings[:,5] - chunk_timings[:,4]
+    wall_time = chunk_timings[:,5].max()
+    workers = np.unique(chunk_timings[:,3])
+    worker_count = len(workers)
+    per_step = np.bincount(chunk_timings[:,0].astype(np.int64), weights=durations, minlength=step_count)
+    worker_finish = [chunk_timings[chunk_timings[:,3] == worker, 5].max() for worker in workers]
+
+    print(f"Sweep finished in {wall_time:.2f}s on {worker_count} workers ({len(chunk_timings)} chunks)")
+    print(f"First results after {chunk_timings[:,5].min():.2f}s")
+    print(f"Chunk time: mean {durations.mean():.4f}s, min {durations.min():.4f}s, max {durations.max():.4f}s")
+    print(f"Time per sweep point: min {per_step.min():.2f}s, max {per_step.max():.2f}s (slowest is step {int(per_step.argmax())})")
+    print(f"Workers finished between {min(worker_finish):.2f}s and {max(worker_finish):.2f}s, utilization {durations.sum() / (worker_count * wall_time):.1%}")
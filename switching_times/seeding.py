@@ -0,0 +1,42 @@
+import numpy as np
+
+"""
+Reproducible, independent random number streams for the sweeps.
+
+Every sweep is driven by one master seed, which the simulation programs print so that it can be recorded.
+The streams are built with numpy's SeedSequence.spawn: the master SeedSequence spawns one child per stream
+(for example one per switching direction), each of those spawns one child per sweep point, and each of those spawns one child per chunk of runs.
+Every chunk therefore has its own independent generator, and since the chunk layout only depends on batch_size and chunk_size,
+a sweep gives bit-for-bit identical results no matter how many threads or processes run it.
+"""
+
+#Returns a fresh master seed - print or save it, and pass it back in later to reproduce a sweep exactly.
+def new_master_seed():
+    return np.random.SeedSequence().entropy
+
+#Returns the SeedSequence for one chunk of runs.
+#This is the same sequence as SeedSequence(master_seed).spawn(...)[stream].spawn(...)[step].spawn(...)[chunk_number],
+#but it can be made directly, without knowing how many streams, points or chunks there are.
+def chunk_seed_sequence(master_seed, stream, step, chunk_number):
+    return np.random.SeedSequence(master_seed, spawn_key=(stream, step, chunk_number))
+
+#Returns one generator per chunk in chunks (a list of (step, start, stop) tuples from scheduler.make_chunks).
+#Chunks are numbered by the run they start at (start // chunk_size), so a chunk always gets the same stream,
+#even when the runs of a sweep point are added a few chunks at a time.
+def chunk_generators(master_seed, chunks, chunk_size, stream=0):
+    generators = []
+    for step, start, stop in chunks:
+        generators.append(np.random.default_rng(chunk_seed_sequence(master_seed, stream, step, start // chunk_size)))
+    return generators
+
+#Returns the SeedSequence for the analysis of one sweep point (for example its bootstrap resamples).
+#It is a child of the same stream and point as the chunks, numbered past any possible chunk, so it never repeats a chunk's random numbers.
+def analysis_seed_sequence(master_seed, stream, step):
+    return np.random.SeedSequence(master_seed, spawn_key=(stream, step, 2**32))
+
+#Returns the SeedSequence for a continuation pass over one chunk of runs (see continuation.py).
+#Pass 0 is the chunk's own sequence, and every later pass gets a new child of it, so continuing runs never reuses random numbers.
+def continuation_seed_sequence(master_seed, stream, step, chunk_number, pass_number):
+    if pass_number == 0:
+        return chunk_seed_sequence(master_seed, stream, step, chunk_number)
+    return np.random.SeedSequence(master_seed, spawn_key=(stream, step, chunk_number, pass_number))
@@ -1,10 +1,18 @@
+import warnings
 import numpy as np
-import gillespie_time
 import matplotlib.pyplot as plt
-import scipy.stats as stats
-import numba
-import statistics
-from numba import prange
+import scheduler
+import seeding
+import adaptive
+import result_store
+import checkpoint
+import refine
+import distributed
+import markov_time
+import fitting
+import bootstrap
+import rare_event
+import continuation
 
 """
 Performs many gillespie runs at once to get information about the time 
@@ -35,6 +43,84 @@ methylatedpop = 10
 unmethylatedpop = 90
 #SwitchDirection - a simulation terminates when it reaches this state
 SwitchDirection = 1 #1 -> mostly methylated, -1-> mostly unmethylated
+#runs are handed out to the worker threads in chunks of this size - smaller chunks balance better, larger ones have less overhead
+chunk_size = 250
+#number of worker threads (None uses every core)
+workers = None
+#master seed for the random number generators - leave as None for a new one, or set it to a printed seed to reproduce a sweep
+master_seed = None
+#sequential stopping - set target_rel_ci to stop each sweep point once the 95% confidence interval of its estimate is narrow enough
+#(e.g. 0.05 stops at +-5% of the estimate). batch_size then becomes the maximum number of runs per point, added adaptive_increment at a time
+target_rel_ci = None
+adaptive_metric = "mean" #"mean" for the mean switching time, "exponential" for the exponential parameter
+adaptive_increment = 500 #must be a multiple of chunk_size
+#simulation engine - "compiled" runs each chunk one run at a time in the numba kernel, "lockstep" advances all of a chunk's runs together
+#(see lockstep.py), which is usually faster.
+#"tauleap" leaps over many events at a time, for large totalpop (thousands of sites or more) - add the accuracy after a colon,
+#e.g. "tauleap:0.01" (smaller is more accurate, the default is 0.03). See gillespie_time.GillespieTauLeapFun and benchmark_tau_leap.py.
+#It works with time_horizon, but not with rare_events, exact_moments or exact_distributions, which need a rate table over every state
+engine = "compiled"
+#result store - set store_dir to a directory to save the switching times of every point there, and reuse them in later sweeps
+#(only points that are missing or need more runs get simulated). Points are only reused with the same master_seed, so set master_seed too.
+#the store is used for fixed batches, not for sequential stopping
+store_dir = None
+#checkpointing - set checkpoint_path to a file name to save the finished runs every checkpoint_seconds. If the program is stopped,
+#running it again with the same checkpoint_path only runs what is left (with the seed saved there), and gives the same results - see checkpoint.py
+#checkpointing and the result store can't be used together
+checkpoint_path = None
+checkpoint_seconds = 60
+#adaptive refinement - set refine_max_points to start from the step_count evenly spaced points and keep adding midpoints where the
+#switching time, the time-outs or the KS error change fastest (see refine.py). It stops once refine_max_points points have been run,
+#no interval changes by more than refine_tolerance (as a fraction of each curve's range), or the points are refine_min_spacing apart.
+#Changes smaller than refine_significance standard errors are taken to be sampling noise, and don't count.
+#Refinement runs fixed batches on the worker threads, so it can't be used with the store, checkpoints, time_horizon, distributed runs or target_rel_ci
+refine_max_points = None
+refine_min_spacing = 0.005
+refine_tolerance = 0.05
+refine_significance = 3
+#time horizon - set time_horizon to stop every run at that simulated time, instead of after trial_max_length events (see continuation.py).
+#Runs that haven't switched are kept as censored runs rather than thrown away, and the censored fit below uses them. Each of continuation_passes passes
+#lets the censored runs go on for another time_horizon (and at most trial_max_length more events). Set run_state_path to a file name to save the runs,
+#so running the program again continues them with more passes instead of starting over.
+#run_state_path takes the place of checkpoint_path here, and the runs can't be stored, distributed or stopped adaptively
+time_horizon = None
+continuation_passes = 1
+run_state_path = None
+#distributed runs - set distributed_backend to "processes" to run the chunks on a pool of worker processes on this machine, or to "socket"
+#to hand them to worker processes on other nodes, which connect to distributed_address (start each one with
+#`python distributed.py worker HOST PORT AUTHKEY`). Lost chunks are run again. The results are the same as on threads - see distributed.py
+#distributed_address only accepts workers on this machine - use this node's network address (or "0.0.0.0") to accept workers from other nodes,
+#on a trusted network only. With distributed_authkey None a random key is made and printed; anyone with the key can run code on this machine.
+#Distributed runs can't be checkpointed, stored or stopped adaptively, and "processes" only works when the program is started by run.py
+distributed_backend = None
+distributed_address = ("127.0.0.1", 6000)
+distributed_authkey = None
+#bootstrap confidence intervals - set bootstrap_replicates to give every fitted curve a shaded percentile interval from that many bootstrap resamples
+#of each point (e.g. 1000). 0 turns them off
+bootstrap_replicates = 0
+bootstrap_confidence = 0.95
+#rare switches - set rare_events to True to estimate the mean switching time with forward flux sampling at every point where more than half
+#of the runs timed out, so those points still get a result (see rare_event.py). ffs_trials trials are run at each of ffs_interface_count interfaces
+#in each of ffs_replicates independent FFS runs, and the interval comes from the spread between the runs
+rare_events = False
+ffs_interface_count = 15
+ffs_trials = 1000
+ffs_replicates = 10
+#set to True to also compute the exact mean and S.D. of the switching time at every point, solved on the Markov chain (see markov_time.py)
+exact_moments = False
+#set to True to also compute the exact switching-time distribution at every point, and the exact KS error of each fit (a few seconds per point)
+exact_distributions = False
+#-----------run config-----------
+#when this program is started by run.py, the values from the run config file replace the ones above (see run.py)
+#only the names in the parameters block can be set
+parameter_names = ("param_begin_val", "param_end_val", "step_count", "param_to_change", "batch_size", "trial_max_length", "totalpop",
+                   "methylatedpop", "unmethylatedpop", "SwitchDirection", "chunk_size", "workers", "master_seed", "target_rel_ci", "adaptive_metric",
+                   "adaptive_increment", "engine", "store_dir", "checkpoint_path", "checkpoint_seconds", "refine_max_points", "refine_min_spacing",
+                   "refine_tolerance", "refine_significance", "time_horizon", "continuation_passes", "run_state_path", "distributed_backend", "distributed_address",
+                   "distributed_authkey", "bootstrap_replicates", "bootstrap_confidence", "rare_events", "ffs_interface_count", "ffs_trials",
+                   "ffs_replicates", "exact_moments", "exact_distributions")
+if "RUN_CONFIG" in globals():
+    globals().update(RUN_CONFIG.parameters(parameter_names))
 #-----------Rates Dictionary---------
 default_parameters = {"r_hm": 0.5,          #0
                       "r_hm_m": 20/totalpop, #1
@@ -51,6 +137,10 @@ default_parameters = {"r_hm": 0.5,          #0
                       "birth_rate": 1         #12
 }
 
+#rates from the run config replace the defaults above
+if "RUN_CONFIG" in globals():
+    default_parameters.update(RUN_CONFIG.rates(default_parameters))
+
 #This dictionary just matches each parameter to its place in the list.
 default_indices = {
     "r_hm": 0,          
@@ -80,94 +170,208 @@ index_to_change = default_indices[param_to_change]
 #find the size of each step, rounded to 5 decimal places.
 step_size = round((param_end_val-param_begin_val)/(step_count-1), 5)
 
+#for every step, make a copy of the default parameters and change the parameter we want to study
+param_arrs = []
+for step in range(step_count):
+    temp_arr = default_arr.copy()
+    temp_arr[index_to_change] = param_begin_val + (step*step_size)
+    param_arrs.append(temp_arr)
+
 #-----------simulation-----------
-@numba.jit(nopython=True, parallel=True)
 def main(rngs):
-    output_array = np.zeros(shape=(step_count, batch_size))
-    #this loop runs in parallel because it uses prange() instead of range() - keep this in mind if debugging it
-    for step in prange(step_count):
-        #make a copy of the default parameters, change the parameter we want to study
-        temp_arr = default_arr.copy()
-        temp_arr[index_to_change] = param_begin_val + (step*step_size)
+    for temp_arr in param_arrs:
         print("Testing parameters: ", temp_arr)
 
-        #run a batch of identical gillespie algorithms, store the results in output_array[step]
-        for i in range(batch_size):
-            output_array[step][i] = gillespie_time.GillespieSwitchFun(trial_max_length, temp_arr, totalpop, methylatedpop, unmethylatedpop, SwitchDirection,rngs[step])
-    return output_array
+    param_values = [temp_arr[index_to_change] for temp_arr in param_arrs]
+    if refine_max_points is not None:
+        #start from the evenly spaced points, then add more where the results change fastest - see refine.py
+        param_values, (output_array,) = refine.run_refined_sweep(default_arr, index_to_change, param_values, [(methylatedpop, unmethylatedpop, SwitchDirection)], totalpop,
+                                                                  batch_size, trial_max_length, refine_max_points, refine_min_spacing, refine_tolerance,
+                                                                  chunk_size=chunk_size, workers=workers, master_seed=master_seed, engine=engine,
+                                                                  significance=refine_significance)
+        return output_array, np.full(len(param_values), batch_size), param_values
+
+    #run a batch of identical gillespie algorithms for every set of parameters, store the results in output_array[step]
+    #the runs are split into chunks that are handed out to the worker threads as they become free - see scheduler.py
+    if time_horizon is not None or run_state_path is not None:
+        #keep the runs that haven't switched as censored runs, and continue them in later passes - see continuation.py
+        run_state = continuation.run_horizon_sweep(param_arrs, totalpop, methylatedpop, unmethylatedpop, SwitchDirection, batch_size, time_horizon, trial_max_length,
+                                                   continuation_passes, chunk_size, workers, master_seed, 0, run_state_path, engine)
+        return continuation.signed_times(run_state), np.full(step_count, batch_size), param_values
+
+    if target_rel_ci is None:
+        if distributed_backend is not None:
+            #hand the chunks to other processes or nodes - see distributed.py
+            if distributed_backend == "processes":
+                backend = distributed.ProcessPoolBackend(workers)
+            elif distributed_backend == "socket":
+                backend = distributed.SocketBackend(tuple(distributed_address), None if distributed_authkey is None else distributed_authkey.encode())
+                print("Waiting for workers on", tuple(distributed_address), "with authkey", backend.authkey)
+            else:
+                raise ValueError("distributed_backend must be None, 'processes' or 'socket'")
+            output_array = distributed.run_distributed_sweep(backend, param_arrs, totalpop, methylatedpop, unmethylatedpop, SwitchDirection, batch_size, trial_max_length,
+                                                             chunk_size, master_seed, 0, engine)
+            if distributed_backend == "socket":
+                backend.close()
+            chunk_timings = []
+        elif checkpoint_path is not None:
+            #save the finished runs as we go, and pick up from the last checkpoint if there is one
+            output_array, chunk_timings = checkpoint.run_checkpointed_sweep(checkpoint_path, param_arrs, totalpop, methylatedpop, unmethylatedpop, SwitchDirection, batch_size, trial_max_length,
+                                                                         chunk_size, workers, master_seed, 0, engine, checkpoint_seconds)
+        elif store_dir is None:
+            output_array, chunk_timings = scheduler.run_sweep(param_arrs, totalpop, methylatedpop, unmethylatedpop, SwitchDirection, batch_size, trial_max_length, chunk_size, workers, rngs, engine)
+        else:
+            #load what we can from the result store, and only simulate the rest - see result_store.py
+            output_array, chunk_timings = result_store.run_cached_sweep(store_dir, param_arrs, totalpop, methylatedpop, unmethylatedpop, SwitchDirection, batch_size, trial_max_length,
+                                                                        chunk_size, workers, master_seed, 0, engine)
+        if len(chunk_timings) > 0:
+            scheduler.print_timing_report(chunk_timings, step_count)
+        run_counts = np.full(step_count, batch_size)
+    else:
+        #keep adding runs to each point until its estimate is precise enough - see adaptive.py
+        output_array, run_counts, half_widths = adaptive.run_adaptive_sweep(param_arrs, totalpop, methylatedpop, unmethylatedpop, SwitchDirection, trial_max_length, target_rel_ci,
+                                                                            batch_size, adaptive_increment, adaptive_metric, 0.95, chunk_size, workers, master_seed, 0, engine)
+    return output_array, run_counts, param_values
 #-----------setup-----------
 
-#generate the arrays for our output - None (or null value) is the default
-exponential_parameters = [None] * step_count
-exponential_KS = [None] * step_count
-
-gamma_shape = [None] * step_count
-gamma_location = [None] * step_count
-gamma_scale = [None] * step_count
-gamma_KS = [None] * step_count
-inverse_gamma_scale = [None] * step_count
-
-normal_KS = [None] * step_count
-normal_sd = [None] * step_count
-normal_mean = [None] * step_count
+#a checkpointed sweep doesn't read or write the result store, so the two can't be used together
+if checkpoint_path is not None and store_dir is not None:
+    raise ValueError("checkpoint_path and store_dir can't both be set - a checkpointed sweep doesn't use the result store")
+
+#a distributed sweep runs every point once on the backend, without checkpoints, the result store or adaptive runs
+distributed_conflicts = [name for name, value in (("checkpoint_path", checkpoint_path), ("store_dir", store_dir), ("target_rel_ci", target_rel_ci)) if value is not None]
+if distributed_backend is not None and distributed_conflicts:
+    raise ValueError("distributed_backend can't be used with " + ", ".join(distributed_conflicts))
+#worker processes may start by importing the main script again, and this script runs the whole sweep when it is imported -
+#run.py keeps its own code behind a __main__ check and runs this script under another name, so start it through run.py to use a process pool
+if distributed_backend == "processes" and "RUN_CONFIG" not in globals():
+    raise ValueError("distributed_backend='processes' needs the script to be started through run.py (python run.py CONFIG)")
+
+#refinement runs its own fixed-batch sweep on the worker threads (see refine.py), so it can't use any of the other ways of running a sweep
+refine_conflicts = [name for name, value in (("store_dir", store_dir), ("checkpoint_path", checkpoint_path), ("time_horizon", time_horizon),
+                                             ("run_state_path", run_state_path), ("distributed_backend", distributed_backend), ("target_rel_ci", target_rel_ci)) if value is not None]
+if refine_max_points is not None and refine_conflicts:
+    raise ValueError("refine_max_points can't be used with " + ", ".join(refine_conflicts))
+
+#runs stopped at a time horizon are kept with their censored state by continuation.py, which has no checkpoints, store, distributed or adaptive version
+horizon_conflicts = [name for name, value in (("checkpoint_path", checkpoint_path), ("store_dir", store_dir), ("distributed_backend", distributed_backend),
+                                              ("target_rel_ci", target_rel_ci)) if value is not None]
+if (time_horizon is not None or run_state_path is not None) and horizon_conflicts:
+    raise ValueError("time_horizon and run_state_path can't be used with " + ", ".join(horizon_conflicts))
+
+#forward flux sampling and the exact results all need a rate table over every state, which tau-leaping is there to avoid
+if scheduler.parse_engine(engine)[0] == "tauleap" and (rare_events or exact_moments or exact_distributions):
+    raise ValueError("rare_events, exact_moments and exact_distributions need a rate table over every state, so they can't be used with engine='tauleap'")
 
-timeouts = [0] * step_count
-empirical_mean = [None] * step_count
+#create an array of random number generators that we will pass into our function
+#each chunk of runs gets its own independent generator, all derived from one master seed - see seeding.py
+#a sweep that is being resumed keeps the seed saved in its checkpoint
+if master_seed is None and checkpoint_path is not None:
+    master_seed = checkpoint.saved_master_seed(checkpoint_path)
+#and so do runs that are being continued
+if master_seed is None and run_state_path is not None:
+    master_seed = continuation.saved_master_seed(run_state_path)
+#stored points are keyed by the master seed, so a new seed never finds anything in the store
+if master_seed is None and store_dir is not None:
+    warnings.warn("store_dir is set but master_seed is not - a new master seed is drawn, so no stored points will be reused. Set master_seed to reuse them.")
+if master_seed is None:
+    master_seed = seeding.new_master_seed()
+print("Master seed: ", master_seed)
+generators = seeding.chunk_generators(master_seed, scheduler.make_chunks(step_count, batch_size, chunk_size), chunk_size)
 
-line = [None] * step_count
+#-----------Call simulation-----------
+output, run_counts, param_values = main(generators)
 
+#refinement adds points, so the number of points and their values are taken from the sweep that was actually run
+step_count = len(param_values)
+param_arrs = []
+for value in param_values:
+    temp_arr = default_arr.copy()
+    temp_arr[index_to_change] = value
+    param_arrs.append(temp_arr)
 
 #list comprehension that creates an array of the values we tested for our chosen parameter
-step_array = [step_size * i for i in range(step_count)]
+#like the evenly spaced sweeps, the x-axis starts from 0
+step_array = [value - param_begin_val for value in param_values]
 
-#create an array of random number generators that we will pass into our function
-#this makes it easier to reproduce, and also keeps Numba happy.
-generators = [None]*step_count
-for i in range(step_count):
-    generators[i] = np.random.default_rng()
-
-#-----------Call simulation-----------
-output = main(generators)
 
 #-----------postprocessing-----------
 
-#go through the output row-by-row and find the exponential parameters
-for step in range(step_count):
-    #this list comprehension makes an array of all the positive values in a given row of output_array
-    valid_array = [output[step][index] for index in range(batch_size) if output[step][index] >= 0]
-    #this list comprehension counts up all the negative (meaning timed out) values
-    raw_timeouts = batch_size - len(valid_array)
-    timeouts[step] = 10*(raw_timeouts/batch_size) #scale the timeouts to fit with the other info on the graph
-
-    #create a line representing the parameter we are varying on the y axis
-    line[step] = step_array[step]
-
-    #guess parameters only if less than half our simulations timed out
-    if len(valid_array) > batch_size/2:
-        #fit distributions to the data
-        exponential_parameters[step] = stats.expon.fit(valid_array,floc=0)[1]
-        print('exponential paramater = ' + str(exponential_parameters[step]))
+#fit every sweep point at once - the exponential, normal and gamma fits and their KS errors (see fitting.py)
+#values are NaN where more than half of the simulations timed out
+fits = fitting.fit_sweep(output, run_counts, workers)
+exponential_parameters = fits["exponential_parameter"]
+exponential_KS = 10 * fits["exponential_KS"]
 
-        gamma_shape[step],gamma_location[step],gamma_scale[step]=stats.gamma.fit(valid_array,floc=0)
-        inverse_gamma_scale[step] = 1/gamma_scale[step]
+gamma_shape = fits["gamma_shape"]
+gamma_location = np.where(np.isnan(gamma_shape), np.nan, 0.0)
+gamma_scale = fits["gamma_scale"]
+gamma_KS = 10 * fits["gamma_KS"]
+inverse_gamma_scale = 1/gamma_scale
 
-        normal_mean[step], normal_sd[step] =  stats.norm.fit(valid_array,)
-        print(f'Normal mean is {normal_mean[step]} and S.D. is {normal_sd[step]}')
+normal_KS = 10 * fits["normal_KS"]
+normal_sd = fits["normal_sd"]
+normal_mean = fits["normal_mean"]
+
+timeouts = 10*(fits["timeouts"]/run_counts) #scale the timeouts to fit with the other info on the graph
+empirical_mean = fits["empirical_mean"]
+
+#censored exponential fit - every run is used, and a run that timed out (or was stopped at the time horizon) counts as "hasn't switched by its time",
+#so unlike the fits above it isn't biased low when many runs time out (see fitting.censored_exponential_fit)
+censored_runs = np.arange(output.shape[1])[None, :] < np.asarray(run_counts)[:, None]
+censored_exponential_parameters, *censored_exponential_CI = fitting.censored_exponential_fit(np.where(censored_runs, np.abs(output), 0.0), censored_runs & (output >= 0))
 
-        empirical_mean[step] = statistics.fmean(valid_array)
+#create a line representing the parameter we are varying on the y axis
+line = step_array
 
-        #calculate error for parameters with Kolmogorov-Smirnov test
-        #note that we lock the first argument, location, to 0 for the exponential distribution
-        exponential_KS[step] = 10 * (stats.kstest(valid_array, 'expon', N=len(valid_array), args=(0,exponential_parameters[step])).statistic)
+for step in range(step_count):
+    if not np.isnan(exponential_parameters[step]):
+        print('exponential paramater = ' + str(exponential_parameters[step]))
+        print(f'Normal mean is {normal_mean[step]} and S.D. is {normal_sd[step]}')
         print(exponential_KS[step])
-        normal_KS[step] = 10 * (stats.kstest(valid_array, 'norm', N=len(valid_array), args=(normal_mean[step], normal_sd[step])).statistic)
-        # print(normal_KS[step])
-        gamma_KS[step] = 10 * (stats.kstest(valid_array, stats.gamma.cdf, N=len(valid_array), args=(gamma_shape[step],0,gamma_scale[step])).statistic)
         print(gamma_KS[step])
-
-    # print("predicted exponential parameter: ", exponential_parameters[step])
-    # print("predicted gamma shape parameter: ", gamma_shape[step])
-    print("timed-out simulations: " + str(raw_timeouts) + " out of " + str(batch_size))
+    print("timed-out simulations: " + str(fits["timeouts"][step]) + " out of " + str(run_counts[step]))
+
+#confidence intervals for the fits, from resampling the runs of every point - see bootstrap.py
+#each is a (lower, upper) pair of arrays, NaN where there is no fit
+if bootstrap_replicates > 0:
+    intervals = bootstrap.bootstrap_sweep(output, run_counts, bootstrap_replicates, bootstrap_confidence, master_seed, 0, workers)
+else:
+    intervals = {name: (np.full(step_count, np.nan), np.full(step_count, np.nan)) for name in ("exponential_parameter", "empirical_mean", "normal_mean", "normal_sd",
+                                                                                               "gamma_shape", "gamma_scale", "timeout_fraction")}
+exponential_parameters_CI = intervals["exponential_parameter"]
+timeouts_CI = [10 * bound for bound in intervals["timeout_fraction"]]
+gamma_shape_CI = intervals["gamma_shape"]
+gamma_scale_CI = intervals["gamma_scale"]
+inverse_gamma_scale_CI = (1/gamma_scale_CI[1], 1/gamma_scale_CI[0])
+normal_mean_CI = intervals["normal_mean"]
+normal_sd_CI = intervals["normal_sd"]
+empirical_mean_CI = intervals["empirical_mean"]
+
+#forward flux sampling where the plain simulation timed out too often to fit - for such rare switches the switching time is exponential,
+#so its mean is also the exponential parameter
+ffs_mean = np.full(step_count, np.nan)
+ffs_mean_CI = (np.full(step_count, np.nan), np.full(step_count, np.nan))
+if rare_events:
+    for step in np.flatnonzero(np.isnan(exponential_parameters)):
+        ffs_result = rare_event.run_ffs(param_arrs[step], totalpop, methylatedpop, unmethylatedpop, SwitchDirection, interface_count=ffs_interface_count,
+                                        flux_crossings=ffs_trials, trials_per_interface=ffs_trials, replicates=ffs_replicates, chunk_size=chunk_size, workers=workers, master_seed=master_seed, stream=step + 1)
+        ffs_mean[step] = ffs_result["mean_switching_time"]
+        ffs_mean_CI[0][step], ffs_mean_CI[1][step] = ffs_result["mean_interval"]
+        print(f"FFS mean switching time at step {step}: {ffs_mean[step]} ({ffs_mean_CI[0][step]} to {ffs_mean_CI[1][step]})")
+
+#exact mean and S.D. of the switching time, solved directly on the Markov chain instead of simulated - see markov_time.py
+#timed-out runs are left out of the fits above, so when many runs time out the fitted values will fall below these
+#it needs a rate table and a sparse solve over every state, so it only runs when exact_moments is set
+exact_mean = exact_sd = np.full(step_count, np.nan)
+if exact_moments:
+    exact_mean, exact_sd = markov_time.exact_sweep(param_arrs, totalpop, methylatedpop, unmethylatedpop, SwitchDirection)
+#exact KS errors of the exponential, normal and gamma fits, found from the exact distribution with no sampling (scaled by 10x like the others)
+exact_exponential_KS = [None] * step_count
+exact_normal_KS = [None] * step_count
+exact_gamma_KS = [None] * step_count
+if exact_distributions:
+    exact_exponential_KS, exact_normal_KS, exact_gamma_KS = [10 * ks for ks in markov_time.exact_ks_sweep(param_arrs, totalpop, methylatedpop, unmethylatedpop, SwitchDirection)]
 
 #-----------graphing - edit here -----------
 
@@ -175,21 +379,48 @@ for step in range(step_count):
 plt.close()
 final_label = "Switching times from unmethylated to methylated as birth rate changes \n Population = " + str(totalpop)
 run_stats = "Batches of " + str(batch_size) + ", running for maximum of " + str(trial_max_length) + " steps each"
+if target_rel_ci is not None:
+    run_stats = "Up to " + str(batch_size) + " runs per point (stopping at +-" + str(target_rel_ci) + " relative CI), running for maximum of " + str(trial_max_length) + " steps each"
+if refine_max_points is not None:
+    run_stats = run_stats + ", refined to " + str(step_count) + " points"
+if time_horizon is not None:
+    run_stats = "Batches of " + str(batch_size) + ", time horizon " + str(time_horizon) + " per pass"
+if bootstrap_replicates > 0:
+    run_stats = run_stats + ", shaded: " + str(round(100 * bootstrap_confidence)) + "% CI"
 plt.plot(step_array, exponential_parameters,label="exponential parameters", linestyle='dashed')
+plt.fill_between(step_array, *exponential_parameters_CI, alpha=0.2)
+#the censored fit is shown for sweeps with a time horizon - it can be used for any sweep, but it often dwarfs the other curves
+if time_horizon is not None or run_state_path is not None:
+    plt.plot(step_array, censored_exponential_parameters, label="exponential parameters (censored fit)", linestyle='dotted')
+    plt.fill_between(step_array, *censored_exponential_CI, alpha=0.2)
+if rare_events:
+    plt.errorbar(step_array, ffs_mean, yerr=[ffs_mean - ffs_mean_CI[0], ffs_mean_CI[1] - ffs_mean], label="exponential parameters (forward flux sampling)", marker='x', linestyle='')
 plt.plot(step_array,timeouts, label = "proportion timed out, scaled by 10x")
+plt.fill_between(step_array, *timeouts_CI, alpha=0.2)
 plt.plot(step_array, exponential_KS, label="Exponential KS error, scaled by 10x")
 
 # plt.plot(step_array, gamma_shape,label="Gamma shape")
+# plt.fill_between(step_array, *gamma_shape_CI, alpha=0.2)
 # plt.plot(step_array, gamma_location,label="Gamma location")
 # plt.plot(step_array, gamma_scale,label="Gamma scale")
+# plt.fill_between(step_array, *gamma_scale_CI, alpha=0.2)
 # plt.plot(step_array, inverse_gamma_scale,label = "1/Gamma scale",linestyle='dashed')
+# plt.fill_between(step_array, *inverse_gamma_scale_CI, alpha=0.2)
 # plt.plot(step_array, gamma_KS, label="Gamma KS error, scaled by 10x")
 # plt.plot(step_array, line, linestyle='dotted', label = 'Birth Rate')
 
 plt.plot(step_array, normal_mean, label='Normal mean',marker='.',linestyle='')
+plt.errorbar(step_array, normal_mean, yerr=[normal_mean - normal_mean_CI[0], normal_mean_CI[1] - normal_mean], linestyle='', color='gray', alpha=0.5)
 plt.plot(step_array, normal_sd, label='Normal S.D.',marker='.',linestyle='')
+plt.errorbar(step_array, normal_sd, yerr=[normal_sd - normal_sd_CI[0], normal_sd_CI[1] - normal_sd], linestyle='', color='gray', alpha=0.5)
 plt.plot(step_array, normal_KS, label="Normal KS error, scaled by 10x",marker='.',linestyle='')
 # plt.plot(step_array, empirical_mean, label='Empirical Mean', linestyle='dashed')
+# plt.fill_between(step_array, *empirical_mean_CI, alpha=0.2)
+# plt.plot(step_array, exact_mean, label='Exact mean', linestyle='dotted')
+# plt.plot(step_array, exact_sd, label='Exact S.D.', linestyle='dotted')
+# plt.plot(step_array, exact_exponential_KS, label='Exact exponential KS error, scaled by 10x', linestyle='dotted')
+# plt.plot(step_array, exact_normal_KS, label='Exact normal KS error, scaled by 10x', linestyle='dotted')
+# plt.plot(step_array, exact_gamma_KS, label='Exact gamma KS error, scaled by 10x', linestyle='dotted')
 
 plt.title(final_label + "\n" + run_stats)
 plt.xlabel('Value of parameter '+ param_to_change)
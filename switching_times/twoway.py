@@ -0,0 +1,68 @@
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+import scheduler
+import seeding
+
+"""
+Both switching directions as one workload.
+
+Running the M->U sweep, analysing it, and only then starting the U->M sweep leaves the cores idle during the analysis, and the slow points of
+one direction can't be balanced against the other direction. run_twoway_sweep instead puts the chunks of every direction into one queue
+for one pool of worker threads (one call to scheduler.run_chunks, with each direction's sweep as its own block of rows):
+    - each sweep point's rate table is built once and shared by all directions (it only depends on the parameters)
+    - the chunks are interleaved point by point, so both directions finish their points at about the same rate
+    - as soon as every chunk of a (direction, point) is done, the point is handed to `analyze` on a separate thread,
+      so the fitting runs while the kernels (which release the GIL) keep simulating
+
+Direction d uses random stream d, so with the same master seed the results are identical to running scheduler.run_sweep
+once per direction with seeding.chunk_generators(master_seed, chunks, chunk_size, stream=d).
+"""
+
+#Runs batch_size runs at every parameter array in param_arrs, for every direction in directions (a list of (methylatedpop, unmethylatedpop, SwitchDirection)).
+#If analyze is given, analyze(times) is called on the postprocessing thread for every finished (direction, point), with that point's switching times.
+#returns one (step_count, batch_size) array of switching times per direction, the analyze results as analyses[direction][step] (None without analyze),
+#and chunk timings like scheduler.run_chunks, where the step column is direction * step_count + step
+def run_twoway_sweep(param_arrs, totalpop, directions, batch_size, trial_max_length, chunk_size=250, workers=None, master_seed=None, engine="compiled", analyze=None):
+    if master_seed is None:
+        master_seed = seeding.new_master_seed()
+    step_count = len(param_arrs)
+    point_chunks = scheduler.make_chunks(step_count, batch_size, chunk_size)
+    rngs = [seeding.chunk_generators(master_seed, point_chunks, chunk_size, stream) for stream in range(len(directions))]
+    rate_tables = scheduler.rate_tables_for(param_arrs, totalpop, engine)
+    #every direction's sweep is a block of step_count rows of one output array - row direction * step_count + step, which shares the point's rate table
+    combined_output = np.zeros(shape=(len(directions) * step_count, batch_size))
+    outputs = [combined_output[direction * step_count:(direction + 1) * step_count] for direction in range(len(directions))]
+    row_directions = [start for start in directions for step in range(step_count)]
+    analyses = [[None] * step_count for _ in directions]
+
+    #the combined queue: (direction, index into point_chunks), going through the points in order and alternating directions within each point
+    chunks_per_point = len(point_chunks) // step_count
+    work = [(direction, step * chunks_per_point + offset) for step in range(step_count) for offset in range(chunks_per_point) for direction in range(len(directions))]
+    chunks = []
+    for direction, chunk_index in work:
+        step, start, stop = point_chunks[chunk_index]
+        chunks.append((direction * step_count + step, start, stop))
+    remaining = np.full((len(directions), step_count), chunks_per_point)
+    remaining_lock = threading.Lock()
+
+    def analyze_point(direction, step):
+        analyses[direction][step] = analyze(outputs[direction][step])
+
+    with ThreadPoolExecutor(max_workers=1) as postprocessing:
+        analysis_futures = []
+
+        #hands a (direction, point) to the postprocessing thread once its last chunk is done
+        def on_chunk_done(work_index):
+            direction, step = divmod(chunks[work_index][0], step_count)
+            with remaining_lock:
+                remaining[direction, step] -= 1
+                point_done = remaining[direction, step] == 0
+            if point_done and analyze is not None:
+                analysis_futures.append(postprocessing.submit(analyze_point, direction, step))
+
+        chunk_timings = scheduler.run_chunks(chunks, rate_tables * len(directions), combined_output, trial_max_length, totalpop, None, None, None,
+                                             [rngs[direction][chunk_index] for direction, chunk_index in work], workers, engine, on_chunk_done, row_directions)
+        for future in analysis_futures:
+            future.result()
+    return outputs, analyses, chunk_timings
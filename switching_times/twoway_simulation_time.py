@@ -1,10 +1,14 @@
+import warnings
 import numpy as np
-import gillespie_time as gillespie_time
 import matplotlib.pyplot as plt
-import scipy.stats as stats
-import numba
-import statistics
-from numba import prange
+import scheduler
+import seeding
+import adaptive
+import result_store
+import checkpoint
+import twoway
+import fitting
+import bootstrap
 
 """
 Performs many gillespie runs at once, in both directions, to get information about the time 
@@ -35,6 +39,50 @@ batch_size = 5000
 trial_max_length = 10000
 #define starting population - the starting counts of methylated/unmethylated are further down in the file
 totalpop = 100
+#runs are handed out to the worker threads in chunks of this size - smaller chunks balance better, larger ones have less overhead
+chunk_size = 250
+#number of worker threads (None uses every core)
+workers = None
+#master seed for the random number generators - leave as None for a new one, or set it to a printed seed to reproduce a sweep
+master_seed = None
+#sequential stopping - set target_rel_ci to stop each sweep point once the 95% confidence interval of its estimate is narrow enough
+#(e.g. 0.05 stops at +-5% of the estimate). batch_size then becomes the maximum number of runs per point, added adaptive_increment at a time
+target_rel_ci = None
+adaptive_metric = "mean" #"mean" for the mean switching time, "exponential" for the exponential parameter
+adaptive_increment = 500 #must be a multiple of chunk_size
+#simulation engine - "compiled" runs each chunk one run at a time in the numba kernel, "lockstep" advances all of a chunk's runs together
+#(see lockstep.py), which is usually faster.
+#"tauleap" leaps over many events at a time, for large totalpop (thousands of sites or more) - add the accuracy after a colon,
+#e.g. "tauleap:0.01" (smaller is more accurate, the default is 0.03). See gillespie_time.GillespieTauLeapFun and benchmark_tau_leap.py
+engine = "compiled"
+#result store - set store_dir to a directory to save the switching times of every point there, and reuse them in later sweeps
+#(only points that are missing or need more runs get simulated). Points are only reused with the same master_seed, so set master_seed too.
+#the store is used for fixed batches, not for sequential stopping
+store_dir = None
+#checkpointing - set checkpoint_path to a file name to save the finished runs every checkpoint_seconds. If the program is stopped,
+#running it again with the same checkpoint_path only runs what is left (with the seed saved there), and gives the same results - see checkpoint.py
+#the two switching directions are saved to checkpoint_path + ".MtoU" and checkpoint_path + ".UtoM". Checkpointing and the result store can't be used together
+checkpoint_path = None
+checkpoint_seconds = 60
+#the starting populations for the two directions are set further down (search for `edit here`) -
+#to set them from here or from a run config instead, give them as [methylated, unmethylated]
+MtoU_start = None
+UtoM_start = None
+#run both directions at once as one workload, analysing each point while the rest are still simulating (see twoway.py)
+#the results are the same as running them one after the other. Sequential stopping, checkpointing and the result store always run one direction at a time
+combined_directions = True
+#bootstrap confidence intervals - set bootstrap_replicates to give the exponential parameter and time-out curves a shaded percentile interval
+#from that many bootstrap resamples of each point (e.g. 1000). 0 turns them off
+bootstrap_replicates = 0
+bootstrap_confidence = 0.95
+#-----------run config-----------
+#when this program is started by run.py, the values from the run config file replace the ones above (see run.py)
+#only the names in the parameters block can be set
+parameter_names = ("param_begin_val", "param_end_val", "step_count", "param_to_change", "batch_size", "trial_max_length", "totalpop", "chunk_size",
+                   "workers", "master_seed", "target_rel_ci", "adaptive_metric", "adaptive_increment", "engine", "store_dir", "checkpoint_path",
+                   "checkpoint_seconds", "MtoU_start", "UtoM_start", "combined_directions", "bootstrap_replicates", "bootstrap_confidence")
+if "RUN_CONFIG" in globals():
+    globals().update(RUN_CONFIG.parameters(parameter_names))
 #-----------Rates Dictionary---------
 default_parameters = {"r_hm": 0.5,          #0
                       "r_hm_m": 20/totalpop, #1
@@ -51,6 +99,10 @@ default_parameters = {"r_hm": 0.5,          #0
                       "birth_rate": 1         #12
 }
 
+#rates from the run config replace the defaults above
+if "RUN_CONFIG" in globals():
+    default_parameters.update(RUN_CONFIG.rates(default_parameters))
+
 #This dictionary just matches each parameter to its place in the list.
 default_indices = {
     "r_hm": 0,          
@@ -82,118 +134,141 @@ step_size = round((param_end_val-param_begin_val)/(step_count-1), 5)
 # step_array = step_count
 
 #-----------simulation-----------
-@numba.jit(nopython=True, parallel=True)
 def main(rngs,SwitchDirection,methylatedpop, unmethylatedpop):
-    output_array = np.zeros(shape=(step_count, batch_size))
-    #this loop runs in parallel because it uses prange() instead of range() - keep this in mind when debugging it!
-    for step in prange(step_count):
+    param_arrs = []
+    for step in range(step_count):
         #make a copy of the default parameters, change the parameter we want to study
         temp_arr = default_arr.copy()
         temp_arr[index_to_change] = param_begin_val + (step*step_size)
         print("Testing parameters: ", temp_arr)
+        param_arrs.append(temp_arr)
+
+    #run a batch of identical gillespie algorithms for every set of parameters, store the results in output_array[step]
+    #the runs are split into chunks that are handed out to the worker threads as they become free - see scheduler.py
+    #each direction gets its own random stream
+    stream = 0 if SwitchDirection == -1 else 1
+    if target_rel_ci is None:
+        if checkpoint_path is not None:
+            #save the finished runs as we go, and pick up from the last checkpoint if there is one
+            output_array, chunk_timings = checkpoint.run_checkpointed_sweep(checkpoint_path + (".MtoU" if SwitchDirection == -1 else ".UtoM"), param_arrs, totalpop, methylatedpop, unmethylatedpop, SwitchDirection, batch_size, trial_max_length,
+                                                                         chunk_size, workers, master_seed, stream, engine, checkpoint_seconds)
+        elif store_dir is None:
+            output_array, chunk_timings = scheduler.run_sweep(param_arrs, totalpop, methylatedpop, unmethylatedpop, SwitchDirection, batch_size, trial_max_length, chunk_size, workers, rngs, engine)
+        else:
+            #load what we can from the result store, and only simulate the rest - see result_store.py
+            output_array, chunk_timings = result_store.run_cached_sweep(store_dir, param_arrs, totalpop, methylatedpop, unmethylatedpop, SwitchDirection, batch_size, trial_max_length,
+                                                                        chunk_size, workers, master_seed, stream, engine)
+        if len(chunk_timings) > 0:
+            scheduler.print_timing_report(chunk_timings, step_count)
+        run_counts = np.full(step_count, batch_size)
+    else:
+        #keep adding runs to each point until its estimate is precise enough - see adaptive.py
+        output_array, run_counts, half_widths = adaptive.run_adaptive_sweep(param_arrs, totalpop, methylatedpop, unmethylatedpop, SwitchDirection, trial_max_length, target_rel_ci,
+                                                                            batch_size, adaptive_increment, adaptive_metric, 0.95, chunk_size, workers, master_seed, stream, engine)
+    return output_array, run_counts
 
-        #run a batch of identical gillespie algorithms, store the results in output_array[step]
-        for i in range(batch_size):
-            output_array[step][i] = gillespie_time.GillespieSwitchFun(trial_max_length, temp_arr, totalpop, methylatedpop, unmethylatedpop, SwitchDirection,rngs[step])
-    return output_array
-
-#-----------setup - METHYLATED TO UNMETHYLATED-----------
-#generate the arrays for our output - None (or null value) is the default
-exponential_parameters_MtoU = [None] * step_count
-gamma_shape_MtoU = [None] * step_count
-gamma_location_MtoU = [None] * step_count
-gamma_scale_MtoU = [None] * step_count
-exponential_KS_MtoU = [None] * step_count
-gamma_KS_MtoU = [None] * step_count
-timeouts_MtoU = [0] * step_count
-empirical_mean_MtoU = [None] * step_count
+#-----------postprocessing-----------
+#fits the switching times of one sweep point - returns the scaled time-outs, the exponential parameter, the empirical mean and the exponential KS error
+#(the last three are None if more than half of the runs timed out)
+def analyze_point(times):
+    #fit the point's switching times in one go - see fitting.py
+    fits = fitting.fit_sweep(times[None, :], workers=1)
+    raw_timeouts = int(fits["timeouts"][0])
+    result = {"timeouts": 10*(raw_timeouts/len(times)), #scale the timeouts to fit with the other info on the graph
+              "raw_timeouts": raw_timeouts, "exponential_parameter": None, "empirical_mean": None, "exponential_KS": None}
+    #parameters are only guessed if less than half our simulations timed out
+    if not np.isnan(fits["exponential_parameter"][0]):
+        result["exponential_parameter"] = fits["exponential_parameter"][0]
+        result["empirical_mean"] = fits["empirical_mean"][0]
+        #error of the exponential fit, from the Kolmogorov-Smirnov test
+        result["exponential_KS"] = 10 * fits["exponential_KS"][0]
+    return result
+
+#-----------setup-----------
+#a checkpointed sweep doesn't read or write the result store, so the two can't be used together
+if checkpoint_path is not None and store_dir is not None:
+    raise ValueError("checkpoint_path and store_dir can't both be set - a checkpointed sweep doesn't use the result store")
 #list comprehension that creates an array of the values we tested for our chosen parameter
+#TODO: add offset of initial size
 step_array = [step_size * i for i in range(step_count)]
 
-#create an array of random number generators that we will pass into our function
-#this makes it easier to reproduce, and also keeps Numba happy.
-generators = [None]*step_count
-for i in range(step_count):
-    generators[i] = np.random.default_rng()
+#each chunk of runs gets its own independent random number generator, all derived from one master seed - see seeding.py
+#the two switching directions use separate streams (0 and 1) so they don't reuse the same random numbers
+#a sweep that is being resumed keeps the seed saved in its checkpoint
+if master_seed is None and checkpoint_path is not None:
+    master_seed = checkpoint.saved_master_seed(checkpoint_path + ".MtoU")
+#stored points are keyed by the master seed, so a new seed never finds anything in the store
+if master_seed is None and store_dir is not None:
+    warnings.warn("store_dir is set but master_seed is not - a new master seed is drawn, so no stored points will be reused. Set master_seed to reuse them.")
+if master_seed is None:
+    master_seed = seeding.new_master_seed()
+print("Master seed: ", master_seed)
+chunks = scheduler.make_chunks(step_count, batch_size, chunk_size)
 
 #-----------parameters - edit here - METHYLATED TO UNMETHYLATED-----------
 methylatedpop = 71
 unmethylatedpop = 13
-
-#-----------Call simulation-----------
-SwitchDirection = -1
-output = main(generators,-1,methylatedpop, unmethylatedpop)
-
-#-----------postprocessing-----------
-
-#go through the output row-by-row and find the exponential parameters
-for step in range(step_count):
-    #this list comprehension makes an array of all the positive values in a given row of output_array
-    valid_array = [output[step][index] for index in range(batch_size) if output[step][index] >= 0]
-    #this list comprehension counts up all the negative (meaning timed out) values
-    raw_timeouts = batch_size - len(valid_array)
-    timeouts_MtoU[step] = 10*(raw_timeouts/batch_size) #scale the timeouts to fit with the other info on the graph
-
-    #guess parameters only if less than half our simulations timed out
-    if len(valid_array) > batch_size/2:
-        #fit distributions to the data
-        exponential_parameters_MtoU[step] = stats.expon.fit(valid_array,floc=0)[1]
-
-        empirical_mean_MtoU[step] = statistics.fmean(valid_array)
-
-        #calculate error for parameters with Kolmogorov-Smirnov test
-        exponential_KS_MtoU[step] = 10 * (stats.kstest(valid_array, 'expon', args=(0,exponential_parameters_MtoU[step]), N=len(valid_array)).statistic)
-        print(exponential_KS_MtoU[step])
-    print("timed-out simulations: " + str(raw_timeouts) + " out of " + str(batch_size))
-    print('exponential paramater MtoU = ' + str(exponential_parameters_MtoU[step]))
-
+#MtoU_start (from the parameters block or a run config) replaces this starting population if it is set
+if MtoU_start is not None:
+    methylatedpop, unmethylatedpop = MtoU_start
+MtoU_direction = (methylatedpop, unmethylatedpop, -1)
 
 #-----------parameters - edit here - UNMETHYLATED TO METHYLATED-----------
 
 methylatedpop = 4
 unmethylatedpop = 72
+#UtoM_start (from the parameters block or a run config) replaces this starting population if it is set
+if UtoM_start is not None:
+    methylatedpop, unmethylatedpop = UtoM_start
+UtoM_direction = (methylatedpop, unmethylatedpop, 1)
 
-#-----------call simulation-----------
-SwitchDirection = 1
-output = main(generators,1,methylatedpop, unmethylatedpop)
+#-----------Call simulation-----------
+if combined_directions and target_rel_ci is None and checkpoint_path is None and store_dir is None:
+    #both directions share one pool of workers and one rate table per point, and each point is analysed as soon as it finishes - see twoway.py
+    param_arrs = []
+    for step in range(step_count):
+        temp_arr = default_arr.copy()
+        temp_arr[index_to_change] = param_begin_val + (step*step_size)
+        print("Testing parameters: ", temp_arr)
+        param_arrs.append(temp_arr)
+    outputs, (analyses_MtoU, analyses_UtoM), chunk_timings = twoway.run_twoway_sweep(param_arrs, totalpop, [MtoU_direction, UtoM_direction], batch_size, trial_max_length,
+                                                                                      chunk_size, workers, master_seed, engine, analyze_point)
+    scheduler.print_timing_report(chunk_timings, 2 * step_count)
+    output_MtoU, output_UtoM = outputs
+    run_counts_MtoU = run_counts_UtoM = np.full(step_count, batch_size)
+else:
+    #one direction after the other
+    output_MtoU, run_counts_MtoU = main(seeding.chunk_generators(master_seed, chunks, chunk_size, stream=0), -1, MtoU_direction[0], MtoU_direction[1])
+    analyses_MtoU = [analyze_point(output_MtoU[step][:run_counts_MtoU[step]]) for step in range(step_count)]
+    output_UtoM, run_counts_UtoM = main(seeding.chunk_generators(master_seed, chunks, chunk_size, stream=1), 1, UtoM_direction[0], UtoM_direction[1])
+    analyses_UtoM = [analyze_point(output_UtoM[step][:run_counts_UtoM[step]]) for step in range(step_count)]
 
 #generate the arrays for our output - None (or null value) is the default
-exponential_parameters_UtoM = [None] * step_count
-gamma_shape_UtoM = [None] * step_count
-gamma_location_UtoM = [None] * step_count
-gamma_scale_UtoM = [None] * step_count
-exponential_KS_UtoM = [None] * step_count
-gamma_KS_UtoM = [None] * step_count
-normal_KS_UtoM = [None] * step_count
-normal_sd_UtoM = [None] * step_count
-normal_mean_UtoM = [None] * step_count
-timeouts_UtoM = [0] * step_count
-empirical_mean_UtoM = [None] * step_count
-#list comprehension that creates an array of the values we tested for our chosen parameter
-#TODO: add offset of initial size
-step_array = [step_size * i for i in range(step_count)]
-
+exponential_parameters_MtoU = [analysis["exponential_parameter"] for analysis in analyses_MtoU]
+exponential_KS_MtoU = [analysis["exponential_KS"] for analysis in analyses_MtoU]
+timeouts_MtoU = [analysis["timeouts"] for analysis in analyses_MtoU]
+empirical_mean_MtoU = [analysis["empirical_mean"] for analysis in analyses_MtoU]
+exponential_parameters_UtoM = [analysis["exponential_parameter"] for analysis in analyses_UtoM]
+exponential_KS_UtoM = [analysis["exponential_KS"] for analysis in analyses_UtoM]
+timeouts_UtoM = [analysis["timeouts"] for analysis in analyses_UtoM]
+empirical_mean_UtoM = [analysis["empirical_mean"] for analysis in analyses_UtoM]
+
+#confidence intervals from resampling the runs of every point, as (lower, upper) pairs of arrays - see bootstrap.py
+#each direction resamples with its own random stream
+exponential_parameters_MtoU_CI = timeouts_MtoU_CI = exponential_parameters_UtoM_CI = timeouts_UtoM_CI = (np.full(step_count, np.nan), np.full(step_count, np.nan))
+if bootstrap_replicates > 0:
+    intervals_MtoU = bootstrap.bootstrap_sweep(output_MtoU, run_counts_MtoU, bootstrap_replicates, bootstrap_confidence, master_seed, 0, workers)
+    intervals_UtoM = bootstrap.bootstrap_sweep(output_UtoM, run_counts_UtoM, bootstrap_replicates, bootstrap_confidence, master_seed, 1, workers)
+    exponential_parameters_MtoU_CI = intervals_MtoU["exponential_parameter"]
+    timeouts_MtoU_CI = [10 * bound for bound in intervals_MtoU["timeout_fraction"]]
+    exponential_parameters_UtoM_CI = intervals_UtoM["exponential_parameter"]
+    timeouts_UtoM_CI = [10 * bound for bound in intervals_UtoM["timeout_fraction"]]
 
 for step in range(step_count):
-    #this list comprehension makes an array of all the positive values in a given row of output_array
-    valid_array = [output[step][index] for index in range(batch_size) if output[step][index] >= 0]
-    #this list comprehension counts up all the negative (meaning timed out) values
-    raw_timeouts = batch_size - len(valid_array)
-    timeouts_UtoM[step] = 10*(raw_timeouts/batch_size) #scale the timeouts to fit with the other info on the graph
-
-    #guess parameters only if less than half our simulations timed out
-    if len(valid_array) > batch_size/2:
-        #fit distributions to the data
-        exponential_parameters_UtoM[step] = stats.expon.fit(valid_array,floc=0)[1]
-
-        empirical_mean_UtoM[step] = statistics.fmean(valid_array)
-
-        #calculate error for parameters with Kolmogorov-Smirnov test
-        #TODO: add args for expon
-        exponential_KS_UtoM[step] = 10 * (stats.kstest(valid_array, 'expon', N=len(valid_array), args=(0,exponential_parameters_UtoM[step])).statistic)
-        print(exponential_KS_MtoU[step])
-
-    print("timed-out simulations: " + str(raw_timeouts) + " out of " + str(batch_size))
+    print("timed-out simulations: " + str(analyses_MtoU[step]["raw_timeouts"]) + " out of " + str(run_counts_MtoU[step]))
+    print('exponential paramater MtoU = ' + str(exponential_parameters_MtoU[step]))
+for step in range(step_count):
+    print("timed-out simulations: " + str(analyses_UtoM[step]["raw_timeouts"]) + " out of " + str(run_counts_UtoM[step]))
     print('exponential paramater UtoM= ' + str(exponential_parameters_UtoM[step]))
 
 #-----------graphing-----------
@@ -201,16 +276,24 @@ for step in range(step_count):
 plt.close()
 final_label = "Two-way switching directions with Population = 100"
 run_stats = "Batches of " + str(batch_size) + ", running for maximum of " + str(trial_max_length) + " steps each"
+if target_rel_ci is not None:
+    run_stats = "Up to " + str(batch_size) + " runs per point (stopping at +-" + str(target_rel_ci) + " relative CI), running for maximum of " + str(trial_max_length) + " steps each"
+if bootstrap_replicates > 0:
+    run_stats = run_stats + ", shaded: " + str(round(100 * bootstrap_confidence)) + "% CI"
 
 #MtoU
 plt.plot(step_array, exponential_parameters_MtoU,label="exponential parameters")
+plt.fill_between(step_array, *exponential_parameters_MtoU_CI, alpha=0.2)
 plt.plot(step_array,timeouts_MtoU, label = "proportion timed out, scaled by 10x")
+plt.fill_between(step_array, *timeouts_MtoU_CI, alpha=0.2)
 plt.plot(step_array, exponential_KS_MtoU, label="Exponential KS error, scaled by 10x")
 # plt.plot(step_array, empirical_mean_MtoU, label='Empirical Mean',linestyle='none',marker='.')
 
 #UtoM
 plt.plot(step_array, exponential_parameters_UtoM,label="exponential parameters", linestyle='dashed')
+plt.fill_between(step_array, *exponential_parameters_UtoM_CI, alpha=0.2)
 plt.plot(step_array,timeouts_UtoM, label = "proportion timed out, scaled by 10x", linestyle='dashed')
+plt.fill_between(step_array, *timeouts_UtoM_CI, alpha=0.2)
 plt.plot(step_array, exponential_KS_UtoM, label="Exponential KS error, scaled by 10x", linestyle='dashed')
 # plt.plot(step_array, empirical_mean_UtoM, label='Empirical Mean', linestyle='none',marker='.')
 